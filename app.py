@@ -1,9 +1,9 @@
 """
 Главный файл Flask приложения для отслеживания котировок MOEX
 """
-from flask import Flask, render_template, jsonify, request, send_file, redirect, url_for, flash
+from flask import Flask, render_template, jsonify, request, send_file, redirect, url_for, flash, g
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from models.database import init_db, db_session
+from models.database import init_db, db_session, read_session, engine, read_engine
 from models.portfolio import Portfolio, InstrumentType
 from models.price_history import PriceHistory
 from models.transaction import Transaction, TransactionType
@@ -14,9 +14,31 @@ from models.settings import Settings
 from models.user import User
 from models.access_log import AccessLog
 from models.split_coefficient import SplitCoefficient
+from models.background_job import BackgroundJob
+from models.open_lot import OpenLot
+from models.portfolio_change import PortfolioChange
+from models.split_price_factor import SplitPriceFactor
+from models.corporate_action import CorporateAction
+from models.position_change import PositionChange
 from services.moex_service import MOEXService
 from services.price_logger import PriceLogger
 from services.currency_service import CurrencyService
+from services.job_runner import JobRunner
+from services.market_data_writer import MarketDataWriter
+from services.lot_ledger import LotLedger
+from services.cash_ledger import CashLedger
+from services.position_timeline import PositionTimeline, PositionTimelineLedger
+from services.portfolio_cache import PortfolioResponseCache
+from services.event_stream import PortfolioEventPublisher
+from services.valuation_engine import PortfolioValuationEngine, ValuationContext
+from services.split_index import SplitFactorIndex, SplitIndexCache
+from services.split_adjusted_prices import SplitAdjustedPrices
+from services.split_sync import SplitSync
+from services.transaction_importer import TransactionImporter
+from services.realized_pnl import RealizedPnLReport
+from services.data_export import StreamingExport
+from services.trading_calendar import TradingCalendar
+from services.scheduler_lock import SchedulerLock, default_lock_path
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from datetime import datetime, timedelta, date
@@ -24,6 +46,8 @@ import atexit
 import pytz
 import os
 import shutil
+import hashlib
+from collections import namedtuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 app = Flask(__name__)
@@ -111,107 +135,83 @@ def _normalize_ticker(value: str) -> str:
     return (value or '').strip().upper()
 
 
-def _get_split_coefficients_map(user_id: int, tickers):
-    """
-    Вернуть коэффициенты сплитов по тикерам:
-    {
-      'SBER': [{'effective_date': date(...), 'coefficient': 10.0}, ...]
-    }
-    """
-    if not user_id or not tickers:
-        return {}
-    normalized = sorted({_normalize_ticker(t) for t in tickers if t})
-    if not normalized:
-        return {}
+split_index_cache = SplitIndexCache()
 
-    rows = db_session.query(SplitCoefficient).filter(
-        SplitCoefficient.user_id == user_id,
-        SplitCoefficient.ticker.in_(normalized)
-    ).order_by(SplitCoefficient.ticker.asc(), SplitCoefficient.effective_date.asc(), SplitCoefficient.id.asc()).all()
-
-    result = {t: [] for t in normalized}
-    for r in rows:
-        ticker = _normalize_ticker(r.ticker)
-        result.setdefault(ticker, []).append({
-            'effective_date': r.effective_date,
-            'coefficient': float(r.coefficient or 1.0),
-        })
-    return result
 
-
-def get_adjusted_price_for_date(raw_price: float, price_dt: datetime, ticker: str, split_coeffs_map: dict) -> float:
+def _get_split_index(user_id: int, session=None) -> SplitFactorIndex:
     """
-    Приведение цены на дату к текущей шкале с учётом сплитов.
-    Для всех сплитов ПОСЛЕ даты цены: adjusted = raw * product(coeff).
-
-    Пример:
-      - если после даты был сплит 1:10, коэффициент = 0.1
-      - историческая цена 3180 станет 318
+    Индекс коэффициентов сплитов пользователя (все тикеры): даты и накопленные
+    произведения для bisect. Кэшируется в памяти процесса и пересобирается,
+    когда коэффициенты пользователя меняются.
+    session — сессия для запроса (по умолчанию db_session)
     """
-    if raw_price is None:
-        return None
-
-    ticker_norm = _normalize_ticker(ticker)
-    coeffs = split_coeffs_map.get(ticker_norm, []) if split_coeffs_map else []
-    if not coeffs:
-        return raw_price
+    return split_index_cache.get(user_id, session or db_session)
 
-    if isinstance(price_dt, datetime):
-        price_date = price_dt.date()
-    else:
-        price_date = price_dt
-    if not price_date:
-        return raw_price
-
-    factor = 1.0
-    for c in coeffs:
-        eff_date = c.get('effective_date')
-        if isinstance(eff_date, str):
-            try:
-                eff_date = datetime.strptime(eff_date, '%Y-%m-%d').date()
-            except Exception:
-                eff_date = None
-        coeff = float(c.get('coefficient') or 1.0)
-        if eff_date and eff_date >= price_date and coeff > 0:
-            factor *= coeff
 
-    if factor <= 0:
-        return raw_price
-    return raw_price * factor
-
-
-def _get_cumulative_split_factor_until(ticker: str, dt_obj, split_coeffs_map: dict) -> float:
+def _get_cumulative_split_factor_until(ticker: str, dt_obj, split_index: SplitFactorIndex) -> float:
     """
     Накопленный коэффициент сплитов на дату (включительно).
     Используется для пересчета количества и цен в текущей шкале:
       quantity_adj = quantity / factor
       price_adj = price * factor
     """
-    ticker_norm = _normalize_ticker(ticker)
-    coeffs = split_coeffs_map.get(ticker_norm, []) if split_coeffs_map else []
-    if not coeffs:
+    if not split_index:
         return 1.0
+    return split_index.factor_until(ticker, dt_obj)
 
-    if isinstance(dt_obj, datetime):
-        target_date = dt_obj.date()
-    else:
-        target_date = dt_obj
-    if not target_date:
-        return 1.0
 
-    factor = 1.0
-    for c in coeffs:
-        eff_date = c.get('effective_date')
-        if isinstance(eff_date, str):
-            try:
-                eff_date = datetime.strptime(eff_date, '%Y-%m-%d').date()
-            except Exception:
-                eff_date = None
-        coeff = float(c.get('coefficient') or 1.0)
-        if eff_date and eff_date <= target_date and coeff > 0:
-            factor *= coeff
+# Лёгкая запись истории цен (вместо ORM-объекта PriceHistory) для оценки портфеля
+_HistoryEntry = namedtuple('_HistoryEntry', 'ticker price logged_at')
+
+
+def _get_price_history_baselines(tickers, period_start: datetime = None, session=None) -> dict:
+    """
+    Базовые записи истории цен для всех тикеров одним запросом (оконные функции):
+    {
+      'SBER': {'latest': _HistoryEntry, 'period_oldest': _HistoryEntry | None}
+    }
+    latest — самая свежая запись тикера;
+    period_oldest — самая старая запись начиная с period_start (если period_start задан).
+    session — сессия для запроса (по умолчанию db_session)
+    """
+    if not tickers:
+        return {}
+    session = session or db_session
+    from sqlalchemy import func, or_, and_, literal
+
+    in_period = PriceHistory.logged_at >= period_start if period_start is not None else literal(False)
+    ranked = session.query(
+        PriceHistory.ticker,
+        PriceHistory.price,
+        PriceHistory.logged_at,
+        func.row_number().over(
+            partition_by=PriceHistory.ticker,
+            order_by=(PriceHistory.logged_at.desc(), PriceHistory.id.desc())
+        ).label('rn_latest'),
+        func.row_number().over(
+            partition_by=(PriceHistory.ticker, in_period),
+            order_by=(PriceHistory.logged_at.asc(), PriceHistory.id.asc())
+        ).label('rn_period'),
+        in_period.label('in_period')
+    ).filter(PriceHistory.ticker.in_(list(tickers))).subquery()
+
+    rows = session.query(
+        ranked.c.ticker, ranked.c.price, ranked.c.logged_at,
+        ranked.c.rn_latest, ranked.c.rn_period, ranked.c.in_period
+    ).filter(
+        or_(ranked.c.rn_latest == 1, and_(ranked.c.in_period, ranked.c.rn_period == 1))
+    ).all()
+
+    result = {}
+    for row in rows:
+        entry = _HistoryEntry(row.ticker, row.price, row.logged_at)
+        baseline = result.setdefault(row.ticker, {'latest': None, 'period_oldest': None})
+        if row.rn_latest == 1:
+            baseline['latest'] = entry
+        if row.in_period and row.rn_period == 1:
+            baseline['period_oldest'] = entry
+    return result
 
-    return factor if factor > 0 else 1.0
 
 def write_access_log(event: str, username: str = None, success: bool = True):
     """Записать событие доступа в базу данных."""
@@ -353,6 +353,9 @@ def migrate_portfolio_columns():
             conn.execute(text('ALTER TABLE cash_balance ADD COLUMN user_id INTEGER REFERENCES users(id)'))
             conn.execute(text('UPDATE cash_balance SET user_id = 1'))
             conn.commit()
+        if 'ledger_synced_at' not in cols:
+            conn.execute(text('ALTER TABLE cash_balance ADD COLUMN ledger_synced_at DATETIME'))
+            conn.commit()
 
         # --- ALTER TABLE для users: добавляем поля темы интерфейса ---
         cols = [row[1] for row in conn.execute(text('PRAGMA table_info(users)')).fetchall()]
@@ -362,8 +365,16 @@ def migrate_portfolio_columns():
             conn.execute(text("ALTER TABLE users ADD COLUMN theme_color_header_text VARCHAR(7)"))
         if 'theme_color_subtext' not in cols:
             conn.execute(text("ALTER TABLE users ADD COLUMN theme_color_subtext VARCHAR(7)"))
+        if 'portfolio_version' not in cols:
+            conn.execute(text("ALTER TABLE users ADD COLUMN portfolio_version INTEGER NOT NULL DEFAULT 0"))
         conn.commit()
 
+        # --- ALTER TABLE для background_jobs: процесс-владелец задачи ---
+        cols = [row[1] for row in conn.execute(text('PRAGMA table_info(background_jobs)')).fetchall()]
+        if cols and 'owner' not in cols:
+            conn.execute(text('ALTER TABLE background_jobs ADD COLUMN owner VARCHAR(100)'))
+            conn.commit()
+
         # --- Таблица коэффициентов сплитов ---
         conn.execute(text('''
             CREATE TABLE IF NOT EXISTS split_coefficients (
@@ -379,6 +390,35 @@ def migrate_portfolio_columns():
         conn.execute(text('CREATE INDEX IF NOT EXISTS idx_split_coefficients_effective_date ON split_coefficients(effective_date)'))
         conn.commit()
 
+        # --- Индекс для постраничной выдачи транзакций (ключ страницы — date, id) ---
+        conn.execute(text('CREATE INDEX IF NOT EXISTS idx_transactions_user_date_id ON transactions(user_id, date, id)'))
+        conn.commit()
+
+        # --- Составные индексы горячих запросов (проверка: scripts/check_query_plans.py) ---
+        # Операции тикера по порядку и история цен тикера за период раньше читались
+        # по одноколоночным индексам с досортировкой во временном B-дереве.
+        conn.execute(text('CREATE INDEX IF NOT EXISTS idx_transactions_user_ticker_date ON transactions(user_id, ticker, date, id)'))
+        conn.execute(text('CREATE INDEX IF NOT EXISTS idx_price_history_ticker_logged_at ON price_history(ticker, logged_at)'))
+        conn.commit()
+
+        # --- Дубликаты позиций портфеля (тикер в разном регистре) ---
+        # Раньше их удалял GET /api/portfolio при каждом чтении. Оставляем первую запись
+        # каждого тикера и закрепляем это уникальным индексом без учёта регистра
+        # (UNIQUE(ticker, user_id) регистр учитывает).
+        has_index = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'uq_portfolio_user_ticker_upper'"
+        )).first()
+        if not has_index:
+            deleted = conn.execute(text('''
+                DELETE FROM portfolio WHERE id NOT IN (
+                    SELECT MIN(id) FROM portfolio GROUP BY user_id, UPPER(ticker)
+                )
+            ''')).rowcount
+            if deleted:
+                print(f"Миграция: удалено дубликатов позиций портфеля: {deleted}")
+            conn.execute(text('CREATE UNIQUE INDEX uq_portfolio_user_ticker_upper ON portfolio(user_id, UPPER(ticker))'))
+            conn.commit()
+
 migrate_portfolio_columns()
 
 
@@ -432,13 +472,84 @@ def init_cash_balance():
 
 init_cash_balance()
 
+lot_ledger = LotLedger()
+cash_ledger = CashLedger()
+position_timeline = PositionTimelineLedger()
+transaction_importer = TransactionImporter(lot_ledger, cash_ledger, position_timeline)
+
+# Заполнение таблицы открытых лотов (open_lots) для существующих транзакций
+def init_open_lots():
+    """Однократно строит open_lots, если таблица пуста, а транзакции уже есть"""
+    if db_session.query(OpenLot.id).first() or not db_session.query(Transaction.id).first():
+        return
+    count = lot_ledger.rebuild_all()
+    print(f"Открытые лоты построены по транзакциям: {count} тикеров")
+
+init_open_lots()
+
+# Перевод балансов свободных денег на журнал движения денег (CashLedger)
+def init_cash_ledger():
+    """Пересчитывает по транзакциям балансы, которые ещё ни разу не считал журнал"""
+    legacy = db_session.query(CashBalance.user_id, CashBalance.balance).filter(
+        CashBalance.ledger_synced_at.is_(None)
+    ).all()
+    for user_id, old_balance in legacy:
+        new_balance = cash_ledger.rebuild(user_id, commit=False)
+        if abs(new_balance - (old_balance or 0.0)) > CashLedger.TOLERANCE:
+            print(f"Баланс пользователя {user_id} пересчитан по журналу транзакций: {old_balance:.2f} -> {new_balance:.2f}")
+    db_session.commit()
+
+init_cash_ledger()
+
+# Заполнение истории позиций (position_changes) для существующих транзакций
+def init_position_timeline():
+    """Однократно строит position_changes, если таблица пуста, а транзакции уже есть"""
+    if db_session.query(PositionChange.id).first() or not db_session.query(Transaction.id).first():
+        return
+    count = position_timeline.rebuild_all()
+    print(f"История позиций построена по транзакциям: {count} тикеров")
+
+init_position_timeline()
+
+# Множители сплитов для истории цен (split_price_factors)
+def init_split_adjusted_prices():
+    """Строит множители, если таблица пуста, а коэффициенты сплитов уже есть"""
+    if db_session.query(SplitPriceFactor.id).first() or not db_session.query(SplitCoefficient.id).first():
+        return
+    count = SplitAdjustedPrices().rebuild_all()
+    print(f"Множители сплитов построены для записей истории цен: {count}")
+
+init_split_adjusted_prices()
+
 # Инициализация сервисов
 moex_service = MOEXService()
 currency_service = CurrencyService()
-price_logger = PriceLogger(moex_service)
+split_adjusted_prices = SplitAdjustedPrices()
+price_logger = PriceLogger(moex_service, split_adjusted_prices)
+split_sync = SplitSync(moex_service, split_adjusted_prices, split_index_cache)
+trading_calendar = TradingCalendar(moex_service)
+job_runner = JobRunner()
+market_data_writer = MarketDataWriter()
+portfolio_response_cache = PortfolioResponseCache()
+realized_pnl_cache = PortfolioResponseCache(max_entries=64)
+portfolio_events = PortfolioEventPublisher()
+
+# Режим работы планировщика (переменная окружения SCHEDULER_MODE):
+#   embedded   — (по умолчанию) планировщик запускается в веб-воркере, который первым
+#                захватит файловую блокировку; остальные воркеры gunicorn его не запускают
+#   external   — веб-воркеры планировщик не запускают вообще, его выполняет
+#                отдельный процесс scheduler_worker.py
+#   standalone — выставляется самим scheduler_worker.py
+SCHEDULER_MODE = os.environ.get('SCHEDULER_MODE', 'embedded')
+
+# Незавершённые задачи, процесс-владелец которых завершился, помечаем прерванными.
+# Задачи живых процессов (других воркеров, планировщика) не трогаются,
+# поэтому проверка безопасна в любом процессе, импортирующем приложение.
+job_runner.recover_interrupted()
 
 # Инициализация планировщика задач
 scheduler = BackgroundScheduler(timezone=pytz.timezone('Europe/Moscow'))
+scheduler_leader_lock = SchedulerLock(default_lock_path(str(engine.url)))
 
 # Функции для работы с настройками времени логирования
 def get_logging_time():
@@ -451,8 +562,12 @@ def get_logging_time():
         print(f"[{datetime.now(pytz.timezone('Europe/Moscow'))}] Ошибка получения настроек: {e}")
     return 0, 0  # По умолчанию 00:00
 
+# Время, на которое сейчас запланирована задача daily_price_logging в этом процессе
+_scheduled_logging_time = None
+
 def update_scheduler_time():
     """Обновляет время задачи планировщика из настроек"""
+    global _scheduled_logging_time
     hour, minute = get_logging_time()
     try:
         # Обновляем существующую задачу или создаем новую
@@ -461,16 +576,37 @@ def update_scheduler_time():
                 'daily_price_logging',
                 trigger=CronTrigger(hour=hour, minute=minute, timezone='Europe/Moscow')
             )
+            _scheduled_logging_time = (hour, minute)
             print(f"[{datetime.now(pytz.timezone('Europe/Moscow'))}] Время логирования обновлено: {hour:02d}:{minute:02d} МСК")
+        else:
+            # Планировщик работает в другом процессе — он подхватит новое время через sync_logging_time
+            print(f"[{datetime.now(pytz.timezone('Europe/Moscow'))}] Время логирования сохранено: {hour:02d}:{minute:02d} МСК (применит процесс планировщика)")
     except Exception as e:
         print(f"[{datetime.now(pytz.timezone('Europe/Moscow'))}] Ошибка обновления времени планировщика: {e}")
 
+def scheduled_price_logging():
+    """
+    Плановое логирование цен с учётом календаря торгов MOEX.
+    В дни без торговой сессии цены на бирже не меняются: вместо запросов к ISS
+    переносим последние залогированные цены на сегодня.
+    """
+    today = datetime.now(_MOSCOW_TZ).date()
+    # Календарь загружается только здесь и в ежемесячной задаче, не в веб-запросах
+    trading_calendar.refresh_if_stale()
+    if not trading_calendar.has_session_for(today):
+        print(f"[{datetime.now(_MOSCOW_TZ)}] {today} — нет торговой сессии, запросы к MOEX не выполняются")
+        price_logger.carry_forward_last_prices()
+        return
+    price_logger.log_all_prices(force=False)
+
 # Добавляем задачу логирования цен с настраиваемым временем
 def setup_daily_logging_job():
     """Настраивает задачу ежедневного логирования с временем из настроек"""
+    global _scheduled_logging_time
     hour, minute = get_logging_time()
+    _scheduled_logging_time = (hour, minute)
     scheduler.add_job(
-        func=price_logger.log_all_prices,
+        func=scheduled_price_logging,
         trigger=CronTrigger(hour=hour, minute=minute, timezone='Europe/Moscow'),
         id='daily_price_logging',
         name=f'Ежедневное логирование цен в {hour:02d}:{minute:02d} МСК',
@@ -479,12 +615,30 @@ def setup_daily_logging_job():
 
 setup_daily_logging_job()
 
-# Добавляем периодическую проверку в 6, 12, 17, 21 час, если записи за сегодня нет
+def sync_logging_time():
+    """
+    Подхватывает время логирования, изменённое через API в другом процессе.
+    При нескольких воркерах запрос /api/settings/logging-time может попасть
+    не в тот процесс, где работает планировщик.
+    """
+    try:
+        if get_logging_time() != _scheduled_logging_time:
+            update_scheduler_time()
+    finally:
+        # Не держим Settings в identity map потока планировщика — иначе не увидим изменений
+        db_session.remove()
+
+scheduler.add_job(
+    func=sync_logging_time,
+    trigger=CronTrigger(minute='*/5', timezone='Europe/Moscow'),
+    id='logging_time_sync',
+    name='Синхронизация времени логирования с настройками',
+    replace_existing=True
+)
+
+# Добавляем периодическую проверку в 6, 12, 17, 21 час: дозаписываем тикеры без записи за сегодня
 def check_and_log_prices():
-    """Проверяет, есть ли записи за сегодня, и если нет - логирует цены"""
-    from datetime import date, timedelta
-    from models.price_history import PriceHistory
-    
+    """Проверяет, для каких тикеров нет записей за сегодня, и дозаписывает только их"""
     now_moscow = datetime.now(pytz.timezone('Europe/Moscow'))
 
     # В установленное время отдельная задача daily_price_logging сама пишет цены.
@@ -504,40 +658,115 @@ def check_and_log_prices():
     if current_hour == logging_hour and abs(current_minute - logging_minute) <= 1:
         print(f"[{now_moscow}] Периодическая проверка пропущена (сработает ежедневное логирование в {logging_hour:02d}:{logging_minute:02d})")
         return
-    today_start = now_moscow.replace(hour=0, minute=0, second=0, microsecond=0)
-    today_end = today_start + timedelta(days=1)
-    
-    # Проверяем, есть ли хотя бы одна запись за сегодня
-    has_logs_today = db_session.query(PriceHistory).filter(
-        PriceHistory.logged_at >= today_start,
-        PriceHistory.logged_at < today_end
-    ).first()
-    
-    if not has_logs_today:
-        print(f"[{datetime.now(pytz.timezone('Europe/Moscow'))}] Записей за сегодня нет, выполняем логирование цен...")
-        price_logger.log_all_prices(force=False)
+    # Дозаписываем только тикеры, для которых за сегодня ещё нет записи
+    # (например, MOEX не ответил по ним во время основного запуска)
+    missing_tickers = price_logger.get_missing_tickers_today()
+
+    if missing_tickers:
+        print(f"[{datetime.now(pytz.timezone('Europe/Moscow'))}] Нет записей за сегодня для {len(missing_tickers)} тикеров ({', '.join(missing_tickers)}), выполняем логирование цен...")
+        scheduled_price_logging()
     else:
-        print(f"[{datetime.now(pytz.timezone('Europe/Moscow'))}] Записи за сегодня уже есть, пропускаем периодическое логирование")
+        print(f"[{datetime.now(pytz.timezone('Europe/Moscow'))}] Записи за сегодня есть для всех тикеров, пропускаем периодическое логирование")
 
 scheduler.add_job(
     func=check_and_log_prices,
     trigger=CronTrigger(hour='6,12,17,21', minute=0, timezone='Europe/Moscow'),  # В 6, 12, 17, 21 час
     id='periodic_price_logging',
-    name='Периодическое логирование цен (в 6, 12, 17, 21 час, если записи нет)',
+    name='Периодическое логирование цен (в 6, 12, 17, 21 час, для тикеров без записи за сегодня)',
+    replace_existing=True
+)
+
+# Календарь торгов обновляем раз в месяц (между обновлениями он хранится в таблице trading_days)
+scheduler.add_job(
+    func=trading_calendar.refresh,
+    trigger=CronTrigger(day=1, hour=5, minute=0, timezone='Europe/Moscow'),
+    id='trading_calendar_refresh',
+    name='Ежемесячное обновление календаря торгов MOEX',
+    replace_existing=True
+)
+
+def verify_cash_ledger():
+    """Сверка сохранённых балансов свободных денег с журналом движения денег"""
+    try:
+        problems = cash_ledger.verify()
+        if not problems:
+            print(f"[{datetime.now(_MOSCOW_TZ)}] Сверка баланса свободных денег: расхождений нет")
+        for p in problems:
+            print(f"[{datetime.now(_MOSCOW_TZ)}] Сверка баланса: пользователь {p['user_id']} — сохранено "
+                  f"{p['stored']:.2f}, по журналу {p['expected']:.2f}, неверных снимков {p['bad_snapshots']}")
+        return problems
+    finally:
+        read_session.remove()
+
+# Ночная сверка баланса с журналом (расхождения только пишутся в лог;
+# исправление — scripts/verify_cash_ledger.py --fix)
+scheduler.add_job(
+    func=verify_cash_ledger,
+    trigger=CronTrigger(hour=4, minute=30, timezone='Europe/Moscow'),
+    id='cash_ledger_verify',
+    name='Ежедневная сверка баланса свободных денег с журналом',
+    replace_existing=True
+)
+
+# Сплиты из ISS: SPLIT_SYNC_AUTO_APPLY=1 — сразу добавлять коэффициенты пользователям,
+# иначе события только предлагаются в настройках (GET /api/split-coefficients/proposals)
+SPLIT_SYNC_AUTO_APPLY = os.environ.get('SPLIT_SYNC_AUTO_APPLY', '0') == '1'
+
+def sync_corporate_actions():
+    """Загрузка сплитов и консолидаций из ISS и (по настройке) добавление коэффициентов"""
+    try:
+        created, applied = split_sync.sync(auto_apply=SPLIT_SYNC_AUTO_APPLY)
+        print(f"[{datetime.now(_MOSCOW_TZ)}] Сплиты из ISS: новых событий {created}")
+        for user_id, rows in applied.items():
+            tickers = sorted({row.ticker for row in rows})
+            touch_portfolio_version(user_id, tickers)
+            print(f"[{datetime.now(_MOSCOW_TZ)}] Пользователю {user_id} добавлены коэффициенты сплитов: {', '.join(tickers)}")
+        return created
+    except Exception as e:
+        db_session.rollback()
+        print(f"[{datetime.now(_MOSCOW_TZ)}] Ошибка загрузки сплитов из ISS: {e}")
+    finally:
+        db_session.remove()
+
+scheduler.add_job(
+    func=sync_corporate_actions,
+    trigger=CronTrigger(hour=5, minute=15, timezone='Europe/Moscow'),
+    id='corporate_actions_sync',
+    name='Ежедневная загрузка сплитов и консолидаций из MOEX ISS',
     replace_existing=True
 )
 
 import threading
+import time
 
 # Флаг, показывающий, что планировщик был запущен при старте приложения
 # Это позволяет избежать лишних проверок в @app.before_request
 _scheduler_started = False
 _scheduler_lock = threading.Lock()
 
+# Как часто процесс, не ставший лидером, пробует перехватить блокировку планировщика
+LEADER_RETRY_SECONDS = 60
+_leader_wait_thread = None
+
+def _wait_for_scheduler_leadership():
+    """Фоновый поток: ждём, пока лидер отпустит блокировку (остановка/падение процесса)"""
+    while not scheduler.running:
+        time.sleep(LEADER_RETRY_SECONDS)
+        if scheduler_leader_lock.acquire():
+            print(f"[{datetime.now(pytz.timezone('Europe/Moscow'))}] Блокировка планировщика освободилась, процесс {os.getpid()} становится лидером")
+            start_scheduler()
+            return
+
 # Функция для запуска планировщика (вызывается при первом запросе или при прямом запуске)
 def start_scheduler():
-    """Запускает планировщик задач, если он еще не запущен"""
-    global _scheduler_started
+    """
+    Запускает планировщик задач, если он еще не запущен.
+
+    Планировщик запускается только в процессе, захватившем файловую блокировку
+    (scheduler_leader_lock), поэтому при нескольких воркерах gunicorn задачи не дублируются.
+    Остальные процессы раз в LEADER_RETRY_SECONDS пробуют перехватить блокировку.
+    """
+    global _scheduler_started, _leader_wait_thread
     
     if scheduler.running:
         # Планировщик уже запущен, просто обновляем флаг
@@ -550,6 +779,22 @@ def start_scheduler():
         if scheduler.running:
             _scheduler_started = True
             return
+
+        if SCHEDULER_MODE == 'external':
+            # Задачи выполняет отдельный процесс scheduler_worker.py
+            _scheduler_started = True
+            return
+
+        if not scheduler_leader_lock.acquire():
+            _scheduler_started = True
+            if _leader_wait_thread is None:
+                print(f"[{datetime.now(pytz.timezone('Europe/Moscow'))}] Планировщик уже работает в другом процессе "
+                      f"(PID {scheduler_leader_lock.holder_pid()}), процесс {os.getpid()} его не запускает")
+                _leader_wait_thread = threading.Thread(
+                    target=_wait_for_scheduler_leadership, name='scheduler-leader-wait', daemon=True
+                )
+                _leader_wait_thread.start()
+            return
         
         try:
             moscow_time = datetime.now(pytz.timezone('Europe/Moscow'))
@@ -560,8 +805,8 @@ def start_scheduler():
             moscow_time = datetime.now(pytz.timezone('Europe/Moscow'))
             print(f"[{moscow_time}] ===== ПЛАНИРОВЩИК ЗАПУЩЕН =====")
             print(f"[{moscow_time}] Ежедневное логирование цен в {hour:02d}:{minute:02d} МСК")
-            print(f"[{moscow_time}] Периодическая проверка в 6, 12, 17, 21 час (если записи за сегодня нет)")
-            print(f"[{moscow_time}] Статус планировщика: {scheduler.running}")
+            print(f"[{moscow_time}] Периодическая проверка в 6, 12, 17, 21 час (дозапись тикеров без записи за сегодня)")
+            print(f"[{moscow_time}] Статус планировщика: {scheduler.running} (PID {os.getpid()}, блокировка {scheduler_leader_lock.path})")
             print(f"[{moscow_time}] Задач в планировщике: {len(scheduler.get_jobs())}")
             for job in scheduler.get_jobs():
                 next_run = job.next_run_time.strftime('%Y-%m-%d %H:%M:%S %Z') if job.next_run_time else 'Не запланировано'
@@ -651,6 +896,89 @@ def require_login():
         return redirect(url_for('login'))
 
 
+# Эндпоинты, после успешного выполнения которых меняется ответ /api/portfolio пользователя
+_PORTFOLIO_WRITE_ENDPOINTS = {
+    'add_portfolio_item', 'update_portfolio_item', 'delete_portfolio_item', 'update_category',
+    'add_transaction', 'update_transaction', 'delete_transaction', 'import_transactions',
+    'add_split_coefficient', 'delete_split_coefficient', 'apply_split_proposals',
+    'update_category_item', 'delete_category', 'update_asset_type_item', 'delete_asset_type',
+    'hard_reset_portfolio',
+}
+# ...а эти удаляют историю цен, общую для всех пользователей
+_SHARED_PRICE_HISTORY_WRITE_ENDPOINTS = {'delete_price_history'}
+
+
+# Сколько последних версий журнала portfolio_changes хранить на пользователя
+PORTFOLIO_CHANGES_KEEP_VERSIONS = 500
+
+
+def mark_portfolio_changed(*tickers):
+    """
+    Запомнить тикеры, затронутые текущим запросом. После ответа они попадут
+    в журнал portfolio_changes вместе с новой версией портфеля.
+    """
+    changed = g.setdefault('portfolio_changed_tickers', set())
+    changed.update((t or '').upper() for t in tickers if t)
+
+
+def touch_portfolio_version(user_id=None, tickers=None):
+    """
+    Увеличить версию портфеля пользователя (или всех пользователей, если user_id не задан).
+    Кэшированные ответы /api/portfolio со старой версией больше не используются.
+
+    Для одного пользователя версия записывается в журнал portfolio_changes:
+    с перечнем тикеров или с ticker = NULL, если затронут весь портфель.
+    Увеличение для всех пользователей в журнал не пишется — пропуск версии
+    клиент /api/portfolio/changes воспринимает как необходимость полной загрузки.
+    """
+    try:
+        query = db_session.query(User)
+        if user_id is not None:
+            query = query.filter(User.id == user_id)
+        query.update({User.portfolio_version: User.portfolio_version + 1}, synchronize_session=False)
+        if user_id is not None:
+            version = db_session.query(User.portfolio_version).filter(User.id == user_id).scalar() or 0
+            for ticker in (sorted(tickers) if tickers else [None]):
+                db_session.add(PortfolioChange(user_id=user_id, version=version, ticker=ticker))
+            db_session.query(PortfolioChange).filter(
+                PortfolioChange.user_id == user_id,
+                PortfolioChange.version <= version - PORTFOLIO_CHANGES_KEEP_VERSIONS
+            ).delete(synchronize_session=False)
+        db_session.commit()
+    except Exception as e:
+        db_session.rollback()
+        print(f"[{datetime.now(_MOSCOW_TZ)}] Ошибка обновления версии портфеля: {e}")
+
+
+@app.after_request
+def bump_portfolio_version(response):
+    """Версию увеличиваем после всех записей эндпоинта (включая пересчёт позиций)"""
+    if request.method in ('POST', 'PUT', 'DELETE') and response.status_code < 400:
+        if request.endpoint in _PORTFOLIO_WRITE_ENDPOINTS and current_user.is_authenticated:
+            touch_portfolio_version(current_user.id, g.get('portfolio_changed_tickers'))
+            portfolio_events.notify()
+        elif request.endpoint in _SHARED_PRICE_HISTORY_WRITE_ENDPOINTS:
+            touch_portfolio_version()
+            portfolio_events.notify()
+    return response
+
+
+def _get_quote_generation(user_id: int):
+    """
+    Поколение котировок для ключа кэша /api/portfolio?use_cached=1:
+    меняется при новой/обновлённой записи price_history и при фоновой записи
+    свежих цен в позиции пользователя. Все три значения берутся по индексам.
+    """
+    from sqlalchemy import func
+    return read_session.query(
+        read_session.query(func.max(PriceHistory.id)).scalar_subquery(),
+        read_session.query(func.max(PriceHistory.logged_at)).scalar_subquery(),
+        read_session.query(func.max(Portfolio.current_price_updated_at)).filter(
+            Portfolio.user_id == user_id
+        ).scalar_subquery()
+    ).one()
+
+
 @app.route('/favicon.ico')
 def favicon():
     """Явный маршрут для favicon"""
@@ -678,6 +1006,342 @@ def favicon_svg():
         abort(404)
 
 
+def _load_portfolio_rows(user_id: int, tickers=None, session=None) -> list:
+    """
+    Позиции портфеля для оценки одним Core-запросом: только нужные колонки
+    и агрегаты открытых лотов (LEFT JOIN open_lots), без ORM-объектов.
+
+    Строки результата имеют атрибуты колонок Portfolio (id, ticker, quantity, ...)
+    и lots_quantity, lots_cost, lots_count (None, если открытых лотов нет).
+    """
+    from sqlalchemy import select, func
+    session = session or read_session
+
+    lots = select(
+        OpenLot.ticker.label('ticker'),
+        func.sum(OpenLot.remaining).label('lots_quantity'),
+        func.sum(OpenLot.price * OpenLot.remaining).label('lots_cost'),
+        func.count(OpenLot.id).label('lots_count'),
+    ).where(OpenLot.user_id == user_id).group_by(OpenLot.ticker).subquery()
+
+    query = select(
+        Portfolio.id, Portfolio.ticker, Portfolio.company_name, Portfolio.category,
+        Portfolio.asset_type, Portfolio.instrument_type, Portfolio.quantity,
+        Portfolio.average_buy_price, Portfolio.bond_facevalue, Portfolio.bond_currency,
+        Portfolio.current_price, Portfolio.current_price_updated_at, Portfolio.lotsize,
+        Portfolio.date_added,
+        lots.c.lots_quantity, lots.c.lots_cost, lots.c.lots_count,
+    ).outerjoin(lots, lots.c.ticker == func.upper(Portfolio.ticker)).where(Portfolio.user_id == user_id)
+    if tickers is not None:
+        query = query.where(func.upper(Portfolio.ticker).in_([_normalize_ticker(t) for t in tickers]))
+    return session.execute(query.order_by(Portfolio.id.asc())).all()
+
+
+def _value_portfolio_positions(user_id: int, change_days=None, use_cached: bool = False, tickers=None) -> list:
+    """
+    Оценка позиций портфеля пользователя: текущая цена, средняя цена покупки,
+    изменение цены за период, прибыль/убыток.
+
+    Args:
+        change_days: Период изменения цены в днях (None/1 — дневное изменение)
+        use_cached: Не запрашивать MOEX, брать сохранённые цены
+        tickers: Оценить только эти тикеры (None — весь портфель)
+
+    Returns:
+        Список позиций в формате ответа /api/portfolio
+    """
+    ticker_lotsize_overrides = {
+        'CNYM': 1,
+    }
+
+    def normalize_lotsize(ticker: str, lotsize_value):
+        override_value = ticker_lotsize_overrides.get((ticker or '').upper())
+        if override_value:
+            return override_value
+        try:
+            return int(lotsize_value) if lotsize_value else 1
+        except (TypeError, ValueError):
+            return 1
+
+    # Запрос только читает: все выборки идут через read_session (пул соединений
+    # с PRAGMA query_only), свежие цены с MOEX пишутся фоново через market_data_writer.
+    # Дубликаты тикеров исключены уникальным индексом (см. migrate_portfolio_columns).
+    # Позиции и стоимость открытых лотов (FIFO) — одним запросом в виде лёгких строк;
+    # в cached-режиме, кроме него и базовых цен истории, запросов нет.
+    unique_items = _load_portfolio_rows(user_id, tickers)
+
+    result = []
+
+    all_tickers = [item.ticker.upper() for item in unique_items]
+    split_index = _get_split_index(user_id, session=read_session)
+
+    # Оптимизация: базовые цены для расчета изменений (последняя запись и самая
+    # старая запись за период) для всех тикеров одним запросом — в цикле по позициям
+    # обращений к price_history нет
+    period_start = datetime.now() - timedelta(days=change_days) if change_days and change_days > 1 else None
+    history_tickers = sorted({item.ticker for item in unique_items} | set(all_tickers))
+    price_history_baselines = _get_price_history_baselines(history_tickers, period_start, session=read_session)
+
+    def get_history_baseline(ticker: str) -> dict:
+        return (
+            price_history_baselines.get(ticker)
+            or price_history_baselines.get(ticker.upper())
+            or {'latest': None, 'period_oldest': None}
+        )
+
+    # Подготавливаем данные для параллельных запросов
+    items_data = []
+    for item in unique_items:
+        # Определяем тип инструмента
+        instrument_type = item.instrument_type.name if hasattr(item, 'instrument_type') and item.instrument_type else 'STOCK'
+
+        # Дополнительная проверка: если тикер облигации (начинается с RU или SU), но тип не определен
+        if instrument_type == 'STOCK' and (item.ticker.startswith('RU') or item.ticker.startswith('SU')) and len(item.ticker) > 10:
+            # Вероятно, это облигация (тикеры облигаций обычно длинные и начинаются с RU или SU)
+            instrument_type = 'BOND'
+
+        types_to_try = [instrument_type]
+        if instrument_type == 'STOCK':
+            types_to_try.append('BOND')
+        elif instrument_type == 'BOND':
+            types_to_try.append('STOCK')
+
+        items_data.append({
+            'item': item,
+            'instrument_type': instrument_type,
+            'types_to_try': types_to_try
+        })
+
+    # Параллельно получаем цены и информацию о лотах для всех элементов,
+    # если явно не запрещено дергать MOEX API.
+    price_data_cache = {}
+    security_info_cache = {}
+
+    if not use_cached:
+        def fetch_price_data(data):
+            """Получить данные о цене для одного элемента"""
+            item = data['item']
+            types_to_try = data['types_to_try']
+            current_price_data = None
+            for itype in types_to_try:
+                current_price_data = moex_service.get_current_price(item.ticker, itype)
+                if current_price_data:
+                    break
+            return item.ticker, current_price_data
+
+        def fetch_security_info(data):
+            """Получить информацию о лотах для одного элемента"""
+            item = data['item']
+            instrument_type = data['instrument_type']
+            security_info = moex_service.get_security_info(item.ticker, instrument_type)
+            return item.ticker, security_info
+
+        # Выполняем запросы параллельно
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            # Запросы цен
+            price_futures = {executor.submit(fetch_price_data, data): data for data in items_data}
+            # Запросы информации о лотах
+            security_futures = {executor.submit(fetch_security_info, data): data for data in items_data}
+
+            # Собираем результаты цен
+            for future in as_completed(price_futures):
+                ticker, price_data = future.result()
+                price_data_cache[ticker] = price_data
+
+            # Собираем результаты информации о лотах
+            for future in as_completed(security_futures):
+                ticker, security_info = future.result()
+                security_info_cache[ticker] = security_info
+    else:
+        # Режим без запросов к MOEX: берём последнюю цену из таблицы price_history.
+        for data in items_data:
+            item = data['item']
+            # Приоритет: сохранённая цена из портфеля (обновляется при каждом запросе к MOEX)
+            if hasattr(item, 'current_price') and item.current_price:
+                price_data_cache[item.ticker] = {
+                    'price': item.current_price,
+                    'last_update': item.current_price_updated_at.isoformat() if item.current_price_updated_at else '',
+                    'decimals': None,
+                }
+            else:
+                # Fallback: последняя запись из price_history
+                entry = get_history_baseline(item.ticker)['latest']
+                if entry:
+                    price_data_cache[item.ticker] = {
+                        'price': entry.price,
+                        'last_update': entry.logged_at.isoformat(),
+                        'decimals': None,
+                    }
+                else:
+                    price_data_cache[item.ticker] = None
+            # В cached-режиме берём lotsize из сохранённого в Portfolio
+            security_info_cache[item.ticker] = {
+                'trading_params': {'lotsize': normalize_lotsize(item.ticker, item.lotsize)}
+            }
+
+    # Свежие рыночные данные (цена, лот, номинал облигаций) не коммитим в цикле,
+    # а собираем и отдаём в фоновую запись одним пакетом после цикла
+    market_updates = {}
+
+    # Первый проход — только подготовка входных колонок оценки (цены, лоты, номиналы,
+    # курсы, коэффициенты сплитов); вся арифметика — в PortfolioValuationEngine
+    columns = PortfolioValuationEngine.empty_columns()
+    display = []  # Поля ответа, не участвующие в расчёте
+    now_msk = datetime.now(_MOSCOW_TZ)
+    # Курсы валют и коэффициенты сплитов — один раз на запрос, а не на каждую позицию
+    valuation_context = ValuationContext(split_index, now_msk.date(), currency_service.get_rate_to_rub)
+    for data in items_data:
+        item = data['item']
+        instrument_type = data['instrument_type']
+        is_bond = instrument_type == 'BOND'
+
+        # Получаем актуальную цену с MOEX из кэша
+        current_price_data = price_data_cache.get(item.ticker)
+
+        # Получаем информацию о размере лота из кэша
+        lotsize = 1  # По умолчанию 1
+        security_info = security_info_cache.get(item.ticker)
+        if security_info and security_info.get('trading_params'):
+            lotsize = normalize_lotsize(
+                item.ticker,
+                security_info['trading_params'].get('lotsize', 1)
+            )
+
+        # Получаем номинал и валюту для облигаций
+        bond_facevalue = None
+        bond_currency = None
+        if is_bond:
+            # Используем сохраненные значения из базы, если есть
+            if item.bond_facevalue:
+                bond_facevalue = item.bond_facevalue
+                bond_currency = item.bond_currency
+            # Если нет в базе, получаем из API
+            elif current_price_data:
+                bond_facevalue = current_price_data.get('facevalue', 1000.0)
+                bond_currency = current_price_data.get('currency_id', 'SUR')
+                # Сохраняем в базу для будущего использования
+                market_updates.setdefault(item.id, {}).update(
+                    bond_facevalue=bond_facevalue, bond_currency=bond_currency
+                )
+            else:
+                bond_facevalue = 1000.0
+                bond_currency = 'SUR'
+
+        # Получаем decimals для форматирования цен
+        price_decimals = None
+        if current_price_data:
+            current_price = current_price_data.get('price', 0)
+            last_update = current_price_data.get('last_update', '')
+            price_decimals = current_price_data.get('decimals')  # Количество знаков после запятой
+            # Обновляем номинал и валюту из API, если они есть
+            if is_bond and current_price_data.get('facevalue'):
+                bond_facevalue = current_price_data.get('facevalue', bond_facevalue or 1000.0)
+                bond_currency = current_price_data.get('currency_id', bond_currency or 'SUR')
+                # Обновляем в базе, если изменились
+                if item.bond_facevalue != bond_facevalue or item.bond_currency != bond_currency:
+                    market_updates.setdefault(item.id, {}).update(
+                        bond_facevalue=bond_facevalue, bond_currency=bond_currency
+                    )
+            # Сохраняем свежую цену и lotsize в БД, чтобы при перезагрузке страницы
+            # (use_cached=1) использовались актуальные данные
+            if not use_cached and current_price and current_price > 0:
+                fields = {'current_price': current_price, 'current_price_updated_at': datetime.now()}
+                if lotsize and lotsize > 0:
+                    fields['lotsize'] = normalize_lotsize(item.ticker, lotsize)
+                market_updates.setdefault(item.id, {}).update(fields)
+        else:
+            # Если цена не получена от MOEX — берём сохранённую в БД
+            if item.current_price:
+                current_price = item.current_price
+                last_update = item.current_price_updated_at.isoformat() if item.current_price_updated_at else ''
+            else:
+                current_price = item.average_buy_price
+                last_update = ''
+
+        # Предыдущая цена для изменения за период:
+        # неделя, месяц и т.д. — самая старая запись за период (если записей нет — самая свежая);
+        # день (или период не задан) — самая свежая запись истории.
+        # Для облигаций цены в истории хранятся в процентах, для акций — в рублях.
+        ticker_baseline = get_history_baseline(item.ticker)
+        if change_days and change_days > 1:
+            baseline_entry = ticker_baseline['period_oldest'] or ticker_baseline['latest']
+        else:
+            baseline_entry = ticker_baseline['latest']
+
+        # Коэффициенты сплитов: накопленный на сегодня (для количества и средней цены)
+        # и множители приведения текущей и исторической цены к текущей шкале
+        columns['is_bond'].append(is_bond)
+        columns['quantity'].append(item.quantity)
+        columns['average_buy_price'].append(item.average_buy_price)
+        # Средняя цена покупки — по открытым лотам (покупки, которые не были полностью проданы).
+        # Цены в транзакциях сохраняются как ввел пользователь (в рублях) — не переводим
+        columns['lots_quantity'].append(item.lots_quantity if item.lots_count else None)
+        columns['lots_cost'].append((item.lots_cost or 0.0) if item.lots_count else None)
+        columns['current_price'].append(current_price)
+        columns['has_quote'].append(bool(current_price_data))
+        columns['facevalue'].append(bond_facevalue)
+        columns['fx_rate'].append(valuation_context.fx_rate(bond_currency) if is_bond else 1.0)
+        columns['split_factor'].append(valuation_context.split_factor(item.ticker))
+        columns['latest_adjust'].append(valuation_context.price_adjust(item.ticker, now_msk))
+        columns['baseline_price'].append(baseline_entry.price if baseline_entry else None)
+        columns['baseline_adjust'].append(
+            valuation_context.price_adjust(item.ticker, baseline_entry.logged_at) if baseline_entry else 1.0
+        )
+        columns['lotsize'].append(lotsize)
+        display.append((item, is_bond, bond_facevalue, bond_currency, last_update, price_decimals))
+
+    market_data_writer.enqueue(market_updates)
+
+    values = PortfolioValuationEngine.value(columns)
+
+    for i, (item, is_bond, bond_facevalue, bond_currency, last_update, price_decimals) in enumerate(display):
+        result_item = {
+            'id': item.id,
+            'ticker': item.ticker,
+            'company_name': item.company_name,
+            'category': item.category,
+            'asset_type': item.asset_type,
+            'instrument_type': item.instrument_type.value if item.instrument_type else 'Акция',
+            'quantity': values['quantity'][i],  # Количество бумаг (после коэффициентов сплитов)
+            'lots': values['lots'][i],  # Количество лотов
+            'lotsize': columns['lotsize'][i],  # Размер лота
+            'average_buy_price': values['average_buy_price'][i],  # уже в рублях для облигаций
+            'current_price': values['current_price'][i],  # уже в рублях для облигаций
+            'price_change': values['price_change'][i],  # уже в рублях для облигаций
+            'price_change_percent': values['price_change_percent'][i],
+            'total_cost': values['total_cost'][i],  # стоимость по текущей цене
+            'total_buy_cost': values['total_buy_cost'][i],
+            'profit_loss': values['profit_loss'][i],
+            'profit_loss_percent': values['profit_loss_percent'][i],
+            'last_update': last_update,
+            'date_added': item.date_added.isoformat() if item.date_added else None,
+            'price_decimals': price_decimals  # Количество знаков после запятой для форматирования цен
+        }
+
+        # Добавляем информацию о номинале и валюте для облигаций
+        if is_bond:
+            result_item['bond_facevalue'] = bond_facevalue
+            result_item['bond_currency'] = bond_currency
+
+        result.append(result_item)
+
+    return result
+
+
+def _summarize_portfolio(user_id: int, positions: list) -> dict:
+    """
+    Сводка по всем оценённым позициям портфеля: стоимость, прибыль, изменение цены
+    за период (процент — средневзвешенный по стоимости позиций) и свободные деньги
+    """
+    # Строку баланса создают init_cash_balance и операции с деньгами; здесь её нет — значит 0
+    balance = read_session.query(CashBalance).filter_by(user_id=user_id).first()
+    return PortfolioValuationEngine.summarize(
+        {key: [item[key] for item in positions]
+         for key in ('total_cost', 'total_buy_cost', 'price_change', 'price_change_percent', 'quantity')},
+        cash_balance=balance.balance if balance else 0.0
+    )
+
+
 @app.route('/api/portfolio', methods=['GET'])
 def get_portfolio():
     """
@@ -685,573 +1349,151 @@ def get_portfolio():
     Средняя цена покупки рассчитывается из истории транзакций покупки
     """
     try:
-        ticker_lotsize_overrides = {
-            'CNYM': 1,
-        }
-
-        def normalize_lotsize(ticker: str, lotsize_value):
-            override_value = ticker_lotsize_overrides.get((ticker or '').upper())
-            if override_value:
-                return override_value
-            try:
-                return int(lotsize_value) if lotsize_value else 1
-            except (TypeError, ValueError):
-                return 1
-
         # Период для расчета изменения цены (в днях). Если не задан - используем "последние две записи".
         change_days = request.args.get('change_days', type=int)
         # Флаг: использовать только кэшированные данные (без прямых запросов к MOEX API)
         use_cached = request.args.get('use_cached', default=0, type=int) == 1
 
-        portfolio_items = db_session.query(Portfolio).filter(Portfolio.user_id == current_user.id).all()
-        
-        # Проверяем на дубликаты и удаляем их
-        # Группируем по тикеру и оставляем только первую запись для каждого тикера
-        seen_tickers = {}
-        items_to_delete = []
-        unique_items = []
-        
-        for item in portfolio_items:
-            ticker_upper = item.ticker.upper()
-            if ticker_upper not in seen_tickers:
-                seen_tickers[ticker_upper] = item
-                unique_items.append(item)
-            else:
-                # Дубликат - помечаем для удаления
-                items_to_delete.append(item)
-        
-        # Удаляем дубликаты из базы данных
-        if items_to_delete:
-            for duplicate in items_to_delete:
-                db_session.delete(duplicate)
-            db_session.commit()
-        
-        result = []
-        
-        # Оптимизация: загружаем все транзакции одним запросом
-        all_tickers = [item.ticker.upper() for item in unique_items]
-        split_coeffs_map = _get_split_coefficients_map(current_user.id, all_tickers)
-        all_transactions_dict = {}
-        if all_tickers:
-            all_transactions_list = db_session.query(Transaction).filter(
-                Transaction.ticker.in_(all_tickers),
-                Transaction.user_id == current_user.id
-            ).order_by(Transaction.date.asc()).all()
-            
-            # Группируем транзакции по тикерам
-            for trans in all_transactions_list:
-                ticker_upper = trans.ticker.upper()
-                if ticker_upper not in all_transactions_dict:
-                    all_transactions_dict[ticker_upper] = []
-                all_transactions_dict[ticker_upper].append(trans)
-        
-        # Оптимизация: загружаем историю цен для расчета изменений одним запросом
-        price_history_cache = {}
-        now_moscow = datetime.now(pytz.timezone('Europe/Moscow'))
-        today_start = now_moscow.replace(hour=0, minute=0, second=0, microsecond=0)
-        yesterday_start = today_start - timedelta(days=1)
-        yesterday_end = today_start
-        
-        # Загружаем последние записи за сегодня и вчера для всех тикеров (для change_days=1 или не задан)
-        if not change_days or change_days == 1:
-            today_entries = db_session.query(PriceHistory).filter(
-                PriceHistory.ticker.in_(all_tickers),
-                PriceHistory.logged_at >= today_start
-            ).order_by(PriceHistory.ticker, PriceHistory.logged_at.desc()).all()
-            
-            yesterday_entries = db_session.query(PriceHistory).filter(
-                PriceHistory.ticker.in_(all_tickers),
-                PriceHistory.logged_at >= yesterday_start,
-                PriceHistory.logged_at < yesterday_end
-            ).order_by(PriceHistory.ticker, PriceHistory.logged_at.desc()).all()
-            
-            # Группируем по тикерам (берем только первую запись для каждого тикера)
-            seen_today = set()
-            seen_yesterday = set()
-            for entry in today_entries:
-                ticker_upper = entry.ticker.upper()
-                if ticker_upper not in seen_today:
-                    if ticker_upper not in price_history_cache:
-                        price_history_cache[ticker_upper] = {'today': None, 'yesterday': None}
-                    price_history_cache[ticker_upper]['today'] = entry
-                    seen_today.add(ticker_upper)
-            
-            for entry in yesterday_entries:
-                ticker_upper = entry.ticker.upper()
-                if ticker_upper not in seen_yesterday:
-                    if ticker_upper not in price_history_cache:
-                        price_history_cache[ticker_upper] = {'today': None, 'yesterday': None}
-                    price_history_cache[ticker_upper]['yesterday'] = entry
-                    seen_yesterday.add(ticker_upper)
-        
-        # Подготавливаем данные для параллельных запросов
-        items_data = []
-        for item in unique_items:
-            # Определяем тип инструмента
-            instrument_type = item.instrument_type.name if hasattr(item, 'instrument_type') and item.instrument_type else 'STOCK'
-            
-            # Дополнительная проверка: если тикер облигации (начинается с RU или SU), но тип не определен
-            if instrument_type == 'STOCK' and (item.ticker.startswith('RU') or item.ticker.startswith('SU')) and len(item.ticker) > 10:
-                # Вероятно, это облигация (тикеры облигаций обычно длинные и начинаются с RU или SU)
-                instrument_type = 'BOND'
-            
-            types_to_try = [instrument_type]
-            if instrument_type == 'STOCK':
-                types_to_try.append('BOND')
-            elif instrument_type == 'BOND':
-                types_to_try.append('STOCK')
-            
-            items_data.append({
-                'item': item,
-                'instrument_type': instrument_type,
-                'types_to_try': types_to_try
-            })
+        # В cached-режиме ответ определяется версией портфеля пользователя и поколением
+        # котировок (плюс текущий час: курсы валют и окно периода изменения). Если они
+        # не изменились — отвечаем 304 или готовым ответом из кэша без пересчёта.
+        cache_key = None
+        if use_cached:
+            cache_key = (
+                current_user.id,
+                current_user.portfolio_version or 0,
+                tuple(str(v) for v in _get_quote_generation(current_user.id)),
+                change_days or 0,
+                datetime.now(_MOSCOW_TZ).strftime('%Y-%m-%d %H'),
+            )
+            etag = hashlib.sha1(repr(cache_key).encode()).hexdigest()
+            cached = portfolio_response_cache.get(cache_key)
+            if etag in request.if_none_match or cached:
+                response = app.response_class(cached[1] if cached else b'', mimetype='application/json')
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'private, no-cache'
+                return response.make_conditional(request)
+
+        result = _value_portfolio_positions(current_user.id, change_days, use_cached)
+        summary = _summarize_portfolio(current_user.id, result)
         
-        # Параллельно получаем цены и информацию о лотах для всех элементов,
-        # если явно не запрещено дергать MOEX API.
-        price_data_cache = {}
-        security_info_cache = {}
-        
-        if not use_cached:
-            def fetch_price_data(data):
-                """Получить данные о цене для одного элемента"""
-                item = data['item']
-                types_to_try = data['types_to_try']
-                current_price_data = None
-                for itype in types_to_try:
-                    current_price_data = moex_service.get_current_price(item.ticker, itype)
-                    if current_price_data:
-                        break
-                return item.ticker, current_price_data
-            
-            def fetch_security_info(data):
-                """Получить информацию о лотах для одного элемента"""
-                item = data['item']
-                instrument_type = data['instrument_type']
-                security_info = moex_service.get_security_info(item.ticker, instrument_type)
-                return item.ticker, security_info
-            
-            # Выполняем запросы параллельно
-            with ThreadPoolExecutor(max_workers=10) as executor:
-                # Запросы цен
-                price_futures = {executor.submit(fetch_price_data, data): data for data in items_data}
-                # Запросы информации о лотах
-                security_futures = {executor.submit(fetch_security_info, data): data for data in items_data}
-                
-                # Собираем результаты цен
-                for future in as_completed(price_futures):
-                    ticker, price_data = future.result()
-                    price_data_cache[ticker] = price_data
-                
-                # Собираем результаты информации о лотах
-                for future in as_completed(security_futures):
-                    ticker, security_info = future.result()
-                    security_info_cache[ticker] = security_info
+        response = jsonify({
+            'success': True,
+            'portfolio': result,
+            'version': current_user.portfolio_version or 0,
+            'summary': summary
+        })
+        if cache_key is not None:
+            portfolio_response_cache.put(cache_key, etag, response.get_data())
+            response.set_etag(etag)
         else:
-            # Режим без запросов к MOEX: берём последнюю цену из таблицы price_history.
-            if all_tickers:
-                # Получаем последние записи для всех тикеров одним запросом
-                from sqlalchemy import func
-                subq = db_session.query(
-                    PriceHistory.ticker,
-                    func.max(PriceHistory.logged_at).label('max_logged_at')
-                ).filter(
-                    PriceHistory.ticker.in_(all_tickers)
-                ).group_by(PriceHistory.ticker).subquery()
-
-                latest_history = db_session.query(PriceHistory).join(
-                    subq,
-                    (PriceHistory.ticker == subq.c.ticker) &
-                    (PriceHistory.logged_at == subq.c.max_logged_at)
-                ).all()
-
-                latest_history_map = {e.ticker.upper(): e for e in latest_history}
-            else:
-                latest_history_map = {}
+            # Живые цены с MOEX: ETag по содержимому, чтобы не передавать одинаковый ответ повторно
+            response.add_etag()
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
-            for data in items_data:
-                item = data['item']
-                # Приоритет: сохранённая цена из портфеля (обновляется при каждом запросе к MOEX)
-                if hasattr(item, 'current_price') and item.current_price:
-                    price_data_cache[item.ticker] = {
-                        'price': item.current_price,
-                        'last_update': item.current_price_updated_at.isoformat() if item.current_price_updated_at else '',
-                        'decimals': None,
-                    }
-                else:
-                    # Fallback: последняя запись из price_history
-                    entry = latest_history_map.get(item.ticker.upper())
-                    if entry:
-                        price_data_cache[item.ticker] = {
-                            'price': entry.price,
-                            'last_update': entry.logged_at.isoformat(),
-                            'decimals': None,
-                        }
-                    else:
-                        price_data_cache[item.ticker] = None
-                # В cached-режиме берём lotsize из сохранённого в Portfolio
-                security_info_cache[item.ticker] = {
-                    'trading_params': {'lotsize': normalize_lotsize(item.ticker, item.lotsize)}
-                }
-        
-        # Обрабатываем каждый элемент с использованием кэшированных данных
-        for data in items_data:
-            item = data['item']
-            instrument_type = data['instrument_type']
-            
-            # Получаем актуальную цену с MOEX из кэша
-            current_price_data = price_data_cache.get(item.ticker)
-            
-            # Получаем информацию о размере лота из кэша
-            lotsize = 1  # По умолчанию 1
-            security_info = security_info_cache.get(item.ticker)
-            if security_info and security_info.get('trading_params'):
-                lotsize = normalize_lotsize(
-                    item.ticker,
-                    security_info['trading_params'].get('lotsize', 1)
-                )
-            
-            # Получаем номинал и валюту для облигаций
-            bond_facevalue = None
-            bond_currency = None
-            if instrument_type == 'BOND':
-                # Используем сохраненные значения из базы, если есть
-                if hasattr(item, 'bond_facevalue') and item.bond_facevalue:
-                    bond_facevalue = item.bond_facevalue
-                    bond_currency = item.bond_currency if hasattr(item, 'bond_currency') else 'SUR'
-                # Если нет в базе, получаем из API
-                elif current_price_data:
-                    bond_facevalue = current_price_data.get('facevalue', 1000.0)
-                    bond_currency = current_price_data.get('currency_id', 'SUR')
-                    # Сохраняем в базу для будущего использования
-                    item.bond_facevalue = bond_facevalue
-                    item.bond_currency = bond_currency
-                    db_session.commit()
-                else:
-                    bond_facevalue = 1000.0
-                    bond_currency = 'SUR'
-            
-            # Получаем decimals для форматирования цен
-            price_decimals = None
-            if current_price_data:
-                current_price = current_price_data.get('price', 0)
-                last_update = current_price_data.get('last_update', '')
-                price_decimals = current_price_data.get('decimals')  # Количество знаков после запятой
-                # Обновляем номинал и валюту из API, если они есть
-                if instrument_type == 'BOND' and current_price_data.get('facevalue'):
-                    bond_facevalue = current_price_data.get('facevalue', bond_facevalue or 1000.0)
-                    bond_currency = current_price_data.get('currency_id', bond_currency or 'SUR')
-                    # Обновляем в базе, если изменились
-                    if hasattr(item, 'bond_facevalue') and (item.bond_facevalue != bond_facevalue or item.bond_currency != bond_currency):
-                        item.bond_facevalue = bond_facevalue
-                        item.bond_currency = bond_currency
-                        db_session.commit()
-                # Сохраняем свежую цену и lotsize в БД, чтобы при перезагрузке страницы
-                # (use_cached=1) использовались актуальные данные
-                if not use_cached and current_price and current_price > 0:
-                    item.current_price = current_price
-                    item.current_price_updated_at = datetime.now()
-                    if lotsize and lotsize > 0:
-                        item.lotsize = normalize_lotsize(item.ticker, lotsize)
-                    db_session.commit()
-            else:
-                # Если цена не получена от MOEX — берём сохранённую в БД
-                if hasattr(item, 'current_price') and item.current_price:
-                    current_price = item.current_price
-                    last_update = item.current_price_updated_at.isoformat() if item.current_price_updated_at else ''
-                else:
-                    current_price = item.average_buy_price if hasattr(item, 'average_buy_price') else 0
-                    last_update = ''
-            
-            # Вычисляем среднюю цену покупки из истории транзакций
-            # Используем ту же логику, что и в recalculate_portfolio_for_ticker
-            # Учитываем только те покупки, которые не были полностью проданы
-            # Используем кэшированные транзакции
-            all_transactions = all_transactions_dict.get(item.ticker.upper(), [])
-            
-            # Применяем FIFO для определения релевантных покупок
-            current_quantity = 0
-            relevant_buy_transactions = []  # Кортежи (цена, оставшееся_количество)
-            
-            for trans in all_transactions:
-                if trans.operation_type == TransactionType.BUY:
-                    current_quantity += trans.quantity
-                    if current_quantity - trans.quantity <= 0:
-                        # Позиция была полностью продана, начинаем считать заново
-                        relevant_buy_transactions = []
-                    relevant_buy_transactions.append((trans.price, trans.quantity))
-                elif trans.operation_type == TransactionType.SELL:
-                    sell_quantity = trans.quantity
-                    current_quantity -= sell_quantity
-                    
-                    # Удаляем покупки по FIFO
-                    while sell_quantity > 0 and relevant_buy_transactions:
-                        buy_price, buy_remaining = relevant_buy_transactions[0]
-                        if buy_remaining <= sell_quantity:
-                            sell_quantity -= buy_remaining
-                            relevant_buy_transactions.pop(0)
-                        else:
-                            relevant_buy_transactions[0] = (buy_price, buy_remaining - sell_quantity)
-                            sell_quantity = 0
-                    
-                    if current_quantity < 0:
-                        current_quantity = 0
-            
-            # Рассчитываем среднюю цену из релевантных покупок
-            # ВАЖНО: цены в транзакциях сохраняются как ввел пользователь (в рублях)
-            # НЕ переводим цены из транзакций - они уже в рублях
-            total_cost_from_transactions = None
-            total_buy_quantity = 0
-            if relevant_buy_transactions:
-                # Цены в транзакциях уже в рублях (как ввел пользователь)
-                total_cost_from_transactions = sum(price * quantity for price, quantity in relevant_buy_transactions)
-                total_buy_quantity = sum(quantity for _, quantity in relevant_buy_transactions)
-                calculated_avg_price = total_cost_from_transactions / total_buy_quantity if total_buy_quantity > 0 else item.average_buy_price
-            else:
-                # Если нет релевантных транзакций, используем цену из портфеля
-                calculated_avg_price = item.average_buy_price
-            
-            # Получаем данные истории цен для расчета изменения
-            # latest_price = current_price (та же цена, что отображается в "Текущая стоимость")
-            # previous_price = самая ранняя запись в истории за выбранный период
-            bond_nominal = bond_facevalue if bond_facevalue else 1000.0
-
-            # Конечная точка — текущая цена актива в приведенной (актуальной) шкале,
-            # с учетом коэффициентов сплитов по дате.
-            split_factor_now = _get_cumulative_split_factor_until(
-                item.ticker, datetime.now(_MOSCOW_TZ).date(), split_coeffs_map
-            )
-            latest_price_raw = current_price if current_price_data else None
-            latest_price = (
-                get_adjusted_price_for_date(
-                    latest_price_raw,
-                    datetime.now(_MOSCOW_TZ),
-                    item.ticker,
-                    split_coeffs_map
-                )
-                if latest_price_raw is not None else None
-            )
-            previous_price = None
-
-            if change_days and change_days > 0:
-                if change_days == 1:
-                    # День: предыдущая цена — последняя запись за сегодня из истории цен; текущая — из главной таблицы (MOEX)
-                    ticker_history = price_history_cache.get(item.ticker.upper(), {})
-                    latest_entry_today = ticker_history.get('today')
-
-                    if latest_entry_today:
-                        previous_price = get_adjusted_price_for_date(
-                            latest_entry_today.price, latest_entry_today.logged_at, item.ticker, split_coeffs_map
-                        )
-                    else:
-                        # Нет записи за сегодня — любая последняя доступная запись
-                        any_previous = db_session.query(PriceHistory).filter(
-                            PriceHistory.ticker == item.ticker
-                        ).order_by(PriceHistory.logged_at.desc()).first()
-                        previous_price = (
-                            get_adjusted_price_for_date(any_previous.price, any_previous.logged_at, item.ticker, split_coeffs_map)
-                            if any_previous else latest_price
-                        )
-                else:
-                    # Неделя, месяц и т.д.: предыдущая цена — самая старая запись за период
-                    period_start = datetime.now() - timedelta(days=change_days)
-                    oldest_entry = db_session.query(PriceHistory).filter(
-                        PriceHistory.ticker == item.ticker,
-                        PriceHistory.logged_at >= period_start
-                    ).order_by(PriceHistory.logged_at.asc()).first()
-
-                    if oldest_entry:
-                        previous_price = get_adjusted_price_for_date(
-                            oldest_entry.price, oldest_entry.logged_at, item.ticker, split_coeffs_map
-                        )
-                    else:
-                        # Нет записей за период — берём самую свежую доступную
-                        any_entry = db_session.query(PriceHistory).filter(
-                            PriceHistory.ticker == item.ticker
-                        ).order_by(PriceHistory.logged_at.desc()).first()
-                        previous_price = (
-                            get_adjusted_price_for_date(any_entry.price, any_entry.logged_at, item.ticker, split_coeffs_map)
-                            if any_entry else latest_price
-                        )
-            else:
-                # Без периода — дневное изменение: цена из истории за сегодня и текущая из главной таблицы
-                ticker_history = price_history_cache.get(item.ticker.upper(), {})
-                latest_entry_today = ticker_history.get('today')
 
-                if latest_entry_today:
-                    previous_price = get_adjusted_price_for_date(
-                        latest_entry_today.price, latest_entry_today.logged_at, item.ticker, split_coeffs_map
-                    )
-                else:
-                    any_previous = db_session.query(PriceHistory).filter(
-                        PriceHistory.ticker == item.ticker
-                    ).order_by(PriceHistory.logged_at.desc()).first()
-                    previous_price = (
-                        get_adjusted_price_for_date(any_previous.price, any_previous.logged_at, item.ticker, split_coeffs_map)
-                        if any_previous else latest_price
-                    )
+@app.route('/api/portfolio/changes', methods=['GET'])
+def get_portfolio_changes():
+    """
+    Изменения портфеля после версии since (для точечного обновления таблицы)
 
-            # Рассчитываем изменение: разница между предыдущей и последней ценой
-            # Для облигаций цены в истории хранятся в процентах, для акций - в рублях
-            if latest_price is not None and previous_price is not None:
-                # Для облигаций рассчитываем изменение
-                if instrument_type == 'BOND':
-                    # Для облигаций процентное изменение рассчитывается ПРЯМО из процентов
-                    # (не через конвертацию в валюту номинала)
-                    price_change_percent = latest_price - previous_price
-                    
-                    # Изменение в деньгах: переводим проценты в цену в валюте номинала
-                    latest_price_in_nominal = (latest_price * bond_nominal) / 100
-                    previous_price_in_nominal = (previous_price * bond_nominal) / 100
-                    # Изменение в валюте номинала
-                    price_change_in_nominal = latest_price_in_nominal - previous_price_in_nominal
-                    # Пока что price_change в валюте номинала, конвертация в рубли будет ниже
-                    price_change = price_change_in_nominal
-                else:
-                    price_change = latest_price - previous_price
-                    price_change_percent = (price_change / previous_price * 100) if previous_price > 0 else 0
-            else:
-                price_change = 0
-                price_change_percent = 0
-            
-            # Расчеты прибыли/убытка относительно ТЕКУЩЕЙ цены (с MOEX API)
-            # Для облигаций цены с MOEX в процентах от номинала, сначала получаем цену в валюте номинала,
-            # затем при необходимости переводим в рубли по курсу
-            # calculated_avg_price из транзакций уже в рублях (как ввел пользователь)
-            if instrument_type == 'BOND':
-                # Цена одной облигации в валюте номинала (например, USD) = проценты * номинал / 100
-                current_price_in_nominal_currency = (current_price * bond_nominal) / 100
-
-                # Если номинал не в рублях, конвертируем в RUB по курсу
-                if bond_currency and bond_currency != 'SUR' and bond_currency != 'RUB':
-                    try:
-                        fx_rate = currency_service.get_rate_to_rub(bond_currency)
-                    except Exception:
-                        fx_rate = 1.0
-                else:
-                    fx_rate = 1.0
+    Возвращаются только позиции тикеров, затронутых с тех пор записями
+    пользователя, и тикеров из tickers=SBER,GAZP (свежие котировки из /api/events).
+    Если журнал не покрывает весь интервал версий или изменение затронуло
+    весь портфель — возвращается full: true, и клиент загружает /api/portfolio целиком.
 
-                current_price_rub = current_price_in_nominal_currency * fx_rate
+    Сводка (summary) — те же поля, что у /api/portfolio: портфель оценивается
+    одним проходом целиком (с use_cached=1 — без запросов к MOEX), из него
+    берутся и позиции ответа, и итоги.
+    """
+    try:
+        since = request.args.get('since', type=int)
+        extra_tickers = {_normalize_ticker(t) for t in request.args.get('tickers', '').split(',') if t.strip()}
+        change_days = request.args.get('change_days', type=int)
+        use_cached = request.args.get('use_cached', default=0, type=int) == 1
+
+        version = current_user.portfolio_version or 0
+        if since is None or since > version:
+            return jsonify({'success': True, 'full': True, 'version': version})
+
+        changes = read_session.query(PortfolioChange.version, PortfolioChange.ticker).filter(
+            PortfolioChange.user_id == current_user.id,
+            PortfolioChange.version > since,
+            PortfolioChange.version <= version
+        ).all()
+        versions = {row.version for row in changes}
+        if len(versions) != version - since or any(row.ticker is None for row in changes):
+            return jsonify({'success': True, 'full': True, 'version': version})
+
+        tickers = sorted({_normalize_ticker(row.ticker) for row in changes} | extra_tickers)
+        valued = _value_portfolio_positions(current_user.id, change_days, use_cached)
+        positions = [item for item in valued if item['ticker'].upper() in tickers]
+        present = {item['ticker'].upper() for item in positions}
+
+        return jsonify({
+            'success': True,
+            'full': False,
+            'version': version,
+            'positions': positions,
+            'removed': [ticker for ticker in tickers if ticker not in present],
+            'summary': _summarize_portfolio(current_user.id, valued)
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/api/events', methods=['GET'])
+def portfolio_event_stream():
+    """
+    Server-Sent Events: price_log, portfolio_version и quotes для текущего пользователя
+    (см. services/event_stream.py). Заменяет периодический опрос со стороны браузера.
+
+    Если все слоты потоков событий процесса заняты — 503 с Retry-After:
+    вкладка остаётся на периодическом опросе и подключается позже.
+    """
+    subscription = portfolio_events.subscribe(current_user.id)
+    if subscription is None:
+        response = app.response_class(
+            f'retry: {portfolio_events.BUSY_RETRY_MS}\n\n', status=503, mimetype='text/event-stream'
+        )
+        response.headers['Retry-After'] = str(portfolio_events.BUSY_RETRY_MS // 1000)
+        return response
+
+    response = app.response_class(portfolio_events.stream(subscription), mimetype='text/event-stream')
+    # Генератор могут закрыть, не начав: слот освобождается и при закрытии ответа
+    response.call_on_close(lambda: portfolio_events.unsubscribe(subscription))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx не должен буферизовать поток
+    return response
 
-                # calculated_avg_price уже в рублях (как ввел пользователь при покупке)
-                avg_price_rub = calculated_avg_price
-            else:
-                current_price_rub = current_price
-                avg_price_rub = calculated_avg_price
-
-            # Применяем коэффициент сплита к ценам и количеству:
-            # количество делим на коэффициент.
-            # Средняя цена покупки остаётся пересчитанной (умножается),
-            # а текущую цену оставляем "как с биржи", без умножения.
-            effective_quantity = item.quantity / split_factor_now if split_factor_now > 0 else item.quantity
-            avg_price_rub = (avg_price_rub or 0) * split_factor_now
-            
-            total_current_value = effective_quantity * current_price_rub
-            
-            # Используем реальную сумму из транзакций для точности (избегаем ошибок округления)
-            # Если количество в портфеле равно количеству из транзакций - используем total_cost напрямую
-            # Иначе пропорционально пересчитываем
-            if total_cost_from_transactions is not None and total_buy_quantity > 0:
-                effective_total_buy_quantity = (
-                    total_buy_quantity / split_factor_now if split_factor_now > 0 else total_buy_quantity
-                )
-                if abs(effective_quantity - effective_total_buy_quantity) < 0.01:  # Практически равны (с учетом округления)
-                    total_buy_cost = total_cost_from_transactions
-                else:
-                    # Пропорционально пересчитываем стоимость покупки для текущего количества
-                    # (если были продажи, часть бумаг уже продана)
-                    total_buy_cost = (total_cost_from_transactions / effective_total_buy_quantity) * effective_quantity
-            else:
-                # Если нет транзакций, используем расчет через среднюю цену
-                total_buy_cost = effective_quantity * avg_price_rub
-            
-            profit_loss = total_current_value - total_buy_cost
-            profit_loss_percent = ((current_price_rub - avg_price_rub) / avg_price_rub * 100) if avg_price_rub > 0 else 0
-            
-            # Для облигаций переводим price_change в рубли с учетом валюты номинала
-            if instrument_type == 'BOND':
-                # price_change уже рассчитан как разница в валюте номинала (строки 512-513)
-                # Теперь нужно применить конвертацию валюты, если валюта не RUB
-                if bond_currency and bond_currency != 'SUR' and bond_currency != 'RUB':
-                    try:
-                        fx_rate_change = currency_service.get_rate_to_rub(bond_currency)
-                    except Exception:
-                        fx_rate_change = 1.0
-                else:
-                    fx_rate_change = 1.0
-                price_change_rub = price_change * fx_rate_change
-            else:
-                price_change_rub = price_change
 
-            # Рассчитываем количество лотов
-            lots = effective_quantity / lotsize if lotsize > 0 else effective_quantity
-            
-            result_item = {
-                'id': item.id,
-                'ticker': item.ticker,
-                'company_name': item.company_name,
-                'category': item.category if hasattr(item, 'category') else None,
-                'asset_type': item.asset_type if hasattr(item, 'asset_type') else None,
-                'instrument_type': item.instrument_type.value if hasattr(item, 'instrument_type') and item.instrument_type else 'Акция',
-                'quantity': effective_quantity,  # Количество бумаг (после коэффициентов сплитов)
-                'lots': lots,  # Количество лотов
-                'lotsize': lotsize,  # Размер лота
-                'average_buy_price': avg_price_rub,  # уже в рублях для облигаций
-                'current_price': current_price_rub,  # уже в рублях для облигаций
-                'price_change': price_change_rub,  # уже в рублях для облигаций
-                'price_change_percent': price_change_percent,
-                'total_cost': total_current_value,  # стоимость по текущей цене
-                'total_buy_cost': total_buy_cost,
-                'profit_loss': profit_loss,
-                'profit_loss_percent': profit_loss_percent,
-                'last_update': last_update,
-                'date_added': item.date_added.isoformat() if item.date_added else None,
-                'price_decimals': price_decimals  # Количество знаков после запятой для форматирования цен
-            }
-            
-            # Добавляем информацию о номинале и валюте для облигаций
-            if instrument_type == 'BOND':
-                result_item['bond_facevalue'] = bond_facevalue
-                result_item['bond_currency'] = bond_currency
-            
-            result.append(result_item)
-        
-        # Общие расчеты портфеля
-        total_portfolio_value = sum(item['total_cost'] for item in result)
-        total_portfolio_cost = sum(item['total_buy_cost'] for item in result)
-        total_portfolio_pnl = total_portfolio_value - total_portfolio_cost
-        total_portfolio_pnl_percent = ((total_portfolio_value - total_portfolio_cost) / total_portfolio_cost * 100) if total_portfolio_cost > 0 else 0
-        
-        # Общее изменение цены за день (сумма изменений стоимости всех позиций)
-        # Изменение стоимости позиции = изменение цены * количество
-        total_price_change = sum(item['price_change'] * item['quantity'] for item in result)
-        
-        # Процентное изменение рассчитываем как средневзвешенное по стоимости позиций
-        total_price_change_percent = 0
-        total_value_for_change = sum(item['total_cost'] for item in result if item['price_change'] != 0)
-        if total_value_for_change > 0:
-            # Средневзвешенное процентное изменение (взвешиваем по стоимости позиций)
-            weighted_percent = sum(item['price_change_percent'] * item['total_cost'] for item in result if item['price_change'] != 0)
-            total_price_change_percent = weighted_percent / total_value_for_change if total_value_for_change > 0 else 0
-        
-        # Получаем баланс свободных денег текущего пользователя
-        balance = db_session.query(CashBalance).filter_by(user_id=current_user.id).first()
-        if not balance:
-            balance = CashBalance(user_id=current_user.id, balance=0.0)
-            db_session.add(balance)
-            db_session.commit()
-        
+@app.route('/api/portfolio/<ticker>', methods=['GET'])
+def get_portfolio_position(ticker):
+    """
+    Одна позиция портфеля с актуальной ценой (position = null, если её нет)
+    """
+    try:
+        change_days = request.args.get('change_days', type=int)
+        use_cached = request.args.get('use_cached', default=0, type=int) == 1
+
+        positions = _value_portfolio_positions(current_user.id, change_days, use_cached, tickers=[ticker.upper().strip()])
+        balance = read_session.query(CashBalance).filter_by(user_id=current_user.id).first()
+
         return jsonify({
             'success': True,
-            'portfolio': result,
+            'position': positions[0] if positions else None,
+            'version': current_user.portfolio_version or 0,
             'summary': {
-                'total_value': total_portfolio_value,
-                'total_cost': total_portfolio_cost,
-                'total_pnl': total_portfolio_pnl,
-                'total_pnl_percent': total_portfolio_pnl_percent,
-                'total_price_change': total_price_change,
-                'total_price_change_percent': total_price_change_percent,
-                'cash_balance': balance.balance
+                'cash_balance': balance.balance if balance else 0.0
             }
         })
     except Exception as e:
@@ -1310,6 +1552,7 @@ def add_portfolio_item():
                 existing.asset_type = asset_type
             
             db_session.commit()
+            mark_portfolio_changed(ticker)
             
             return jsonify({
                 'success': True,
@@ -1333,6 +1576,7 @@ def add_portfolio_item():
             
             db_session.add(new_item)
             db_session.commit()
+            mark_portfolio_changed(ticker)
             
             return jsonify({
                 'success': True,
@@ -1373,6 +1617,7 @@ def update_portfolio_item(item_id):
             item.asset_type = data['asset_type'].strip() if data['asset_type'] else None
         
         db_session.commit()
+        mark_portfolio_changed(item.ticker)
         
         return jsonify({
             'success': True,
@@ -1404,6 +1649,7 @@ def delete_portfolio_item(item_id):
         ticker = item.ticker
         db_session.delete(item)
         db_session.commit()
+        mark_portfolio_changed(ticker)
         
         return jsonify({
             'success': True,
@@ -1475,6 +1721,7 @@ def update_category():
             item.category = category if category else None
         
         db_session.commit()
+        mark_portfolio_changed(ticker)
         
         return jsonify({
             'success': True,
@@ -1816,39 +2063,109 @@ def validate_ticker(ticker):
         }), 500
 
 
+# Поля транзакции, которые можно запросить через fields= (как в Transaction.to_dict)
+TRANSACTION_FIELDS = (
+    'id', 'date', 'ticker', 'company_name', 'operation_type', 'price',
+    'quantity', 'total', 'instrument_type', 'notes',
+)
+TRANSACTIONS_PAGE_MAX = 500
+
+
+def _encode_transactions_cursor(tx_date, tx_id):
+    """Курсор страницы: дата и id последней отданной транзакции"""
+    return f"{tx_date.isoformat()}_{tx_id}"
+
+
+def _decode_transactions_cursor(cursor):
+    """(дата, id) из курсора; ValueError — курсор испорчен"""
+    date_part, _, id_part = (cursor or '').rpartition('_')
+    return datetime.fromisoformat(date_part), int(id_part)
+
+
+def _transaction_row_to_dict(row, fields):
+    """Строка выборки колонок транзакции -> словарь в формате Transaction.to_dict"""
+    item = {}
+    for field in fields:
+        value = getattr(row, field)
+        if field == 'date':
+            value = value.strftime('%Y-%m-%d %H:%M:%S') if value else None
+        elif field == 'operation_type':
+            value = value.value
+        elif field == 'instrument_type':
+            value = value.value if value else InstrumentType.STOCK.value
+        item[field] = value
+    return item
+
+
+def _get_transactions_totals(user_id, filters):
+    """
+    Итоги по отфильтрованным транзакциям, посчитанные в SQL
+
+    Returns:
+        {'bought', 'sold', 'count', 'by_ticker': [{'ticker', 'bought', 'sold', 'count'}]}
+    """
+    from sqlalchemy import select, func, case
+    bought = func.sum(case((Transaction.operation_type == TransactionType.BUY, Transaction.total), else_=0.0))
+    sold = func.sum(case((Transaction.operation_type == TransactionType.SELL, Transaction.total), else_=0.0))
+    rows = read_session.execute(
+        select(Transaction.ticker, bought.label('bought'), sold.label('sold'), func.count().label('count'))
+        .where(Transaction.user_id == user_id, *filters)
+        .group_by(Transaction.ticker)
+        .order_by(Transaction.ticker)
+    ).all()
+    by_ticker = [
+        {'ticker': r.ticker, 'bought': r.bought or 0.0, 'sold': r.sold or 0.0, 'count': r.count}
+        for r in rows
+    ]
+    return {
+        'bought': sum(t['bought'] for t in by_ticker),
+        'sold': sum(t['sold'] for t in by_ticker),
+        'count': sum(t['count'] for t in by_ticker),
+        'by_ticker': by_ticker,
+    }
+
+
 @app.route('/api/transactions', methods=['GET'])
 def get_transactions():
     """
-    Получить все транзакции с фильтрацией
+    Получить транзакции с фильтрацией (от новых к старым)
     
     Query параметры:
     - ticker: фильтр по тикеру (опционально)
     - operation_type: фильтр по типу операции (Покупка/Продажа) (опционально)
     - date_from: фильтр по дате от (YYYY-MM-DD) (опционально)
     - date_to: фильтр по дате до (YYYY-MM-DD) (опционально)
+    - limit: размер страницы (опционально, без него — все транзакции)
+    - cursor: next_cursor из предыдущей страницы (опционально)
+    - fields: список полей через запятую (опционально, id и date отдаются всегда)
+    - totals=1: итоги в SQL — сумма покупок, продаж и число операций по тикерам
+    
+    Страницы выбираются по ключу (date, id) индексом idx_transactions_user_date_id,
+    без OFFSET: следующая страница начинается строго после последней строки предыдущей.
     """
     try:
-        query = db_session.query(Transaction).filter(Transaction.user_id == current_user.id)
+        from sqlalchemy import select, or_, and_
+        filters = []
         
         # Фильтр по тикеру
         ticker = request.args.get('ticker')
         if ticker:
-            query = query.filter(Transaction.ticker == ticker.upper())
+            filters.append(Transaction.ticker == ticker.upper())
         
         # Фильтр по типу операции
         operation_type = request.args.get('operation_type')
         if operation_type:
             if operation_type == "Покупка":
-                query = query.filter(Transaction.operation_type == TransactionType.BUY)
+                filters.append(Transaction.operation_type == TransactionType.BUY)
             elif operation_type == "Продажа":
-                query = query.filter(Transaction.operation_type == TransactionType.SELL)
+                filters.append(Transaction.operation_type == TransactionType.SELL)
         
         # Фильтр по датам
         date_from = request.args.get('date_from')
         if date_from:
             try:
                 date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
-                query = query.filter(Transaction.date >= date_from_obj)
+                filters.append(Transaction.date >= date_from_obj)
             except ValueError:
                 pass
         
@@ -1857,19 +2174,59 @@ def get_transactions():
             try:
                 date_to_obj = datetime.strptime(date_to, '%Y-%m-%d')
                 date_to_obj = date_to_obj.replace(hour=23, minute=59, second=59)
-                query = query.filter(Transaction.date <= date_to_obj)
+                filters.append(Transaction.date <= date_to_obj)
             except ValueError:
                 pass
         
-        # Сортировка по дате (от новых к старым)
-        query = query.order_by(Transaction.date.desc())
+        fields = list(TRANSACTION_FIELDS)
+        fields_param = request.args.get('fields')
+        if fields_param:
+            requested = {f.strip() for f in fields_param.split(',')}
+            unknown = requested - set(TRANSACTION_FIELDS)
+            if unknown:
+                return jsonify({'success': False, 'error': f'Неизвестные поля: {", ".join(sorted(unknown))}'}), 400
+            fields = [f for f in TRANSACTION_FIELDS if f in requested or f in ('id', 'date')]
         
-        transactions = query.all()
+        limit = request.args.get('limit', type=int)
+        if limit is not None:
+            limit = max(1, min(limit, TRANSACTIONS_PAGE_MAX))
         
-        return jsonify({
+        query = select(*[getattr(Transaction, f) for f in fields]).where(
+            Transaction.user_id == current_user.id, *filters
+        )
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                cursor_date, cursor_id = _decode_transactions_cursor(cursor)
+            except ValueError:
+                return jsonify({'success': False, 'error': 'Некорректный cursor'}), 400
+            # date <= отдельно от OR — чтобы SQLite шёл по диапазону индекса
+            query = query.where(
+                Transaction.date <= cursor_date,
+                or_(Transaction.date < cursor_date,
+                    and_(Transaction.date == cursor_date, Transaction.id < cursor_id)),
+            )
+        
+        # Сортировка по дате (от новых к старым), id — для однозначного порядка
+        query = query.order_by(Transaction.date.desc(), Transaction.id.desc())
+        if limit is not None:
+            # Лишняя строка — признак того, что есть следующая страница
+            query = query.limit(limit + 1)
+        
+        rows = read_session.execute(query).all()
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_transactions_cursor(rows[-1].date, rows[-1].id)
+        
+        result = {
             'success': True,
-            'transactions': [t.to_dict() for t in transactions]
-        })
+            'transactions': [_transaction_row_to_dict(row, fields) for row in rows],
+            'next_cursor': next_cursor,
+        }
+        if request.args.get('totals') == '1':
+            result['totals'] = _get_transactions_totals(current_user.id, filters)
+        return jsonify(result)
         
     except Exception as e:
         return jsonify({
@@ -1947,35 +2304,29 @@ def add_transaction():
         )
         
         db_session.add(transaction)
+        db_session.flush()
         
-        # Обновляем баланс свободных денег текущего пользователя
-        balance = db_session.query(CashBalance).filter_by(user_id=current_user.id).first()
-        if not balance:
-            balance = CashBalance(user_id=current_user.id, balance=0.0)
-            db_session.add(balance)
-        
-        if operation_type == TransactionType.SELL:
-            # При продаже добавляем сумму в баланс
-            balance.balance += total
-        elif operation_type == TransactionType.BUY:
-            # При покупке:
-            # Если сумма покупки больше баланса - обнуляем баланс
-            # Если сумма покупки меньше баланса - вычитаем сумму из баланса
-            if total >= balance.balance:
-                balance.balance = 0.0
-            else:
-                balance.balance -= total
+        # Баланс свободных денег пересчитывает журнал: с этой транзакции
+        # (или с ближайшего более раннего снимка, если она задним числом)
+        cash_balance = cash_ledger.on_transaction_changed(
+            current_user.id, (transaction.date, transaction.id), commit=False
+        )
+        position_timeline.on_transaction_changed(
+            current_user.id, (transaction.ticker, transaction.date), commit=False
+        )
         
         db_session.commit()
+        lot_ledger.on_transaction_added(transaction)
         
         # Пересчитываем портфель для этого тикера после добавления транзакции
         recalculate_portfolio_for_ticker(data['ticker'].upper(), user_id=current_user.id)
+        mark_portfolio_changed(transaction.ticker)
         
         return jsonify({
             'success': True,
             'message': 'Транзакция успешно добавлена',
             'transaction': transaction.to_dict(),
-            'cash_balance': balance.balance
+            'cash_balance': cash_balance
         })
         
     except Exception as e:
@@ -2005,10 +2356,11 @@ def update_transaction(transaction_id):
         
         data = request.get_json()
         
-        # Сохраняем старые значения для пересчета баланса
+        # Сохраняем старые значения для пересчета баланса и лотов
         old_ticker = transaction.ticker
-        old_operation_type = transaction.operation_type
-        old_total = transaction.total
+        old_cash_key = (transaction.date, transaction.id)
+        old_position_key = (transaction.ticker, transaction.date)
+        old_lot_state = lot_ledger.snapshot(transaction)
         
         # Обновление полей
         if 'ticker' in data:
@@ -2049,7 +2401,16 @@ def update_transaction(transaction_id):
         # Сохраняем новый тикер
         new_ticker = transaction.ticker
         
+        # Сумма, тип или дата могли измениться — пересчитываем баланс с более ранней из дат
+        cash_balance = cash_ledger.on_transaction_changed(
+            current_user.id, old_cash_key, (transaction.date, transaction.id), commit=False
+        )
+        position_timeline.on_transaction_changed(
+            current_user.id, old_position_key, (transaction.ticker, transaction.date), commit=False
+        )
+        
         db_session.commit()
+        lot_ledger.on_transaction_updated(transaction, old_lot_state)
         
         # Пересчитываем портфель для нового тикера
         recalculate_portfolio_for_ticker(new_ticker, user_id=current_user.id)
@@ -2057,12 +2418,14 @@ def update_transaction(transaction_id):
         # Если тикер изменился, пересчитываем и для старого тикера
         if old_ticker != new_ticker:
             recalculate_portfolio_for_ticker(old_ticker, user_id=current_user.id)
+        mark_portfolio_changed(old_ticker, new_ticker)
         
         return jsonify({
             'success': True,
             'message': 'Транзакция успешно обновлена',
             'transaction': transaction.to_dict(),
-            'ticker': new_ticker
+            'ticker': new_ticker,
+            'cash_balance': cash_balance
         })
         
     except Exception as e:
@@ -2075,97 +2438,35 @@ def update_transaction(transaction_id):
 
 def recalculate_portfolio_for_ticker(ticker, user_id=None):
     """
-    Пересчитать портфель для указанного тикера на основе всех транзакций
+    Пересчитать позицию портфеля для указанного тикера по открытым лотам (open_lots)
     Учитывает только те транзакции покупки, которые не были полностью проданы.
     Если позиция была полностью продана (количество = 0), при следующей покупке
     средняя цена считается с нуля от новых транзакций.
     """
     try:
-        # Получаем все транзакции для тикера, отсортированные по дате (от старых к новым)
-        txn_query = db_session.query(Transaction).filter(Transaction.ticker == ticker.upper())
-        if user_id is not None:
-            txn_query = txn_query.filter(Transaction.user_id == user_id)
-        all_transactions = txn_query.order_by(Transaction.date.asc()).all()
-        
-        # Находим позицию в портфеле
-        # Проверяем на дубликаты: если есть несколько записей для одного тикера, удаляем лишние
+        # Находим позицию в портфеле (дубликаты тикера исключает индекс uq_portfolio_user_ticker_upper)
         pf_query = db_session.query(Portfolio).filter_by(ticker=ticker.upper())
         if user_id is not None:
             pf_query = pf_query.filter(Portfolio.user_id == user_id)
-        portfolio_items = pf_query.all()
-        portfolio_item = None
-        if len(portfolio_items) > 1:
-            # Есть дубликаты - оставляем первую запись, остальные удаляем
-            portfolio_item = portfolio_items[0]
-            for duplicate in portfolio_items[1:]:
-                db_session.delete(duplicate)
-            db_session.commit()
-        elif len(portfolio_items) == 1:
-            portfolio_item = portfolio_items[0]
-        
-        # Проходим по транзакциям в хронологическом порядке и отслеживаем количество
-        # Если количество становится 0 или отрицательным, это означает полную продажу
-        # После этого начинаем считать среднюю цену только от новых покупок
-        # Используем FIFO (первая купленная - первая проданная)
-        current_quantity = 0
-        # Храним покупки как кортежи (цена, оставшееся_количество)
-        relevant_buy_transactions = []
-        
-        for trans in all_transactions:
-            if trans.operation_type == TransactionType.BUY:
-                current_quantity += trans.quantity
-                # Если количество было 0 или отрицательным перед этой покупкой,
-                # это означает, что позиция была полностью продана, начинаем считать заново
-                if current_quantity - trans.quantity <= 0:
-                    # Очищаем список покупок, начинаем считать с нуля
-                    relevant_buy_transactions = []
-                # Добавляем покупку с полным количеством
-                relevant_buy_transactions.append((trans.price, trans.quantity))
-            elif trans.operation_type == TransactionType.SELL:
-                sell_quantity = trans.quantity
-                current_quantity -= sell_quantity
-                
-                # Удаляем покупки по FIFO (первая купленная - первая проданная)
-                while sell_quantity > 0 and relevant_buy_transactions:
-                    buy_price, buy_remaining = relevant_buy_transactions[0]
-                    if buy_remaining <= sell_quantity:
-                        # Вся эта покупка была продана
-                        sell_quantity -= buy_remaining
-                        relevant_buy_transactions.pop(0)
-                    else:
-                        # Частично продана - уменьшаем оставшееся количество
-                        relevant_buy_transactions[0] = (buy_price, buy_remaining - sell_quantity)
-                        sell_quantity = 0
-                
-                # Если количество стало отрицательным, это ошибка данных, но обрабатываем
-                if current_quantity < 0:
-                    current_quantity = 0
+        portfolio_item = pf_query.first()
         
-        total_quantity = current_quantity
+        # Количество и стоимость берём из открытых лотов (open_lots): их по FIFO
+        # поддерживает lot_ledger при каждом изменении транзакций, поэтому
+        # проигрывать всю историю тикера здесь не нужно.
+        # Если позиция была полностью продана, лоты после новой покупки начинаются заново,
+        # и средняя цена считается только от новых покупок.
+        position = lot_ledger.get_positions(user_id, [ticker]).get(ticker.upper())
+        total_quantity = position['quantity'] if position else 0
         
         if total_quantity <= 0:
-            # Если количество <= 0, удаляем все позиции для этого тикера из портфеля
-            del_query = db_session.query(Portfolio).filter_by(ticker=ticker.upper())
-            if user_id is not None:
-                del_query = del_query.filter(Portfolio.user_id == user_id)
-            for item_to_delete in del_query.all():
-                db_session.delete(item_to_delete)
+            # Если количество <= 0, удаляем позицию из портфеля
+            if portfolio_item:
+                db_session.delete(portfolio_item)
             db_session.commit()
             return True
         
-        # Рассчитываем среднюю цену покупки только из релевантных транзакций покупки
-        if relevant_buy_transactions:
-            total_cost = sum(price * quantity for price, quantity in relevant_buy_transactions)
-            total_buy_quantity = sum(quantity for _, quantity in relevant_buy_transactions)
-            average_buy_price = total_cost / total_buy_quantity if total_buy_quantity > 0 else 0
-        else:
-            # Если нет релевантных транзакций покупки, но есть позиция, оставляем старую цену
-            # Если позиции нет, не создаем новую (нельзя иметь позицию без покупок)
-            if portfolio_item:
-                average_buy_price = portfolio_item.average_buy_price
-            else:
-                # Нет транзакций покупки и нет позиции - не создаем новую позицию
-                return True
+        # Средняя цена покупки — по остаткам непроданных покупок
+        average_buy_price = position['cost'] / total_quantity
         
         # Обновляем или создаем позицию в портфеле
         if portfolio_item:
@@ -2174,8 +2475,11 @@ def recalculate_portfolio_for_ticker(ticker, user_id=None):
         else:
             # Если позиции нет, но количество > 0 и есть транзакции покупки, создаем новую
             # Берем данные из последней транзакции
-            last_transaction = all_transactions[-1] if all_transactions else None
-            if last_transaction and relevant_buy_transactions:
+            txn_query = db_session.query(Transaction).filter(Transaction.ticker == ticker.upper())
+            if user_id is not None:
+                txn_query = txn_query.filter(Transaction.user_id == user_id)
+            last_transaction = txn_query.order_by(Transaction.date.desc(), Transaction.id.desc()).first()
+            if last_transaction:
                 new_item = Portfolio(
                     ticker=ticker.upper(),
                     user_id=user_id,
@@ -2195,6 +2499,68 @@ def recalculate_portfolio_for_ticker(ticker, user_id=None):
         return False
 
 
+def import_transactions_for_user(user_id: int, rows, dry_run: bool = False) -> dict:
+    """
+    Импортировать транзакции пакетом (см. TransactionImporter) и пересчитать
+    позиции портфеля — по одному разу на каждый затронутый тикер.
+    Используется эндпоинтом /api/transactions/import и scripts/import_transactions.py.
+    """
+    report = transaction_importer.import_rows(user_id, rows, dry_run=dry_run)
+    if report['imported']:
+        for ticker in report['tickers']:
+            recalculate_portfolio_for_ticker(ticker, user_id=user_id)
+    return report
+
+
+@app.route('/api/transactions/import', methods=['POST'])
+def import_transactions():
+    """
+    Массовый импорт транзакций из выгрузки брокера
+
+    Принимает файл (multipart, поле file: .csv или .json), JSON-тело
+    ({"transactions": [...]} или массив) либо CSV в теле запроса.
+    CSV читается из потока запроса построчно; JSON разбирается целиком.
+    Query параметры:
+    - dry_run=1: только проверить строки, ничего не записывая
+
+    Корректные строки импортируются, ошибки возвращаются по номерам строк.
+    """
+    try:
+        dry_run = request.args.get('dry_run', default=0, type=int) == 1
+        upload = request.files.get('file')
+        if upload:
+            rows = transaction_importer.iter_file(upload.stream, upload.filename or '')
+        elif request.is_json:
+            rows = transaction_importer.iter_json(request.get_json())
+        else:
+            rows = transaction_importer.iter_file(request.stream)
+
+        try:
+            report = import_transactions_for_user(current_user.id, rows, dry_run=dry_run)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': f'Не удалось разобрать файл: {e}'
+            }), 400
+
+        if report['imported']:
+            mark_portfolio_changed(*report['tickers'])
+            print(f"[{datetime.now(_MOSCOW_TZ)}] Импорт транзакций: пользователь {current_user.id}, "
+                  f"строк {report['imported']}, тикеров {len(report['tickers'])}, ошибок {len(report['errors'])}")
+
+        return jsonify({
+            'success': True,
+            'dry_run': dry_run,
+            **report
+        })
+    except Exception as e:
+        db_session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
 @app.route('/api/transactions/<int:transaction_id>', methods=['DELETE'])
 def delete_transaction(transaction_id):
     """
@@ -2212,38 +2578,28 @@ def delete_transaction(transaction_id):
                 'error': 'Транзакция не найдена'
             }), 404
         
-        # Сохраняем данные для пересчета баланса
         ticker = transaction.ticker
-        operation_type = transaction.operation_type
-        total = transaction.total
-        
-        # Обновляем баланс свободных денег (откатываем влияние транзакции)
-        balance = db_session.query(CashBalance).filter_by(user_id=current_user.id).first()
-        if not balance:
-            balance = CashBalance(user_id=current_user.id, balance=0.0)
-            db_session.add(balance)
+        cash_key = (transaction.date, transaction.id)
+        position_key = (transaction.ticker, transaction.date)
         
-        # Откатываем влияние удаляемой транзакции
-        if operation_type == TransactionType.SELL:
-            balance.balance -= total
-        elif operation_type == TransactionType.BUY:
-            # При удалении покупки восстанавливаем баланс
-            # Но мы не знаем точно, сколько было до покупки, если покупка обнулила баланс
-            # Поэтому просто добавляем сумму обратно (это не идеально, но лучше чем ничего)
-            balance.balance += total
-        
-        # Удаляем транзакцию
+        # Удаляем транзакцию и пересчитываем баланс с её места в журнале
+        old_lot_state = lot_ledger.snapshot(transaction)
         db_session.delete(transaction)
+        db_session.flush()
+        cash_balance = cash_ledger.on_transaction_changed(current_user.id, cash_key, commit=False)
+        position_timeline.on_transaction_changed(current_user.id, position_key, commit=False)
         db_session.commit()
+        lot_ledger.on_transaction_deleted(old_lot_state)
         
         # Пересчитываем портфель для этого тикера
         recalculate_portfolio_for_ticker(ticker, user_id=current_user.id)
+        mark_portfolio_changed(ticker)
         
         return jsonify({
             'success': True,
             'message': 'Транзакция успешно удалена',
             'ticker': ticker,
-            'cash_balance': balance.balance
+            'cash_balance': cash_balance
         })
         
     except Exception as e:
@@ -2277,6 +2633,64 @@ def get_cash_balance():
         }), 500
 
 
+def build_realized_pnl_report(user_id, session=None):
+    """
+    Отчёт о реализованной прибыли пользователя: один проход по всем транзакциям
+    (выборка колонок, без ORM-объектов) — см. services/realized_pnl.py
+    """
+    from sqlalchemy import select
+    rows = (session or read_session).execute(
+        select(
+            Transaction.id, Transaction.ticker, Transaction.date, Transaction.operation_type,
+            Transaction.price, Transaction.quantity,
+        ).where(Transaction.user_id == user_id)
+        .order_by(Transaction.date.asc(), Transaction.id.asc())
+        .execution_options(yield_per=1000)
+    )
+    return RealizedPnLReport().build(rows)
+
+
+@app.route('/api/reports/realized-pnl', methods=['GET'])
+def get_realized_pnl_report():
+    """
+    Реализованная прибыль/убыток по продажам (FIFO): закрытые лоты со сроком
+    владения, итоги по тикерам и по годам
+    
+    Query параметры:
+    - year: только продажи этого года (опционально)
+    - summary=1: без списка продаж — только итоги по годам и тикерам
+    
+    Ответ кэшируется по версии портфеля: пока транзакции не менялись,
+    повторные запросы (в том числе за другие годы) отдаются без пересчёта.
+    """
+    try:
+        year = request.args.get('year', type=int)
+        summary_only = request.args.get('summary') == '1'
+        cache_key = (current_user.id, current_user.portfolio_version or 0, year, summary_only)
+        etag = hashlib.sha1(repr(('realized_pnl', cache_key)).encode()).hexdigest()
+        cached = realized_pnl_cache.get(cache_key)
+        if etag in request.if_none_match or cached:
+            response = app.response_class(cached[1] if cached else b'', mimetype='application/json')
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response.make_conditional(request)
+
+        report = RealizedPnLReport.filter_year(build_realized_pnl_report(current_user.id), year)
+        if summary_only:
+            report = {k: v for k, v in report.items() if k != 'sales'}
+
+        response = jsonify({'success': True, 'version': current_user.portfolio_version or 0, **report})
+        realized_pnl_cache.put(cache_key, etag, response.get_data())
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
 @app.route('/api/currency-rates', methods=['GET'])
 def get_currency_rates():
     """
@@ -2396,8 +2810,8 @@ def get_price_history():
         # и конвертируем цену в рубли для облигаций.
         # Признак облигации определяем по тикеру (bond_info), а не по instrument_type
         # в истории — старые записи могут хранить неверный тип.
-        split_tickers = [ticker.upper()] if ticker else [i.ticker.upper() for i in portfolio_items]
-        split_coeffs_map = _get_split_coefficients_map(current_user.id, split_tickers)
+        # Множители сплитов пользователя заранее посчитаны по записям истории.
+        split_factors = split_adjusted_prices.factors(current_user.id, ticker=ticker)
 
         def process_history_item(item):
             ticker = item.get('ticker', '').upper()
@@ -2406,16 +2820,9 @@ def get_price_history():
                 or ticker in bond_info
             )
             # Приводим историческую цену к текущей шкале с учётом сплитов
-            logged_at_str = item.get('logged_at', '')
-            logged_at_dt = None
-            if logged_at_str:
-                try:
-                    logged_at_dt = datetime.strptime(logged_at_str, '%Y-%m-%d %H:%M:%S')
-                except Exception:
-                    logged_at_dt = None
-
             raw_price = item.get('price', 0)
-            adjusted_price = get_adjusted_price_for_date(raw_price, logged_at_dt, ticker, split_coeffs_map)
+            factor = split_factors.get(item.get('id'))
+            adjusted_price = raw_price * factor if factor is not None and raw_price is not None else raw_price
             item['price_original'] = raw_price
             item['price'] = adjusted_price
 
@@ -2485,12 +2892,94 @@ def get_price_history():
         }), 500
 
 
+def _portfolio_value_inputs(user_id):
+    """
+    Данные для стоимости портфеля по дням (график и выгрузка)
+
+    Количества берутся на каждую дату по истории позиций (position_changes),
+    а не сегодняшние: иначе точки до покупок и продаж неверны.
+
+    Returns:
+        (тикеры, quantities_on(день 'YYYY-MM-DD') -> количества в текущей шкале по тикеру,
+         облигации {тикер: номинал и валюта})
+    """
+    portfolio = db_session.query(Portfolio).filter_by(user_id=user_id).all()
+    timeline = position_timeline.load(user_id)
+    # Тикеры, проданные целиком, тоже входят в стоимость за даты владения
+    tickers = [p.ticker for p in portfolio]
+    tickers += sorted(set(timeline.tickers) - {(t or '').upper() for t in tickers})
+    if not tickers:
+        return tickers, lambda day: {}, {}
+
+    split_index = _get_split_index(user_id)
+    # Количество для графика должно совпадать с текущей шкалой портфеля:
+    # применяем тот же коэффициент сплита, что и в /api/portfolio.
+    today_date = datetime.now(_MOSCOW_TZ).date()
+    current = {}
+    for p in portfolio:
+        ticker_upper = (p.ticker or '').upper()
+        current[ticker_upper] = current.get(ticker_upper, 0.0) + (p.quantity or 0.0)
+    factors_now = {}
+    for t in tickers:
+        factor_now = _get_cumulative_split_factor_until((t or '').upper(), today_date, split_index)
+        factors_now[(t or '').upper()] = factor_now if factor_now and factor_now > 0 else 1.0
+
+    def quantities_on(day):
+        holdings = timeline.holdings_on(datetime.strptime(day, '%Y-%m-%d').date(), current)
+        return {t: q / factors_now.get(t, 1.0) for t, q in holdings.items()}
+
+    # Собираем информацию об облигациях из портфеля (номинал и валюта),
+    # чтобы корректно интерпретировать исторические цены в процентах.
+    bond_info = {}
+    for p in portfolio:
+        is_bond = False
+        if hasattr(p, 'instrument_type') and p.instrument_type:
+            if isinstance(p.instrument_type, InstrumentType):
+                is_bond = p.instrument_type == InstrumentType.BOND
+            elif isinstance(p.instrument_type, str):
+                is_bond = p.instrument_type == 'Облигация' or p.instrument_type == 'BOND'
+        # Дополнительная эвристика по тикеру
+        if not is_bond and (p.ticker.startswith('RU') or p.ticker.startswith('SU')) and len(p.ticker) > 10:
+            is_bond = True
+        if is_bond:
+            t = p.ticker.upper()
+            face = getattr(p, 'bond_facevalue', None) or 1000.0
+            curr = getattr(p, 'bond_currency', None) or 'SUR'
+            bond_info[t] = {'bond_facevalue': face, 'bond_currency': curr}
+    # Проданные целиком: номинал и валюта неизвестны — только эвристика по тикеру
+    for t in tickers[len(portfolio):]:
+        if (t.startswith('RU') or t.startswith('SU')) and len(t) > 10:
+            bond_info[t] = {'bond_facevalue': 1000.0, 'bond_currency': 'SUR'}
+    return tickers, quantities_on, bond_info
+
+
+def _history_price_rub(adjusted_price, ticker, bond_info):
+    """Цена из истории (уже в текущей шкале сплитов) в рублях; облигации — из % по номиналу и курсу"""
+    adjusted_price = adjusted_price or 0
+    price_rub = adjusted_price
+    if ticker in bond_info:
+        info = bond_info[ticker]
+        face = info['bond_facevalue'] or 1000.0
+        curr = (info.get('bond_currency') or 'SUR').strip() or 'SUR'
+        price_percent = adjusted_price or 0
+        price_in_nominal = (price_percent * face) / 100 if price_percent else 0
+        if curr not in ('SUR', 'RUB'):
+            try:
+                fx_rate = currency_service.get_rate_to_rub(curr)
+                price_rub = (price_in_nominal * fx_rate) if fx_rate and fx_rate > 0 else price_in_nominal
+            except Exception:
+                price_rub = price_in_nominal
+        else:
+            price_rub = price_in_nominal
+    return price_rub
+
+
 @app.route('/api/portfolio-value-history', methods=['GET'])
 @login_required
 def get_portfolio_value_history():
     """
     Рассчитать историю стоимости портфеля по дням на основе истории цен.
-    Использует текущие количества позиций и исторические цены.
+    Количества позиций берутся на каждую дату по истории позиций (position_changes), цены — из истории цен.
     Query: days (int) или date_from (YYYY-MM-DD) — точка старта; date_to (YYYY-MM-DD) — опционально.
     """
     from collections import defaultdict
@@ -2513,46 +3002,18 @@ def get_portfolio_value_history():
         else:
             date_to = datetime.now()
 
-        portfolio = db_session.query(Portfolio).filter_by(user_id=current_user.id).all()
-        if not portfolio:
+        tickers, quantities_on, bond_info = _portfolio_value_inputs(current_user.id)
+        if not tickers:
             return jsonify({'success': True, 'portfolio': [], 'imoex': []})
 
-        tickers = [p.ticker for p in portfolio]
-        split_coeffs_map = _get_split_coefficients_map(current_user.id, tickers)
-        # Количество для графика должно совпадать с текущей шкалой портфеля:
-        # применяем тот же коэффициент сплита, что и в /api/portfolio.
-        today_date = datetime.now(_MOSCOW_TZ).date()
-        quantities = {}
-        for p in portfolio:
-            ticker_upper = (p.ticker or '').upper()
-            factor_now = _get_cumulative_split_factor_until(ticker_upper, today_date, split_coeffs_map)
-            quantities[ticker_upper] = (p.quantity / factor_now) if factor_now and factor_now > 0 else p.quantity
-
-        # Собираем информацию об облигациях из портфеля (номинал и валюта),
-        # чтобы корректно интерпретировать исторические цены в процентах.
-        bond_info = {}
-        for p in portfolio:
-            is_bond = False
-            if hasattr(p, 'instrument_type') and p.instrument_type:
-                if isinstance(p.instrument_type, InstrumentType):
-                    is_bond = p.instrument_type == InstrumentType.BOND
-                elif isinstance(p.instrument_type, str):
-                    is_bond = p.instrument_type == 'Облигация' or p.instrument_type == 'BOND'
-            # Дополнительная эвристика по тикеру
-            if not is_bond and (p.ticker.startswith('RU') or p.ticker.startswith('SU')) and len(p.ticker) > 10:
-                is_bond = True
-            if is_bond:
-                t = p.ticker.upper()
-                face = getattr(p, 'bond_facevalue', None) or 1000.0
-                curr = getattr(p, 'bond_currency', None) or 'SUR'
-                bond_info[t] = {'bond_facevalue': face, 'bond_currency': curr}
-
         date_to_end = date_to.replace(hour=23, minute=59, second=59, microsecond=999999) if hasattr(date_to, 'replace') else date_to
-        history = db_session.query(PriceHistory).filter(
-            PriceHistory.ticker.in_(tickers),
-            PriceHistory.logged_at >= date_from,
-            PriceHistory.logged_at <= date_to_end
-        ).order_by(PriceHistory.logged_at).all()
+        history = db_session.execute(
+            split_adjusted_prices.select_prices(current_user.id, PriceHistory.logged_at, PriceHistory.ticker).where(
+                PriceHistory.ticker.in_(tickers),
+                PriceHistory.logged_at >= date_from,
+                PriceHistory.logged_at <= date_to_end
+            ).order_by(PriceHistory.logged_at)
+        ).all()
 
         # По каждому дню берём последнюю цену за день (как в скрипте portfolio_vs_history_snapshot),
         # облигации переводим из % в рубли по номиналу и курсу.
@@ -2560,28 +3021,15 @@ def get_portfolio_value_history():
         for h in history:
             date_key = h.logged_at.strftime('%Y-%m-%d')
             ticker = (h.ticker or '').upper()
+            daily_prices[date_key][ticker] = _history_price_rub(h.price, ticker, bond_info)
 
-            adjusted_price = get_adjusted_price_for_date(h.price or 0, h.logged_at, ticker, split_coeffs_map)
-            price_rub = adjusted_price or 0
-            if ticker in bond_info:
-                info = bond_info[ticker]
-                face = info['bond_facevalue'] or 1000.0
-                curr = (info.get('bond_currency') or 'SUR').strip() or 'SUR'
-                price_percent = adjusted_price or 0
-                price_in_nominal = (price_percent * face) / 100 if price_percent else 0
-                if curr not in ('SUR', 'RUB'):
-                    try:
-                        fx_rate = currency_service.get_rate_to_rub(curr)
-                        price_rub = (price_in_nominal * fx_rate) if fx_rate and fx_rate > 0 else price_in_nominal
-                    except Exception:
-                        price_rub = price_in_nominal
-                else:
-                    price_rub = price_in_nominal
-            daily_prices[date_key][ticker] = price_rub
-
+        # День без записи по тикеру (нет торгов, сбой сборщика) оценивается по его
+        # последней известной цене, иначе позиция выпадает из стоимости и график проседает
         portfolio_data = []
+        prices = {}
         for date_str in sorted(daily_prices.keys()):
-            prices = daily_prices[date_str]
+            prices.update(daily_prices[date_str])
+            quantities = quantities_on(date_str)
             total = sum(quantities.get((t or '').upper(), 0) * p for t, p in prices.items())
             if total > 0:
                 portfolio_data.append({'date': date_str, 'value': round(total, 2)})
@@ -2610,6 +3058,174 @@ def get_portfolio_value_history():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _export_date_arg(name, end_of_day=False):
+    """Дата из query-параметра (YYYY-MM-DD) или None; ValueError — неверный формат"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        parsed = datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f'Неверная дата {name}: ожидается YYYY-MM-DD')
+    return parsed.replace(hour=23, minute=59, second=59, microsecond=999999) if end_of_day else parsed
+
+
+def _export_response(name, fields, rows):
+    """
+    Потоковый ответ выгрузки: format=csv (по умолчанию) или jsonl, gzip=1 — файл .gz
+
+    Raises:
+        ValueError: неизвестный формат
+    """
+    fmt = (request.args.get('format') or 'csv').lower()
+    compress = request.args.get('gzip') == '1'
+    body = StreamingExport.encode(fmt, fields, rows, compress=compress)
+    filename = f"{name}_{datetime.now(_MOSCOW_TZ).strftime('%Y%m%d')}.{fmt}" + ('.gz' if compress else '')
+    response = app.response_class(
+        body, content_type='application/gzip' if compress else StreamingExport.FORMATS[fmt]
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx не должен буферизовать поток
+    return response
+
+
+@app.route('/api/export/transactions', methods=['GET'])
+def export_transactions():
+    """
+    Выгрузка транзакций (CSV подходит для POST /api/transactions/import)
+    
+    Query параметры: ticker, date_from, date_to (YYYY-MM-DD), format (csv/jsonl), gzip=1
+    """
+    try:
+        from sqlalchemy import select
+        statement = select(*[getattr(Transaction, f) for f in TRANSACTION_FIELDS]).where(
+            Transaction.user_id == current_user.id
+        )
+        ticker = request.args.get('ticker')
+        if ticker:
+            statement = statement.where(Transaction.ticker == ticker.upper())
+        date_from = _export_date_arg('date_from')
+        date_to = _export_date_arg('date_to', end_of_day=True)
+        if date_from:
+            statement = statement.where(Transaction.date >= date_from)
+        if date_to:
+            statement = statement.where(Transaction.date <= date_to)
+        statement = statement.order_by(Transaction.date.asc(), Transaction.id.asc())
+        return _export_response(
+            'transactions', TRANSACTION_FIELDS, StreamingExport.iter_query(read_engine, statement)
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+PRICE_HISTORY_EXPORT_FIELDS = (
+    'logged_at', 'ticker', 'company_name', 'price', 'change', 'change_percent', 'volume', 'instrument_type',
+)
+
+
+@app.route('/api/export/price-history', methods=['GET'])
+def export_price_history():
+    """
+    Выгрузка истории цен как она записана (без приведения к сплитам)
+    
+    Query параметры: ticker или tickers=SBER,GAZP (по умолчанию — все),
+    date_from, date_to (YYYY-MM-DD), format (csv/jsonl), gzip=1
+    """
+    try:
+        from sqlalchemy import select
+        statement = select(*[getattr(PriceHistory, f) for f in PRICE_HISTORY_EXPORT_FIELDS])
+        tickers = [
+            _normalize_ticker(t)
+            for t in (request.args.get('tickers') or request.args.get('ticker') or '').split(',') if t.strip()
+        ]
+        if tickers:
+            statement = statement.where(PriceHistory.ticker.in_(tickers))
+        date_from = _export_date_arg('date_from')
+        date_to = _export_date_arg('date_to', end_of_day=True)
+        if date_from:
+            statement = statement.where(PriceHistory.logged_at >= date_from)
+        if date_to:
+            statement = statement.where(PriceHistory.logged_at <= date_to)
+        statement = statement.order_by(PriceHistory.logged_at.asc(), PriceHistory.id.asc())
+        return _export_response(
+            'price_history', PRICE_HISTORY_EXPORT_FIELDS, StreamingExport.iter_query(read_engine, statement)
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+def _iter_portfolio_daily_values(user_id, tickers, quantities_on, bond_info, date_from=None, date_to=None):
+    """
+    (дата, стоимость) по дням — как /api/portfolio-value-history, но потоком:
+    история цен читается порциями по возрастанию даты, в памяти только последняя цена
+    по каждому тикеру (тикер без записи за день оценивается по ней)
+    """
+    statement = split_adjusted_prices.select_prices(user_id, PriceHistory.logged_at, PriceHistory.ticker).where(
+        PriceHistory.ticker.in_(tickers)
+    )
+    if date_from:
+        statement = statement.where(PriceHistory.logged_at >= date_from)
+    if date_to:
+        statement = statement.where(PriceHistory.logged_at <= date_to)
+    statement = statement.order_by(PriceHistory.logged_at.asc())
+
+    def day_value(day, prices):
+        quantities = quantities_on(day)
+        total = sum(quantities.get(t, 0) * p for t, p in prices.items())
+        return (day, round(total, 2)) if total > 0 else None
+
+    current_day, prices = None, {}
+    for row in StreamingExport.iter_query(read_engine, statement):
+        day = row.logged_at.strftime('%Y-%m-%d')
+        if day != current_day:
+            point = day_value(current_day, prices) if prices else None
+            if point:
+                yield point
+            current_day = day
+        # Последняя цена за день перекрывает предыдущие; цены прошлых дней остаются
+        # для тикеров, по которым за этот день записей нет
+        ticker = (row.ticker or '').upper()
+        prices[ticker] = _history_price_rub(row.price, ticker, bond_info)
+    point = day_value(current_day, prices) if prices else None
+    if point:
+        yield point
+
+
+@app.route('/api/export/portfolio-values', methods=['GET'])
+def export_portfolio_values():
+    """
+    Выгрузка стоимости портфеля по дням (количества на каждую дату по истории позиций и история цен)
+    
+    Query параметры: date_from, date_to (YYYY-MM-DD), format (csv/jsonl), gzip=1
+    """
+    try:
+        date_from = _export_date_arg('date_from')
+        date_to = _export_date_arg('date_to', end_of_day=True)
+        tickers, quantities_on, bond_info = _portfolio_value_inputs(current_user.id)
+        rows = _iter_portfolio_daily_values(
+            current_user.id, tickers, quantities_on, bond_info, date_from, date_to
+        ) if tickers else iter(())
+        return _export_response('portfolio_values', ('date', 'value'), rows)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
 @app.route('/api/delete-price-history', methods=['POST'])
 @login_required
 def delete_price_history():
@@ -2641,6 +3257,7 @@ def delete_price_history():
 
         count = query.count()
         query.delete(synchronize_session=False)
+        split_adjusted_prices.prune(commit=False)
         db_session.commit()
 
         period = f"{date_from} — {date_to}"
@@ -2656,6 +3273,24 @@ def delete_price_history():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _log_prices_job(progress):
+    """Фоновая задача ручного логирования цен"""
+    summary = price_logger.log_all_prices(force=True, progress=progress)
+    if summary is None:
+        raise RuntimeError('Логирование уже выполняется')
+    if summary.get('error'):
+        raise RuntimeError(summary['error'])
+    return summary
+
+
+def _cleanup_price_history_job(progress):
+    """Фоновая задача очистки дублей в истории цен"""
+    result = price_logger.cleanup_duplicate_history(progress=progress)
+    # История цен общая — сбрасываем кэш портфеля всех пользователей
+    touch_portfolio_version()
+    return result
+
+
 @app.route('/api/log-prices-now', methods=['POST'])
 def log_prices_now():
     """
@@ -2663,13 +3298,16 @@ def log_prices_now():
     
     Логирует цены даже если запись за сегодня уже есть
     В продакшене автоматическое логирование выполняется в настраиваемое время
+    
+    Выполняется фоновой задачей: возвращает job_id, статус — через /api/jobs/<job_id>
     """
     try:
-        price_logger.log_all_prices(force=True)
+        job_id = job_runner.submit('log_prices', _log_prices_job, user_id=current_user.id, single=True)
         return jsonify({
             'success': True,
-            'message': 'Цены успешно залогированы'
-        })
+            'job_id': job_id,
+            'message': 'Логирование цен запущено'
+        }), 202
     except Exception as e:
         return jsonify({
             'success': False,
@@ -2677,6 +3315,60 @@ def log_prices_now():
         }), 500
 
 
+@app.route('/api/price-history/cleanup', methods=['POST'])
+@login_required
+def cleanup_price_history():
+    """
+    Очистка истории цен: оставить по одной (последней) записи на день для каждого тикера.
+    Выполняется фоновой задачей, возвращает job_id.
+    """
+    try:
+        job_id = job_runner.submit(
+            'cleanup_price_history', _cleanup_price_history_job, user_id=current_user.id, single=True
+        )
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'message': 'Очистка истории цен запущена'
+        }), 202
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/jobs', methods=['GET'])
+@login_required
+def get_jobs():
+    """
+    Последние фоновые задачи текущего пользователя
+    Query: limit (по умолчанию 20)
+    """
+    try:
+        limit = request.args.get('limit', default=20, type=int)
+        jobs = db_session.query(BackgroundJob).filter(
+            BackgroundJob.user_id == current_user.id
+        ).order_by(BackgroundJob.created_at.desc()).limit(limit).all()
+        return jsonify({'success': True, 'jobs': [j.to_dict() for j in jobs]})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    """
+    Статус, прогресс и результат фоновой задачи.
+    Задачи логирования/очистки общие для всех пользователей, поэтому
+    статус доступен по id (случайный uuid) без привязки к автору.
+    """
+    try:
+        job = db_session.query(BackgroundJob).filter(BackgroundJob.id == job_id).first()
+        if not job:
+            return jsonify({'success': False, 'error': 'Задача не найдена'}), 404
+        return jsonify({'success': True, 'job': job.to_dict()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/settings/logging-time', methods=['GET'])
 def get_logging_time_setting():
     """
@@ -2708,14 +3400,19 @@ def get_scheduler_status():
             jobs.append({
                 'id': job.id,
                 'name': job.name,
-                'next_run_time': str(job.next_run_time) if job.next_run_time else None
+                # У задач незапущенного планировщика (не лидер) next_run_time ещё нет
+                'next_run_time': str(job.next_run_time) if getattr(job, 'next_run_time', None) else None
             })
         
         return jsonify({
             'success': True,
             'running': scheduler.running,
+            'mode': SCHEDULER_MODE,
+            'pid': os.getpid(),
+            'leader_pid': scheduler_leader_lock.holder_pid(),
             'jobs_count': len(scheduler.get_jobs()),
-            'jobs': jobs
+            'jobs': jobs,
+            'trading_calendar': trading_calendar.get_status()
         })
     except Exception as e:
         return jsonify({
@@ -2893,13 +3590,56 @@ def add_split_coefficient():
             coefficient=coefficient
         )
         db_session.add(row)
+        split_adjusted_prices.rebuild(current_user.id, ticker, commit=False)
         db_session.commit()
+        split_index_cache.invalidate(current_user.id)
+        mark_portfolio_changed(ticker)
         return jsonify({'success': True, 'item': row.to_dict()})
     except Exception as e:
         db_session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/split-coefficients/proposals', methods=['GET'])
+@login_required
+def get_split_proposals():
+    """Сплиты и консолидации из ISS по бумагам портфеля, для которых ещё нет коэффициента"""
+    try:
+        from sqlalchemy import func
+        last_sync = db_session.query(func.max(CorporateAction.fetched_at)).scalar()
+        return jsonify({
+            'success': True,
+            'items': [a.to_dict() for a in split_sync.proposals(current_user.id)],
+            'synced_at': last_sync.strftime('%Y-%m-%d %H:%M:%S') if last_sync else None,
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/split-coefficients/proposals/apply', methods=['POST'])
+@login_required
+def apply_split_proposals():
+    """
+    Добавить коэффициенты по предложенным событиям.
+    JSON:
+      { "ids": [1, 2] } — id из /api/split-coefficients/proposals (без ids — все предложенные)
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        ids = data.get('ids')
+        if ids is not None and not isinstance(ids, list):
+            return jsonify({'success': False, 'error': 'ids должен быть списком'}), 400
+        rows = split_sync.apply(current_user.id, [int(i) for i in ids] if ids is not None else None)
+        mark_portfolio_changed(*{row.ticker for row in rows})
+        return jsonify({'success': True, 'items': [row.to_dict() for row in rows]})
+    except ValueError as e:
+        db_session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        db_session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/split-coefficients/<int:item_id>', methods=['DELETE'])
 @login_required
 def delete_split_coefficient(item_id):
@@ -2911,8 +3651,12 @@ def delete_split_coefficient(item_id):
         ).first()
         if not row:
             return jsonify({'success': False, 'error': 'Запись не найдена'}), 404
+        ticker = row.ticker
         db_session.delete(row)
+        split_adjusted_prices.rebuild(current_user.id, ticker, commit=False)
         db_session.commit()
+        split_index_cache.invalidate(current_user.id)
+        mark_portfolio_changed(ticker)
         return jsonify({'success': True})
     except Exception as e:
         db_session.rollback()
@@ -2982,14 +3726,18 @@ def set_user_theme():
 def shutdown_session(exception=None):
     """Закрытие сессии БД после запроса"""
     db_session.remove()
+    read_session.remove()
 
 
 def close_db():
     """Закрытие соединения с БД при завершении приложения"""
     db_session.remove()
+    job_runner.shutdown()
+    market_data_writer.shutdown()
     # Останавливаем планировщик
     if scheduler.running:
         scheduler.shutdown()
+    scheduler_leader_lock.release()
 
 
 @app.route('/api/categories', methods=['GET'])
@@ -3315,12 +4063,13 @@ def hard_reset_portfolio():
         portfolio_count = db_session.query(Portfolio).filter_by(user_id=user_id).count()
         transactions_count = db_session.query(Transaction).filter_by(user_id=user_id).count()
 
+        lot_ledger.delete_user_lots(user_id)
+        position_timeline.delete_user_changes(user_id)
         db_session.query(Transaction).filter_by(user_id=user_id).delete()
         db_session.query(Portfolio).filter_by(user_id=user_id).delete()
 
-        cash = db_session.query(CashBalance).filter_by(user_id=user_id).first()
-        if cash:
-            cash.balance = 0.0
+        # Транзакций не осталось — журнал даёт нулевой баланс и удаляет снимки
+        cash_ledger.rebuild(user_id, commit=False)
 
         db_session.commit()
 
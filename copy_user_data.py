@@ -24,7 +24,9 @@ from models.database import db_session
 from models.user import User
 from models.portfolio import Portfolio
 from models.transaction import Transaction
-from models.cash_balance import CashBalance
+from services.cash_ledger import CashLedger
+from services.lot_ledger import LotLedger
+from services.position_timeline import PositionTimelineLedger
 
 def copy_user_data(from_username: str, to_username: str):
     src = db_session.query(User).filter_by(username=from_username).first()
@@ -86,21 +88,19 @@ def copy_user_data(from_username: str, to_username: str):
         db_session.add(new_tx)
         copied_tx += 1
 
-    # --- Денежный баланс ---
-    src_cash = db_session.query(CashBalance).filter_by(user_id=src.id).first()
-    dst_cash = db_session.query(CashBalance).filter_by(user_id=dst.id).first()
-    if src_cash:
-        if dst_cash:
-            dst_cash.balance = src_cash.balance
-        else:
-            db_session.add(CashBalance(user_id=dst.id, balance=src_cash.balance))
-
     db_session.commit()
 
+    # Открытые лоты (FIFO) для скопированных транзакций
+    LotLedger().rebuild_all(user_id=dst.id)
+    # История позиций: init_position_timeline заполняет только пустую таблицу
+    PositionTimelineLedger().rebuild_all(user_id=dst.id)
+    # Денежный баланс — проигрывание транзакций получателя (со снимками), а не копия чужого
+    balance = CashLedger().rebuild(dst.id)
+
     print(f"\nГотово! Скопировано из '{from_username}' → '{to_username}':")
     print(f"  Позиции в портфеле: {copied_portfolio} (пропущено дублей: {skipped_portfolio})")
     print(f"  Транзакции:         {copied_tx}")
-    print(f"  Денежный баланс:    {src_cash.balance if src_cash else 0} ₽")
+    print(f"  Денежный баланс:    {balance} ₽")
 
 
 if __name__ == '__main__':
@@ -1,14 +1,20 @@
 # Gunicorn configuration file
 import multiprocessing
+import os
 
 # --- Bind ---
 bind = "127.0.0.1:5000"
 
 # --- Workers ---
-# APScheduler требует ровно 1 воркер, иначе планировщик запустится несколько раз
-workers = 1
+# Планировщик запускается только в одном процессе (файловая блокировка scheduler.lock
+# рядом с БД), поэтому воркеров может быть несколько. Количество — через WEB_CONCURRENCY.
+# Чтобы вынести планировщик в отдельный процесс: SCHEDULER_MODE=external + scheduler_worker.py
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
 worker_class = "sync"
-threads = 4
+# Каждая открытая вкладка держит один поток под поток событий /api/events (SSE),
+# поэтому потоков больше, чем одновременных обычных запросов. Соединений SSE на процесс
+# не больше SSE_MAX_STREAMS (по умолчанию GUNICORN_THREADS - 4), сверх лимита — 503
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
 timeout = 120
 keepalive = 5
 
@@ -21,3 +27,11 @@ access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s'
 # --- Process ---
 daemon = False          # systemd сам управляет процессом
 preload_app = True      # загружать приложение до fork'а воркеров
+
+
+def post_fork(server, worker):
+    # С preload_app соединения пула SQLAlchemy открыты ещё в мастер-процессе;
+    # воркеры не должны делить их между собой — открывают свои
+    from models.database import engine, read_engine
+    engine.dispose(close=False)
+    read_engine.dispose(close=False)
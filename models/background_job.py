@@ -0,0 +1,53 @@
+"""
+Модель фоновых задач (ручное логирование цен, очистка истории и т.п.)
+"""
+import json
+from sqlalchemy import Column, Integer, String, Float, Text, DateTime, ForeignKey
+from datetime import datetime
+from models.database import Base
+
+
+class BackgroundJob(Base):
+    """
+    Фоновая задача, выполняемая вне потока HTTP-запроса.
+
+    Эндпоинт сразу возвращает id задачи, а UI опрашивает её статус
+    через /api/jobs/<id>.
+
+    status: pending -> running -> done / failed
+    progress: доля выполнения от 0 до 1
+    result: JSON с итогом выполнения
+    """
+    __tablename__ = 'background_jobs'
+
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=True, index=True)
+    kind = Column(String(50), nullable=False)        # log_prices / cleanup_price_history
+    status = Column(String(20), nullable=False, default='pending', index=True)
+    progress = Column(Float, default=0.0, nullable=False)
+    message = Column(String(500), nullable=True)     # Текущий шаг / текст ошибки
+    result = Column(Text, nullable=True)             # JSON-результат
+    created_at = Column(DateTime, default=datetime.now, nullable=False, index=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    owner = Column(String(100), nullable=True)       # Процесс-исполнитель: host:pid:время старта процесса
+
+    def __repr__(self):
+        return f'<BackgroundJob {self.kind} {self.id}: {self.status}>'
+
+    def to_dict(self):
+        try:
+            result = json.loads(self.result) if self.result else None
+        except ValueError:
+            result = None
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': round(self.progress or 0.0, 4),
+            'message': self.message,
+            'result': result,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None,
+            'started_at': self.started_at.strftime('%Y-%m-%d %H:%M:%S') if self.started_at else None,
+            'finished_at': self.finished_at.strftime('%Y-%m-%d %H:%M:%S') if self.finished_at else None,
+        }
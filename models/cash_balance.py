@@ -1,7 +1,7 @@
 """
 Модель для хранения баланса свободных денег от продаж активов
 """
-from sqlalchemy import Column, Integer, Float, ForeignKey
+from sqlalchemy import Column, Integer, Float, DateTime, ForeignKey
 from models.database import Base
 
 
@@ -10,13 +10,16 @@ class CashBalance(Base):
     Модель для хранения баланса свободных денег от продаж
     
     Хранит сумму рублей, полученных от продажи активов,
-    которая может быть использована для покупки новых активов
+    которая может быть использована для покупки новых активов.
+    Баланс выводится из транзакций журналом CashLedger (services/cash_ledger.py)
+    и здесь только хранится для чтения за O(1).
     """
     __tablename__ = 'cash_balance'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
     balance = Column(Float, default=0.0, nullable=False)  # Баланс в рублях
+    ledger_synced_at = Column(DateTime, nullable=True)  # Когда баланс последний раз посчитан журналом
     
     def __repr__(self):
         return f'<CashBalance {self.balance} ₽>'
@@ -0,0 +1,30 @@
+"""
+Снимки баланса свободных денег в журнале движения денег
+"""
+from datetime import datetime
+from sqlalchemy import Column, Integer, Float, DateTime, ForeignKey, Index
+from models.database import Base
+
+
+class CashBalanceSnapshot(Base):
+    """
+    Баланс пользователя после применения транзакции (transaction_date, transaction_id).
+
+    Снимки пишет CashLedger через каждые SNAPSHOT_EVERY транзакций: пересчёт
+    после изменения задним числом начинается с ближайшего более раннего снимка,
+    а не с первой транзакции. Снимки не раньше изменённой транзакции удаляются.
+    """
+    __tablename__ = 'cash_balance_snapshots'
+    __table_args__ = (
+        Index('idx_cash_snapshots_user_key', 'user_id', 'transaction_date', 'transaction_id'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
+    transaction_date = Column(DateTime, nullable=False)
+    transaction_id = Column(Integer, nullable=False)
+    balance = Column(Float, nullable=False)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    def __repr__(self):
+        return f'<CashBalanceSnapshot user={self.user_id} #{self.transaction_id} {self.balance} ₽>'
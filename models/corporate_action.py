@@ -0,0 +1,46 @@
+"""
+Модель сплитов и консолидаций акций, загруженных из MOEX ISS
+"""
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, UniqueConstraint
+from models.database import Base
+
+
+class CorporateAction(Base):
+    """
+    Локальный кэш сплитов/консолидаций из ISS (общий для всех пользователей).
+
+    before бумаг до события превращаются в after бумаг после него:
+    сплит 1:10 — before=1, after=10, консолидация 100:1 — before=100, after=1.
+    По этим записям SplitSync предлагает пользователям коэффициенты сплитов.
+    """
+    __tablename__ = 'corporate_actions'
+    __table_args__ = (
+        UniqueConstraint('ticker', 'trade_date', name='uq_corporate_actions_ticker_date'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ticker = Column(String(20), nullable=False)
+    trade_date = Column(Date, nullable=False)
+    before = Column(Float, nullable=False)
+    after = Column(Float, nullable=False)
+    fetched_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    @property
+    def coefficient(self) -> float:
+        """Коэффициент цены в терминах SplitCoefficient (сплит 1:10 — 0.1)"""
+        return self.before / self.after
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'ticker': self.ticker,
+            'effective_date': self.trade_date.strftime('%Y-%m-%d') if self.trade_date else None,
+            'before': self.before,
+            'after': self.after,
+            'coefficient': self.coefficient,
+            'fetched_at': self.fetched_at.strftime('%Y-%m-%d %H:%M:%S') if self.fetched_at else None,
+        }
+
+    def __repr__(self):
+        return f'<CorporateAction {self.ticker} {self.trade_date} {self.before}:{self.after}>'
@@ -2,7 +2,7 @@
 Настройка подключения к базе данных SQLite
 """
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -15,6 +15,20 @@ engine = create_engine(_db_url, echo=False)
 # Создаем сессию БД
 db_session = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
 
+# Отдельный пул соединений только для чтения (GET-эндпоинты вроде /api/portfolio).
+# Соединения открываются с PRAGMA query_only: случайная запись из такого запроса
+# упадёт с ошибкой, а не возьмёт блокировку записи SQLite у параллельных запросов.
+read_engine = create_engine(_db_url, echo=False)
+
+if read_engine.dialect.name == 'sqlite':
+    @event.listens_for(read_engine, 'connect')
+    def _set_query_only(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA query_only = ON')
+        cursor.close()
+
+read_session = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=read_engine))
+
 # Базовый класс для моделей
 Base = declarative_base()
 Base.query = db_session.query_property()
@@ -33,6 +47,15 @@ def init_db():
     from models.settings import Settings
     from models.user import User
     from models.access_log import AccessLog
+    from models.background_job import BackgroundJob
+    from models.open_lot import OpenLot
+    from models.portfolio_change import PortfolioChange
+    from models.cash_snapshot import CashBalanceSnapshot
+    from models.split_coefficient import SplitCoefficient
+    from models.split_price_factor import SplitPriceFactor
+    from models.corporate_action import CorporateAction
+    from models.position_change import PositionChange
+    from models.trading_day import TradingDay
     Base.metadata.create_all(bind=engine)
 
     # Миграция: добавляем недостающие колонки вручную (SQLite не знает ALTER TABLE ... ADD COLUMN IF NOT EXISTS)
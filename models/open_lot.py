@@ -0,0 +1,31 @@
+"""
+Модель открытых лотов (непроданных остатков покупок) по FIFO
+"""
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index
+from models.database import Base
+
+
+class OpenLot(Base):
+    """
+    Остаток одной покупки, ещё не закрытый продажами (FIFO).
+
+    Поддерживается сервисом LotLedger при добавлении, изменении и удалении
+    транзакций. Сумма remaining по тикеру — текущее количество в портфеле,
+    сумма price * remaining — стоимость покупки открытой позиции.
+    """
+    __tablename__ = 'open_lots'
+    __table_args__ = (
+        Index('idx_open_lots_user_ticker', 'user_id', 'ticker'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
+    ticker = Column(String(20), nullable=False)
+    transaction_id = Column(Integer, ForeignKey('transactions.id'), nullable=False, index=True)  # Транзакция покупки
+    buy_date = Column(DateTime, nullable=False)
+    price = Column(Float, nullable=False)       # Цена покупки (как ввёл пользователь, в рублях)
+    quantity = Column(Float, nullable=False)    # Куплено в транзакции
+    remaining = Column(Float, nullable=False)   # Ещё не продано
+
+    def __repr__(self):
+        return f'<OpenLot {self.ticker} {self.remaining}/{self.quantity} @ {self.price}>'
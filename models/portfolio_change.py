@@ -0,0 +1,29 @@
+"""
+Журнал изменений портфеля по версиям (для дельта-обновлений на клиенте)
+"""
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
+from models.database import Base
+
+
+class PortfolioChange(Base):
+    """
+    Какие тикеры затронуло увеличение users.portfolio_version.
+
+    На одну версию может приходиться несколько строк (по одной на тикер).
+    ticker = NULL означает изменение, затрагивающее весь портфель
+    (категории, типы активов, сброс) — клиенту нужна полная перезагрузка.
+    """
+    __tablename__ = 'portfolio_changes'
+    __table_args__ = (
+        Index('idx_portfolio_changes_user_version', 'user_id', 'version'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    version = Column(Integer, nullable=False)
+    ticker = Column(String(20), nullable=True)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    def __repr__(self):
+        return f'<PortfolioChange user={self.user_id} v{self.version} {self.ticker}>'
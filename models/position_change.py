@@ -0,0 +1,28 @@
+"""
+Модель точек изменения позиций (история количества бумаг по транзакциям)
+"""
+from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey, Index
+from models.database import Base
+
+
+class PositionChange(Base):
+    """
+    Количество бумаг тикера у пользователя на конец дня change_date.
+
+    Строка есть только для дней с транзакциями по тикеру; в остальные дни
+    действует последняя более ранняя строка (до первой — 0). Поддерживается
+    сервисом PositionTimelineLedger при добавлении, изменении и удалении транзакций.
+    """
+    __tablename__ = 'position_changes'
+    __table_args__ = (
+        Index('idx_position_changes_user_ticker_date', 'user_id', 'ticker', 'change_date', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
+    ticker = Column(String(20), nullable=False)
+    change_date = Column(Date, nullable=False)
+    quantity = Column(Float, nullable=False)  # Количество после последней транзакции дня (в шкале транзакций)
+
+    def __repr__(self):
+        return f'<PositionChange {self.ticker} {self.change_date} {self.quantity}>'
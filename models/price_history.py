@@ -1,7 +1,7 @@
 """
 Модель для хранения истории цен инструментов
 """
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum, Index
 from sqlalchemy.orm import relationship
 from models.database import Base
 from models.portfolio import InstrumentType
@@ -15,6 +15,10 @@ class PriceHistory(Base):
     Цены логируются каждый день в 00:00 МСК
     """
     __tablename__ = 'price_history'
+    __table_args__ = (
+        # История тикера за период и последние цены: WHERE ticker = ? AND logged_at ... ORDER BY logged_at
+        Index('idx_price_history_ticker_logged_at', 'ticker', 'logged_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     ticker = Column(String(20), nullable=False, index=True)
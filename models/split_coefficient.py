@@ -2,7 +2,7 @@
 Модель коэффициентов сплита/дробления акций.
 """
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, Index
 from models.database import Base
 
 
@@ -15,6 +15,9 @@ class SplitCoefficient(Base):
     на накопленный коэффициент всех сплитов после даты цены.
     """
     __tablename__ = 'split_coefficients'
+    __table_args__ = (
+        Index('idx_split_coefficients_user_ticker', 'user_id', 'ticker'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
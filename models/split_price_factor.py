@@ -0,0 +1,31 @@
+"""
+Модель множителей сплитов для записей истории цен (по пользователям)
+"""
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Index
+from models.database import Base
+
+
+class SplitPriceFactor(Base):
+    """
+    Множитель приведения записи price_history к текущей шкале пользователя.
+
+    История цен общая, а коэффициенты сплитов у каждого пользователя свои,
+    поэтому приведённая цена хранится не колонкой price_history, а здесь:
+    цена в текущей шкале = price_history.price * factor. Строки есть только
+    у записей, на которые действует хотя бы один сплит пользователя (нет строки —
+    множитель 1). Поддерживается сервисом SplitAdjustedPrices.
+    """
+    __tablename__ = 'split_price_factors'
+    __table_args__ = (
+        Index('idx_split_price_factors_user_price', 'user_id', 'price_history_id', unique=True),
+        Index('idx_split_price_factors_user_ticker', 'user_id', 'ticker'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    price_history_id = Column(Integer, nullable=False)
+    ticker = Column(String(20), nullable=False)
+    factor = Column(Float, nullable=False)
+
+    def __repr__(self):
+        return f'<SplitPriceFactor user={self.user_id} {self.ticker} #{self.price_history_id} x{self.factor}>'
@@ -0,0 +1,23 @@
+"""
+Модель календаря торговых дней MOEX (последняя загрузка из ISS)
+"""
+from sqlalchemy import Column, Date, DateTime, Boolean
+from models.database import Base
+
+
+class TradingDay(Base):
+    """
+    День календаря торгов фондового рынка из последней загрузки ISS.
+
+    Таблицу целиком перезаписывает TradingCalendar.refresh (задача планировщика),
+    читают её все процессы: период календаря — от первой до последней строки,
+    день внутри периода без строки неторговый.
+    """
+    __tablename__ = 'trading_days'
+
+    day = Column(Date, primary_key=True)
+    is_trading = Column(Boolean, nullable=False)
+    fetched_at = Column(DateTime, nullable=False)  # Время загрузки календаря из ISS
+
+    def __repr__(self):
+        return f'<TradingDay {self.day} {"торговый" if self.is_trading else "неторговый"}>'
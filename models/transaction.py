@@ -1,7 +1,7 @@
 """
 Модель для хранения истории покупок/продаж инструментов
 """
-from sqlalchemy import Column, Integer, String, Float, DateTime, Enum, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, Enum, ForeignKey, Index
 from models.database import Base
 from models.portfolio import InstrumentType
 from datetime import datetime
@@ -21,6 +21,13 @@ class Transaction(Base):
     Содержит всю информацию о совершённых операциях
     """
     __tablename__ = 'transactions'
+    __table_args__ = (
+        # Постраничная выдача журнала: WHERE user_id = ? ORDER BY date DESC, id DESC
+        Index('idx_transactions_user_date_id', 'user_id', 'date', 'id'),
+        # Операции тикера по порядку (пересчёт лотов, позиций, фильтр журнала по тикеру):
+        # WHERE user_id = ? AND ticker = ? ORDER BY date, id
+        Index('idx_transactions_user_ticker_date', 'user_id', 'ticker', 'date', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
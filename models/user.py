@@ -18,6 +18,8 @@ class User(Base):
     theme_color_panels = Column(String(7), nullable=True)       # основной цвет панелей, напр. "#1e3a5f"
     theme_color_header_text = Column(String(7), nullable=True)  # цвет заголовков столбцов
     theme_color_subtext = Column(String(7), nullable=True)      # цвет подписи в шапке таблиц
+    # Версия данных портфеля: увеличивается при любом изменении, влияющем на /api/portfolio
+    portfolio_version = Column(Integer, nullable=False, default=0)
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
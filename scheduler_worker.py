@@ -0,0 +1,45 @@
+"""
+Отдельный процесс планировщика задач (логирование цен, обновление календаря торгов)
+
+Запуск:
+    SCHEDULER_MODE=external gunicorn --config gunicorn.conf.py app:app   # веб без планировщика
+    python scheduler_worker.py                                            # планировщик
+
+Веб-воркеры в режиме external планировщик не запускают, поэтому gunicorn можно
+поднимать с любым числом воркеров. Планировщик использует ту же файловую
+блокировку, что и веб-воркеры: даже если процесс случайно запущен дважды
+(или веб-воркеры работают в режиме embedded), задачи выполняет только один.
+"""
+import os
+import signal
+import sys
+import threading
+
+os.environ['SCHEDULER_MODE'] = 'standalone'
+
+from app import scheduler, start_scheduler, close_db  # noqa: E402
+
+
+def main():
+    stop = threading.Event()
+
+    def handle_signal(signum, frame):
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    start_scheduler()
+    if scheduler.running:
+        print("Планировщик запущен в отдельном процессе")
+    else:
+        print("Планировщик уже работает в другом процессе, ожидаем освобождения блокировки...")
+
+    stop.wait()
+    print("Остановка планировщика...")
+    close_db()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
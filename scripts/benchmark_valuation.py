@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Замер скорости PortfolioValuationEngine на синтетических портфелях
+(10, 1 000 и 100 000 позиций; треть — облигации, часть — валютные и со сплитами).
+
+БД и MOEX не используются: замеряется только расчёт по колонкам и итоги.
+
+Запуск из корня проекта:
+  python scripts/benchmark_valuation.py
+  python scripts/benchmark_valuation.py --sizes 10 1000 100000 --repeat 5
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from services.valuation_engine import PortfolioValuationEngine  # type: ignore
+
+
+def make_columns(size: int, seed: int = 42) -> dict:
+    rng = random.Random(seed)
+    columns = PortfolioValuationEngine.empty_columns()
+    for _ in range(size):
+        is_bond = rng.random() < 0.33
+        has_lots = rng.random() < 0.9
+        lots_quantity = rng.choice([1, 10, 50, 100]) if has_lots else None
+        split = rng.choice([1.0, 1.0, 1.0, 10.0, 0.1])
+        columns['is_bond'].append(is_bond)
+        columns['quantity'].append(lots_quantity or rng.choice([1, 10, 100]))
+        columns['average_buy_price'].append(rng.uniform(50, 5000))
+        columns['lots_quantity'].append(lots_quantity)
+        columns['lots_cost'].append(lots_quantity * rng.uniform(50, 5000) if has_lots else None)
+        columns['current_price'].append(rng.uniform(80, 110) if is_bond else rng.uniform(10, 5000))
+        columns['has_quote'].append(rng.random() < 0.95)
+        columns['facevalue'].append(rng.choice([1000.0, 500.0, None]) if is_bond else None)
+        columns['fx_rate'].append(rng.choice([1.0, 1.0, 92.5]) if is_bond else 1.0)
+        columns['split_factor'].append(split)
+        columns['latest_adjust'].append(1.0)
+        columns['baseline_price'].append(rng.uniform(10, 5000) if rng.random() < 0.9 else None)
+        columns['baseline_adjust'].append(rng.choice([1.0, 1.0, split]))
+        columns['lotsize'].append(rng.choice([1, 10, 100]))
+    return columns
+
+
+def bench(size: int, repeat: int):
+    columns = make_columns(size)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        values = PortfolioValuationEngine.value(columns)
+        PortfolioValuationEngine.summarize(values, cash_balance=0.0)
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    print(f"{size:>8} позиций: лучшее {best * 1000:9.3f} мс, "
+          f"среднее {sum(timings) / len(timings) * 1000:9.3f} мс, "
+          f"{best / size * 1e6:6.3f} мкс/позицию")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер PortfolioValuationEngine")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        bench(size, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Проверка планов запросов горячих путей (EXPLAIN QUERY PLAN, SQLite).
+
+Выполняет функции приложения, которые читают портфель, транзакции, историю цен
+и сплиты, перехватывает отправленные в БД SELECT-запросы и строит для каждого
+план. Если хоть один запрос читает таблицу полным сканированием (SCAN без индекса),
+скрипт печатает запрос и план и завершается с кодом 1 — так пропущенный индекс
+виден до выкладки, а не по медленному графику.
+
+Запуск из корня проекта (индексы создаёт миграция при импорте приложения):
+  python scripts/check_query_plans.py                 # первый пользователь с транзакциями
+  python scripts/check_query_plans.py --user admin
+  python scripts/check_query_plans.py --verbose       # планы всех запросов
+  DATABASE_URL=sqlite:////tmp/empty.db python scripts/check_query_plans.py   # на чистой схеме
+"""
+
+import argparse
+import os
+import re
+import sys
+from datetime import datetime, timedelta
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(APP_DIR)
+sys.path.insert(0, APP_DIR)
+
+# Настраиваем DATABASE_URL так же, как в приложении
+db_url = os.environ.get("DATABASE_URL", f"sqlite:///{APP_DIR}/portfolio.db")
+os.environ.setdefault("DATABASE_URL", db_url)
+
+from sqlalchemy import event  # noqa: E402
+from flask_login import login_user  # noqa: E402
+import app as portfolio_app  # type: ignore  # noqa: E402
+from app import (  # type: ignore  # noqa: E402
+    app, db_session, read_session, engine, read_engine, User, Portfolio, Transaction,
+)
+
+# Таблицы-справочники из нескольких строк: полное чтение для них нормально
+SMALL_TABLES = {"settings", "users"}
+FULL_SCAN = re.compile(r"^SCAN (\w+)(?: AS \w+)?$")
+
+
+def collect_statements(user_id, tickers):
+    """Выполнить горячие пути приложения и вернуть перехваченные SELECT [(путь, sql, параметры)]"""
+    captured = []
+    current = {"name": None}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if current["name"] and statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            captured.append((current["name"], statement, parameters))
+
+    paths = [
+        ("Оценка портфеля: позиции и история цен",
+         lambda: portfolio_app._value_portfolio_positions(user_id, 1, True)),
+        ("Базовые цены для изменения за период",
+         lambda: portfolio_app._get_price_history_baselines(tickers, datetime.now() - timedelta(days=7),
+                                                            session=read_session)),
+        ("Открытые лоты", lambda: portfolio_app.lot_ledger.get_positions(user_id, tickers)),
+        ("Индекс сплитов", lambda: (portfolio_app.split_index_cache.invalidate(user_id),
+                                    portfolio_app.split_index_cache.get(user_id, read_session))),
+        ("Множители сплитов истории цен", lambda: portfolio_app.split_adjusted_prices.factors(user_id)),
+        ("История позиций", lambda: portfolio_app.position_timeline.load(user_id, read_session)),
+        ("Стоимость портфеля по дням",
+         lambda: list(portfolio_app._iter_portfolio_daily_values(
+             user_id, *portfolio_app._portfolio_value_inputs(user_id),
+             datetime.now() - timedelta(days=365), datetime.now()))),
+        ("Журнал денег", lambda: list(portfolio_app.cash_ledger.movements(user_id, session=read_session))),
+        ("Реализованный результат", lambda: portfolio_app.build_realized_pnl_report(user_id, read_session)),
+        ("Предложения сплитов", lambda: portfolio_app.split_sync.proposals(user_id)),
+        ("Транзакции: первая страница с итогами", lambda: _call_view(
+            user_id, "/api/transactions?limit=100&totals=1", portfolio_app.get_transactions)),
+        ("Транзакции: тикер и период", lambda: _call_view(
+            user_id, f"/api/transactions?limit=100&ticker={tickers[0] if tickers else 'SBER'}"
+                     "&date_from=2020-01-01&date_to=2030-01-01", portfolio_app.get_transactions)),
+    ]
+    if tickers:
+        ticker = tickers[0]
+        paths += [
+            ("Транзакции тикера (пересчёт лотов и позиций)", lambda: db_session.query(Transaction).filter(
+                Transaction.user_id == user_id, Transaction.ticker == ticker
+            ).order_by(Transaction.date.asc(), Transaction.id.asc()).all()),
+            ("Позиция тикера", lambda: db_session.query(Portfolio).filter(
+                Portfolio.user_id == user_id, Portfolio.ticker == ticker
+            ).first()),
+            ("История цен тикера за период", lambda: portfolio_app.price_logger.get_price_history(
+                ticker=ticker, date_from="2020-01-01", date_to="2030-01-01")),
+        ]
+
+    for target in (engine, read_engine):
+        event.listen(target, "before_cursor_execute", before_cursor_execute)
+    try:
+        for name, run in paths:
+            current["name"] = name
+            try:
+                run()
+            except Exception as e:
+                print(f"  [{name}] ошибка выполнения: {e}")
+            finally:
+                db_session.rollback()
+    finally:
+        current["name"] = None
+        for target in (engine, read_engine):
+            event.remove(target, "before_cursor_execute", before_cursor_execute)
+    return captured
+
+
+def _call_view(user_id, url, view):
+    with app.test_request_context(url):
+        login_user(db_session.get(User, user_id))
+        return view()
+
+
+def full_scans(plan_rows, tables_in_db):
+    """Таблицы, которые план читает целиком (SCAN подзапросов и CTE не в счёт)"""
+    tables = []
+    for row in plan_rows:
+        match = FULL_SCAN.match(row[-1])
+        if match and match.group(1) in tables_in_db and match.group(1) not in SMALL_TABLES:
+            tables.append(match.group(1))
+    return tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка планов запросов горячих путей")
+    parser.add_argument("--user", help="Пользователь (username), по умолчанию — первый с транзакциями")
+    parser.add_argument("--verbose", action="store_true", help="Печатать планы всех запросов")
+    args = parser.parse_args()
+
+    if engine.dialect.name != "sqlite":
+        print("Проверка поддерживает только SQLite.")
+        return 1
+
+    if args.user:
+        user = db_session.query(User).filter_by(username=args.user).first()
+        if not user:
+            print(f"Пользователь '{args.user}' не найден.")
+            return 1
+        user_id = user.id
+    else:
+        user_id = db_session.query(Transaction.user_id).filter(Transaction.user_id.isnot(None)).limit(1).scalar() \
+            or db_session.query(User.id).order_by(User.id).limit(1).scalar()
+    tickers = [row.ticker for row in db_session.query(Portfolio.ticker).filter(Portfolio.user_id == user_id)]
+
+    statements = collect_statements(user_id, tickers)
+    seen = set()
+    failures = 0
+    with engine.connect() as conn:
+        tables_in_db = {row[0] for row in conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )}
+        for name, statement, parameters in statements:
+            if statement in seen:
+                continue
+            seen.add(statement)
+            plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+            scans = full_scans(plan, tables_in_db)
+            if scans or args.verbose:
+                print(f"[{'SCAN' if scans else 'ok'}] {name}: {', '.join(scans) if scans else ''}")
+                print("    " + " ".join(statement.split()))
+                for row in plan:
+                    print(f"      {row[-1]}")
+            failures += bool(scans)
+
+    print(f"Проверено запросов: {len(seen)}, с полным сканированием таблиц: {failures}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Массовый импорт транзакций пользователя из выгрузки брокера (CSV или JSON).
+
+Строки проверяются и вставляются одной транзакцией БД, позиции портфеля
+пересчитываются по одному разу на тикер (как POST /api/transactions/import).
+
+Запуск из корня проекта:
+  python scripts/import_transactions.py <username> <файл.csv|файл.json>
+  python scripts/import_transactions.py <username> <файл> --dry-run   # только проверка
+"""
+
+import argparse
+import os
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(APP_DIR)
+sys.path.insert(0, APP_DIR)
+
+# Настраиваем DATABASE_URL так же, как в приложении
+db_url = os.environ.get("DATABASE_URL", f"sqlite:///{APP_DIR}/portfolio.db")
+os.environ.setdefault("DATABASE_URL", db_url)
+
+from app import (  # type: ignore  # noqa: E402
+    db_session, User, transaction_importer, import_transactions_for_user, touch_portfolio_version,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Импорт транзакций из выгрузки брокера")
+    parser.add_argument("username")
+    parser.add_argument("path", help="Файл .csv или .json")
+    parser.add_argument("--dry-run", action="store_true", help="Только проверить строки")
+    args = parser.parse_args()
+
+    user = db_session.query(User).filter_by(username=args.username).first()
+    if not user:
+        print(f"Пользователь '{args.username}' не найден.")
+        return 1
+
+    with open(args.path, "rb") as f:
+        try:
+            rows = transaction_importer.iter_file(f, os.path.basename(args.path))
+            report = import_transactions_for_user(user.id, rows, dry_run=args.dry_run)
+        except ValueError as e:
+            print(f"Не удалось разобрать файл: {e}")
+            return 1
+
+    if report["imported"]:
+        touch_portfolio_version(user.id, report["tickers"])
+
+    for error in report["errors"]:
+        print(f"  строка {error['row']}: {error['error']}")
+    if args.dry_run:
+        print(f"Проверка: корректных строк {report['valid']}, ошибок {len(report['errors'])}")
+    else:
+        print(f"Импортировано транзакций: {report['imported']}, тикеров: {len(report['tickers'])}, "
+              f"ошибок: {len(report['errors'])}")
+        if report["cash_balance"] is not None:
+            print(f"Баланс свободных денег: {report['cash_balance']:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
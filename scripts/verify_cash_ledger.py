@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Сверка балансов свободных денег с журналом движения денег (по транзакциям).
+
+Полностью проигрывает транзакции каждого пользователя и сравнивает результат
+с сохранённым балансом и снимками журнала.
+
+Запуск из корня проекта:
+  python scripts/verify_cash_ledger.py            # только проверить
+  python scripts/verify_cash_ledger.py --fix      # пересчитать баланс у пользователей с расхождениями
+  python scripts/verify_cash_ledger.py --user admin
+"""
+
+import argparse
+import os
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(APP_DIR)
+sys.path.insert(0, APP_DIR)
+
+# Настраиваем DATABASE_URL так же, как в приложении
+db_url = os.environ.get("DATABASE_URL", f"sqlite:///{APP_DIR}/portfolio.db")
+os.environ.setdefault("DATABASE_URL", db_url)
+
+from app import db_session, User, cash_ledger, touch_portfolio_version  # type: ignore  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сверка баланса свободных денег с журналом")
+    parser.add_argument("--user", help="Только этот пользователь (username)")
+    parser.add_argument("--fix", action="store_true", help="Пересчитать баланс при расхождении")
+    args = parser.parse_args()
+
+    user_id = None
+    if args.user:
+        user = db_session.query(User).filter_by(username=args.user).first()
+        if not user:
+            print(f"Пользователь '{args.user}' не найден.")
+            return 1
+        user_id = user.id
+
+    problems = cash_ledger.verify(user_id)
+    if not problems:
+        print("Расхождений нет.")
+        return 0
+
+    for p in problems:
+        print(f"Пользователь {p['user_id']}: сохранено {p['stored']:.2f}, по журналу {p['expected']:.2f}, "
+              f"неверных снимков {p['bad_snapshots']}")
+        if args.fix:
+            balance = cash_ledger.rebuild(p['user_id'])
+            touch_portfolio_version(p['user_id'])
+            print(f"  пересчитано: {balance:.2f}")
+    return 0 if args.fix else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Журнал движения свободных денег, выводимый из транзакций
+
+Раньше CashBalance.balance менялся на месте при добавлении и удалении транзакций
+(а при изменении — не менялся вовсе), поэтому его нельзя было ни пересчитать,
+ни проверить. Теперь баланс — результат проигрывания транзакций пользователя
+в порядке (date, id), а CashBalance только хранит последний результат.
+"""
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+from sqlalchemy import select, or_, and_
+from models.database import db_session, read_session
+from models.cash_balance import CashBalance
+from models.cash_snapshot import CashBalanceSnapshot
+from models.transaction import Transaction, TransactionType
+
+# Ключ транзакции в журнале: (дата, id)
+LedgerKey = Tuple[datetime, int]
+
+
+class CashLedger:
+    """
+    Правила движения денег те же, что были у add_transaction:
+    продажа добавляет сумму к балансу, покупка вычитает её, но не ниже нуля
+    (покупка больше баланса обнуляет его — недостающее внесено извне).
+
+    Каждые SNAPSHOT_EVERY транзакций сохраняется снимок баланса. Изменение
+    транзакции с ключом K удаляет снимки с ключом >= K и проигрывает
+    транзакции только от ближайшего более раннего снимка.
+    """
+
+    SNAPSHOT_EVERY = 100
+    TOLERANCE = 0.005  # Расхождение меньше копейки не считаем ошибкой
+
+    @staticmethod
+    def apply(balance: float, operation_type: TransactionType, total: float) -> float:
+        """Баланс после транзакции"""
+        if operation_type == TransactionType.SELL:
+            return balance + total
+        return balance - total if total < balance else 0.0
+
+    @staticmethod
+    def _after(date_column, id_column, key: LedgerKey):
+        """Условие «ключ строки больше key»"""
+        return or_(date_column > key[0], and_(date_column == key[0], id_column > key[1]))
+
+    def _transactions(self, user_id: Optional[int], after: Optional[LedgerKey] = None, session=None):
+        query = select(
+            Transaction.id, Transaction.date, Transaction.operation_type, Transaction.total
+        ).where(Transaction.user_id == user_id)
+        if after is not None:
+            query = query.where(self._after(Transaction.date, Transaction.id, after))
+        query = query.order_by(Transaction.date.asc(), Transaction.id.asc())
+        return (session or db_session).execute(query.execution_options(yield_per=1000))
+
+    def movements(self, user_id: Optional[int], session=None) -> Iterator[dict]:
+        """Движения денег пользователя по всем транзакциям (полное проигрывание с нуля)"""
+        balance = 0.0
+        for row in self._transactions(user_id, session=session):
+            new_balance = self.apply(balance, row.operation_type, row.total)
+            yield {
+                'transaction_id': row.id,
+                'date': row.date,
+                'amount': new_balance - balance,
+                'balance': new_balance,
+            }
+            balance = new_balance
+
+    # --- Пересчёт ---
+
+    def rebuild(self, user_id: Optional[int], since: Optional[LedgerKey] = None, commit: bool = True) -> float:
+        """
+        Пересчитать баланс, начиная с транзакции с ключом since (None — с самого начала)
+
+        Returns:
+            Текущий баланс
+        """
+        # Сессия без autoflush: несохранённые изменения транзакций должны попасть в выборку
+        db_session.flush()
+        snapshots = db_session.query(CashBalanceSnapshot).filter(CashBalanceSnapshot.user_id == user_id)
+        if since is None:
+            snapshots.delete(synchronize_session=False)
+            base = None
+        else:
+            since_date, since_id = since
+            snapshots.filter(or_(
+                CashBalanceSnapshot.transaction_date > since_date,
+                and_(CashBalanceSnapshot.transaction_date == since_date,
+                     CashBalanceSnapshot.transaction_id >= since_id),
+            )).delete(synchronize_session=False)
+            base = snapshots.order_by(
+                CashBalanceSnapshot.transaction_date.desc(), CashBalanceSnapshot.transaction_id.desc()
+            ).first()
+
+        balance = base.balance if base else 0.0
+        after = (base.transaction_date, base.transaction_id) if base else None
+        new_snapshots = []
+        for count, row in enumerate(self._transactions(user_id, after), start=1):
+            balance = self.apply(balance, row.operation_type, row.total)
+            if count % self.SNAPSHOT_EVERY == 0:
+                new_snapshots.append({
+                    'user_id': user_id, 'transaction_date': row.date, 'transaction_id': row.id,
+                    'balance': balance, 'created_at': datetime.now(),
+                })
+        if new_snapshots:
+            db_session.execute(CashBalanceSnapshot.__table__.insert(), new_snapshots)
+
+        stored = db_session.query(CashBalance).filter_by(user_id=user_id).first()
+        if not stored:
+            stored = CashBalance(user_id=user_id, balance=0.0)
+            db_session.add(stored)
+        stored.balance = balance
+        stored.ledger_synced_at = datetime.now()
+        if commit:
+            db_session.commit()
+        return balance
+
+    def on_transaction_changed(self, user_id: Optional[int], *keys: LedgerKey, commit: bool = True) -> float:
+        """
+        Пересчитать баланс после добавления, изменения или удаления транзакций
+
+        Args:
+            keys: ключи (date, id) затронутых транзакций — для изменённой
+                  передаются старый и новый ключ
+        """
+        return self.rebuild(user_id, since=min(keys) if keys else None, commit=commit)
+
+    # --- Проверка ---
+
+    def verify(self, user_id: Optional[int] = None) -> List[dict]:
+        """
+        Сверить сохранённые балансы и снимки с полным проигрыванием транзакций
+
+        Returns:
+            Расхождения: [{'user_id', 'stored', 'expected', 'bad_snapshots'}]
+        """
+        query = read_session.query(CashBalance.user_id, CashBalance.balance)
+        if user_id is not None:
+            query = query.filter(CashBalance.user_id == user_id)
+        stored_balances = dict(query.all())
+        tx_users = read_session.query(Transaction.user_id).distinct()
+        if user_id is not None:
+            tx_users = tx_users.filter(Transaction.user_id == user_id)
+        user_ids = set(stored_balances) | {row.user_id for row in tx_users}
+
+        problems = []
+        for uid in sorted(user_ids, key=lambda u: (u is None, u)):
+            snapshots = {
+                row.transaction_id: row.balance
+                for row in read_session.query(CashBalanceSnapshot.transaction_id, CashBalanceSnapshot.balance)
+                .filter(CashBalanceSnapshot.user_id == uid)
+            }
+            expected = 0.0
+            bad_snapshots = 0
+            for movement in self.movements(uid, session=read_session):
+                expected = movement['balance']
+                snapshot = snapshots.pop(movement['transaction_id'], None)
+                if snapshot is not None and abs(snapshot - expected) > self.TOLERANCE:
+                    bad_snapshots += 1
+            # Снимки удалённых транзакций тоже ошибка
+            bad_snapshots += len(snapshots)
+
+            stored = stored_balances.get(uid, 0.0) or 0.0
+            if abs(stored - expected) > self.TOLERANCE or bad_snapshots:
+                problems.append({
+                    'user_id': uid,
+                    'stored': stored,
+                    'expected': expected,
+                    'bad_snapshots': bad_snapshots,
+                })
+        return problems
@@ -0,0 +1,219 @@
+"""
+Поток событий портфеля для браузера (Server-Sent Events)
+
+Раньше каждая открытая вкладка раз в минуту опрашивала /api/price-history,
+чтобы узнать о новой записи цен. Теперь в каждом процессе один фоновый поток
+опрашивает БД за всех подписчиков и рассылает события по открытым
+соединениям /api/events:
+- price_log — завершилась запись цен в price_history;
+- portfolio_version — изменилась версия портфеля пользователя;
+- quotes — в позиции пользователя записаны свежие цены (кэш котировок).
+
+Источник событий — БД, поэтому события доходят до вкладок, подключённых
+к любому воркеру gunicorn, в том числе о записях отдельного процесса планировщика.
+
+Каждое соединение занимает поток gthread-воркера на всё время жизни, поэтому
+их число в процессе ограничено MAX_SUBSCRIBERS: сверх лимита /api/events
+отвечает 503, и вкладка остаётся на периодическом опросе, пока слот не освободится.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from typing import Dict, Iterator, Optional
+from sqlalchemy import func
+from sqlalchemy.orm import sessionmaker
+from models.database import read_engine
+from models.portfolio import Portfolio
+from models.price_history import PriceHistory
+from models.user import User
+
+
+class _Subscription:
+    """Одно открытое соединение /api/events"""
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.queue: "queue.Queue" = queue.Queue(maxsize=100)
+
+    def put(self, event: str, data: dict):
+        try:
+            self.queue.put_nowait((event, data))
+        except queue.Full:
+            # Клиент не успевает читать — пропускаем, следующее событие всё равно придёт
+            pass
+
+
+class PortfolioEventPublisher:
+    """
+    Публикатор событий портфеля для всех подписчиков процесса
+
+    Поток опроса запускается при первой подписке и останавливается,
+    когда подписчиков не остаётся. За один цикл выполняется три запроса
+    независимо от количества открытых вкладок.
+    """
+
+    POLL_INTERVAL = 5.0        # Секунд между опросами БД
+    HEARTBEAT_INTERVAL = 15.0  # Комментарий-пинг, чтобы прокси не закрывали соединение
+    MAX_STREAM_DURATION = 600  # Соединение закрывается, браузер переподключается сам
+    RETRY_MS = 5000            # Задержка переподключения EventSource
+    BUSY_RETRY_MS = 60000      # Через сколько повторить подключение после отказа 503
+    # Соединений на процесс: по умолчанию на 4 меньше потоков воркера (GUNICORN_THREADS),
+    # чтобы открытые вкладки не занимали потоки, нужные обычным запросам
+    MAX_SUBSCRIBERS = int(os.environ.get(
+        'SSE_MAX_STREAMS', max(1, int(os.environ.get('GUNICORN_THREADS', 16)) - 4)
+    ))
+
+    def __init__(self):
+        self._subscribers: Dict[int, _Subscription] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._session_factory = sessionmaker(bind=read_engine)
+
+        # Последние разосланные значения
+        self._last_log_at = None
+        self._pending_log_at = None
+        self._versions: Dict[int, int] = {}
+        self._quote_marks: Dict[int, object] = {}
+
+    # --- Подписки ---
+
+    def subscribe(self, user_id: int) -> Optional[_Subscription]:
+        """Новая подписка или None, если в процессе уже MAX_SUBSCRIBERS соединений"""
+        subscription = _Subscription(user_id)
+        with self._lock:
+            if len(self._subscribers) >= self.MAX_SUBSCRIBERS:
+                return None
+            self._subscribers[id(subscription)] = subscription
+            # Поток запускаем лениво: при preload_app потоки мастер-процесса не переживают fork
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='portfolio-events', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription: _Subscription):
+        with self._lock:
+            self._subscribers.pop(id(subscription), None)
+
+    def notify(self):
+        """Опросить БД без ожидания интервала (после записи в этом процессе)"""
+        self._wakeup.set()
+
+    def _publish(self, event: str, data: dict, user_id: Optional[int] = None):
+        with self._lock:
+            subscribers = list(self._subscribers.values())
+        for subscription in subscribers:
+            if user_id is None or subscription.user_id == user_id:
+                subscription.put(event, data)
+
+    # --- Опрос БД ---
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    # Без подписчиков состояние устаревает — при следующем запуске набираем заново
+                    self._last_log_at = self._pending_log_at = None
+                    self._versions.clear()
+                    self._quote_marks.clear()
+                    return
+                user_ids = {s.user_id for s in self._subscribers.values()}
+            try:
+                self.poll(user_ids)
+            except Exception as e:
+                print(f"[PortfolioEventPublisher] Ошибка опроса БД: {e}")
+            self._wakeup.wait(self.POLL_INTERVAL)
+            self._wakeup.clear()
+
+    def poll(self, user_ids):
+        """Один цикл: сравнить состояние БД с предыдущим и разослать события"""
+        session = self._session_factory()
+        try:
+            self._poll_price_log(session)
+            self._poll_versions(session, user_ids)
+            self._poll_quotes(session, user_ids)
+        finally:
+            session.close()
+
+    def _poll_price_log(self, session):
+        logged_at = session.query(func.max(PriceHistory.logged_at)).scalar()
+        if self._last_log_at is None:
+            self._last_log_at = self._pending_log_at = logged_at
+            return
+        # Запись цен идёт несколько секунд по тикерам: сообщаем, когда новые записи перестали появляться
+        if logged_at != self._pending_log_at:
+            self._pending_log_at = logged_at
+        elif logged_at != self._last_log_at:
+            self._last_log_at = logged_at
+            self._publish('price_log', {
+                'logged_at': logged_at.strftime('%Y-%m-%d %H:%M:%S') if logged_at else None
+            })
+
+    def _poll_versions(self, session, user_ids):
+        rows = session.query(User.id, User.portfolio_version).filter(User.id.in_(user_ids)).all()
+        for user_id, version in rows:
+            version = version or 0
+            previous = self._versions.get(user_id)
+            self._versions[user_id] = version
+            if previous is not None and version != previous:
+                self._publish('portfolio_version', {'version': version}, user_id=user_id)
+
+    def _poll_quotes(self, session, user_ids):
+        new_users = [u for u in user_ids if u not in self._quote_marks]
+        if new_users:
+            for user_id, mark in session.query(
+                Portfolio.user_id, func.max(Portfolio.current_price_updated_at)
+            ).filter(Portfolio.user_id.in_(new_users)).group_by(Portfolio.user_id).all():
+                self._quote_marks[user_id] = mark
+            for user_id in new_users:
+                self._quote_marks.setdefault(user_id, None)
+
+        known = [u for u in user_ids if u not in new_users]
+        if not known:
+            return
+        marks = [self._quote_marks[u] for u in known if self._quote_marks[u] is not None]
+        query = session.query(
+            Portfolio.user_id, Portfolio.ticker, Portfolio.current_price, Portfolio.current_price_updated_at
+        ).filter(
+            Portfolio.user_id.in_(known),
+            Portfolio.current_price_updated_at.isnot(None)
+        )
+        if len(marks) == len(known):
+            query = query.filter(Portfolio.current_price_updated_at > min(marks))
+
+        updates: Dict[int, list] = {}
+        for user_id, ticker, price, updated_at in query.all():
+            mark = self._quote_marks.get(user_id)
+            if mark is not None and updated_at <= mark:
+                continue
+            updates.setdefault(user_id, []).append((ticker, price, updated_at))
+        for user_id, items in updates.items():
+            self._quote_marks[user_id] = max(updated_at for _, _, updated_at in items)
+            self._publish('quotes', {
+                'quotes': [{'ticker': ticker, 'current_price': price} for ticker, price, _ in items]
+            }, user_id=user_id)
+
+    # --- SSE ---
+
+    def stream(self, subscription: _Subscription) -> Iterator[str]:
+        """
+        Генератор тела ответа text/event-stream для одного соединения
+
+        Подписку берёт вызывающий код (subscribe) до начала ответа, чтобы при
+        отказе успеть ответить 503; отписка — здесь и при закрытии ответа.
+        """
+        try:
+            yield f'retry: {self.RETRY_MS}\n\n'
+            deadline = time.monotonic() + self.MAX_STREAM_DURATION
+            while time.monotonic() < deadline:
+                try:
+                    event, data = subscription.queue.get(timeout=self.HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+        finally:
+            self.unsubscribe(subscription)
@@ -0,0 +1,195 @@
+"""
+Сервис фонового выполнения длительных операций
+
+Ручное логирование цен, очистка истории и т.п. не должны занимать поток
+HTTP-запроса (gunicorn timeout = 120 с). Задача ставится в очередь,
+эндпоинт сразу возвращает её id, а UI опрашивает /api/jobs/<id>.
+"""
+import json
+import os
+import socket
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+from sqlalchemy.orm import sessionmaker
+from models.database import db_session, engine
+from models.background_job import BackgroundJob
+
+
+class JobRunner:
+    """
+    Исполнитель фоновых задач внутри процесса
+
+    Состояние задач (статус, прогресс, результат) хранится в таблице
+    background_jobs, поэтому его видят все потоки и воркеры.
+    Задача — функция, принимающая callback progress(fraction, message=None)
+    и возвращающая JSON-сериализуемый результат.
+    """
+
+    PROGRESS_WRITE_INTERVAL = 1.0       # Не чаще раза в секунду пишем прогресс в БД
+    JOB_RETENTION = timedelta(days=7)   # Сколько хранить завершённые задачи
+
+    def __init__(self, max_workers: int = 2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        # Отдельная фабрика сессий: статус задачи пишется своими короткими транзакциями
+        # и не коммитит изменения, которые задача накапливает в db_session
+        self._session_factory = sessionmaker(bind=engine)
+
+    def _update(self, job_id: str, **fields):
+        session = self._session_factory()
+        try:
+            session.query(BackgroundJob).filter(BackgroundJob.id == job_id).update(fields)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            print(f"[JobRunner] Ошибка обновления задачи {job_id}: {e}")
+        finally:
+            session.close()
+
+    @staticmethod
+    def _process_started(pid: int) -> str:
+        """Время старта процесса (Linux, /proc) — отличает процесс от другого с тем же pid"""
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                return f.read().rsplit(')', 1)[1].split()[19]
+        except (OSError, IndexError):
+            return ''
+
+    @classmethod
+    def current_owner(cls) -> str:
+        pid = os.getpid()
+        return f'{socket.gethostname()}:{pid}:{cls._process_started(pid)}'
+
+    @classmethod
+    def _owner_alive(cls, owner: Optional[str]) -> bool:
+        """
+        Жив ли процесс-владелец задачи. Процессы другого хоста проверить нельзя —
+        считаем живыми; задачи без владельца созданы до его учёта и живыми не считаются.
+        """
+        if not owner:
+            return False
+        host, _, rest = owner.partition(':')
+        pid_str, _, started = rest.partition(':')
+        if host != socket.gethostname():
+            return True
+        try:
+            pid = int(pid_str)
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass  # Процесс существует, но принадлежит другому пользователю
+        except (ValueError, OSError):
+            return False
+        # pid мог достаться новому процессу (например, после перезапуска контейнера)
+        return not started or cls._process_started(pid) == started
+
+    def recover_interrupted(self):
+        """
+        Пометить как прерванные задачи в pending/running, процесс-владелец
+        которых завершился (их поток уже не существует)
+        """
+        session = self._session_factory()
+        try:
+            active = session.query(BackgroundJob.id, BackgroundJob.owner).filter(
+                BackgroundJob.status.in_(['pending', 'running'])
+            ).all()
+            orphaned = [job_id for job_id, owner in active if not self._owner_alive(owner)]
+            if orphaned:
+                session.query(BackgroundJob).filter(BackgroundJob.id.in_(orphaned)).update({
+                    'status': 'failed',
+                    'message': 'Прервано перезапуском приложения',
+                    'finished_at': datetime.now()
+                }, synchronize_session=False)
+                session.commit()
+                print(f"[JobRunner] Помечено прерванных задач: {len(orphaned)}")
+        except Exception as e:
+            session.rollback()
+            print(f"[JobRunner] Ошибка восстановления задач: {e}")
+        finally:
+            session.close()
+
+    def find_active(self, kind: str) -> Optional[str]:
+        """id незавершённой задачи данного вида (если есть)"""
+        session = self._session_factory()
+        try:
+            job = session.query(BackgroundJob).filter(
+                BackgroundJob.kind == kind,
+                BackgroundJob.status.in_(['pending', 'running'])
+            ).order_by(BackgroundJob.created_at.desc()).first()
+            return job.id if job else None
+        finally:
+            session.close()
+
+    def submit(self, kind: str, func: Callable, user_id: Optional[int] = None, single: bool = False) -> str:
+        """
+        Поставить задачу в очередь
+
+        Args:
+            kind: Вид задачи (log_prices, cleanup_price_history, ...)
+            func: Функция func(progress) -> результат
+            user_id: Пользователь, запустивший задачу
+            single: Если True и задача этого вида уже выполняется — вернуть её id
+
+        Returns:
+            id задачи
+        """
+        if single:
+            active_id = self.find_active(kind)
+            if active_id:
+                return active_id
+
+        job_id = uuid.uuid4().hex
+        session = self._session_factory()
+        try:
+            # Заодно подчищаем старые завершённые задачи
+            session.query(BackgroundJob).filter(
+                BackgroundJob.status.in_(['done', 'failed']),
+                BackgroundJob.created_at < datetime.now() - self.JOB_RETENTION
+            ).delete(synchronize_session=False)
+            session.add(BackgroundJob(
+                id=job_id, kind=kind, user_id=user_id, status='pending', owner=self.current_owner()
+            ))
+            session.commit()
+        finally:
+            session.close()
+
+        self._executor.submit(self._run, job_id, func)
+        return job_id
+
+    def _run(self, job_id: str, func: Callable):
+        self._update(job_id, status='running', started_at=datetime.now())
+        last_write = [0.0]
+
+        def progress(fraction: float, message: Optional[str] = None):
+            now = time.monotonic()
+            if now - last_write[0] < self.PROGRESS_WRITE_INTERVAL:
+                return
+            last_write[0] = now
+            fields = {'progress': max(0.0, min(1.0, float(fraction)))}
+            if message is not None:
+                fields['message'] = str(message)[:500]
+            self._update(job_id, **fields)
+
+        try:
+            result = func(progress)
+            self._update(
+                job_id,
+                status='done',
+                progress=1.0,
+                message=None,
+                result=json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+                finished_at=datetime.now()
+            )
+        except Exception as e:
+            traceback.print_exc()
+            self._update(job_id, status='failed', message=str(e)[:500], finished_at=datetime.now())
+        finally:
+            # scoped_session привязан к потоку пула — освобождаем соединение
+            db_session.remove()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,255 @@
+"""
+Сервис учёта открытых лотов (FIFO) по транзакциям
+"""
+from collections import deque
+from typing import Dict, Iterable, Optional
+from sqlalchemy import func
+from models.database import db_session
+from models.open_lot import OpenLot
+from models.transaction import Transaction, TransactionType
+
+
+class LotLedger:
+    """
+    Поддерживает таблицу open_lots в соответствии с транзакциями пользователя
+
+    Раньше get_portfolio и recalculate_portfolio_for_ticker на каждый запрос
+    заново проигрывали все транзакции тикера. Теперь остатки покупок хранятся
+    в open_lots и обновляются точечно:
+    - новая транзакция не раньше остальных по дате — применяется к лотам напрямую;
+    - изменение цены, а также изменение/удаление покупки, из которой ещё ничего
+      не продано, — правится только её лот;
+    - остальные изменения (задним числом, продажи) — полный пересчёт тикера.
+
+    Правила FIFO те же, что были в get_portfolio: продажа закрывает самые
+    старые покупки; покупка после полной продажи начинает позицию заново.
+    """
+
+    EPSILON = 1e-9
+
+    @staticmethod
+    def _ticker(ticker: str) -> str:
+        return (ticker or '').upper()
+
+    def _lots_query(self, user_id: Optional[int], ticker: str, session=None):
+        return (session or db_session).query(OpenLot).filter(
+            OpenLot.user_id == user_id,
+            OpenLot.ticker == self._ticker(ticker)
+        )
+
+    def snapshot(self, transaction: Transaction) -> dict:
+        """Значения транзакции до изменения/удаления (для on_transaction_updated/deleted)"""
+        return {
+            'id': transaction.id,
+            'user_id': transaction.user_id,
+            'ticker': self._ticker(transaction.ticker),
+            'operation_type': transaction.operation_type,
+            'date': transaction.date,
+            'price': transaction.price,
+            'quantity': transaction.quantity,
+        }
+
+    # --- Полный пересчёт ---
+
+    def rebuild(self, user_id: Optional[int], ticker: str, commit: bool = True) -> float:
+        """
+        Пересчитать лоты тикера, проиграв все его транзакции
+
+        Returns:
+            Текущее количество бумаг
+        """
+        ticker = self._ticker(ticker)
+        transactions = db_session.query(Transaction).filter(
+            Transaction.user_id == user_id,
+            Transaction.ticker == ticker
+        ).order_by(Transaction.date.asc(), Transaction.id.asc()).all()
+
+        current_quantity = 0
+        lots = deque()  # [транзакция покупки, остаток]
+        for trans in transactions:
+            if trans.operation_type == TransactionType.BUY:
+                current_quantity += trans.quantity
+                if current_quantity - trans.quantity <= 0:
+                    # Позиция была полностью продана — начинаем заново
+                    lots.clear()
+                lots.append([trans, trans.quantity])
+            elif trans.operation_type == TransactionType.SELL:
+                sell_quantity = trans.quantity
+                current_quantity -= sell_quantity
+                while sell_quantity > 0 and lots:
+                    lot = lots[0]
+                    if lot[1] <= sell_quantity:
+                        sell_quantity -= lot[1]
+                        lots.popleft()
+                    else:
+                        lot[1] -= sell_quantity
+                        sell_quantity = 0
+                if current_quantity < 0:
+                    current_quantity = 0
+
+        self._lots_query(user_id, ticker).delete(synchronize_session=False)
+        for trans, remaining in lots:
+            db_session.add(OpenLot(
+                user_id=user_id,
+                ticker=ticker,
+                transaction_id=trans.id,
+                buy_date=trans.date,
+                price=trans.price,
+                quantity=trans.quantity,
+                remaining=remaining,
+            ))
+        if commit:
+            db_session.commit()
+        return current_quantity
+
+    def rebuild_all(self, user_id: Optional[int] = None) -> int:
+        """
+        Пересчитать лоты по всем тикерам (всех пользователей или одного)
+
+        Returns:
+            Количество пересчитанных тикеров
+        """
+        query = db_session.query(Transaction.user_id, Transaction.ticker).distinct()
+        if user_id is not None:
+            query = query.filter(Transaction.user_id == user_id)
+        pairs = query.all()
+        for pair_user_id, ticker in pairs:
+            self.rebuild(pair_user_id, ticker, commit=False)
+        db_session.commit()
+        return len(pairs)
+
+    # --- Точечные изменения ---
+
+    def _apply(self, transaction: Transaction):
+        """Применить транзакцию, которая идёт последней по дате, к текущим лотам"""
+        ticker = self._ticker(transaction.ticker)
+        lots = self._lots_query(transaction.user_id, ticker).order_by(
+            OpenLot.buy_date.asc(), OpenLot.transaction_id.asc()
+        ).all()
+
+        if transaction.operation_type == TransactionType.BUY:
+            if sum(lot.remaining for lot in lots) <= 0:
+                for lot in lots:
+                    db_session.delete(lot)
+            db_session.add(OpenLot(
+                user_id=transaction.user_id,
+                ticker=ticker,
+                transaction_id=transaction.id,
+                buy_date=transaction.date,
+                price=transaction.price,
+                quantity=transaction.quantity,
+                remaining=transaction.quantity,
+            ))
+        elif transaction.operation_type == TransactionType.SELL:
+            sell_quantity = transaction.quantity
+            for lot in lots:
+                if sell_quantity <= 0:
+                    break
+                if lot.remaining <= sell_quantity:
+                    sell_quantity -= lot.remaining
+                    db_session.delete(lot)
+                else:
+                    lot.remaining -= sell_quantity
+                    sell_quantity = 0
+
+    def _run(self, user_id: Optional[int], ticker: str, incremental):
+        """Выполнить точечное изменение; при ошибке — полный пересчёт тикера"""
+        try:
+            if incremental():
+                db_session.commit()
+                return
+        except Exception as e:
+            db_session.rollback()
+            print(f"[LotLedger] Ошибка точечного обновления лотов {ticker}: {e}, выполняем полный пересчёт")
+        self.rebuild(user_id, ticker)
+
+    def on_transaction_added(self, transaction: Transaction):
+        """Обновить лоты после добавления (уже закоммиченной) транзакции"""
+        def incremental():
+            backdated = db_session.query(Transaction.id).filter(
+                Transaction.user_id == transaction.user_id,
+                Transaction.ticker == self._ticker(transaction.ticker),
+                Transaction.date > transaction.date,
+                Transaction.id != transaction.id
+            ).first()
+            if backdated:
+                return False
+            self._apply(transaction)
+            return True
+
+        self._run(transaction.user_id, transaction.ticker, incremental)
+
+    def on_transaction_updated(self, transaction: Transaction, old: dict):
+        """Обновить лоты после изменения транзакции (old — snapshot до изменения)"""
+        new_ticker = self._ticker(transaction.ticker)
+        if old['ticker'] != new_ticker:
+            self.rebuild(old['user_id'], old['ticker'])
+            self.rebuild(transaction.user_id, new_ticker)
+            return
+
+        def incremental():
+            if old['operation_type'] != transaction.operation_type or old['date'] != transaction.date:
+                return False
+            lot = self._lots_query(transaction.user_id, new_ticker).filter(
+                OpenLot.transaction_id == transaction.id
+            ).first()
+            if transaction.operation_type == TransactionType.SELL:
+                # Цена продажи на лоты не влияет, количество — влияет
+                return old['quantity'] == transaction.quantity
+            if old['quantity'] == transaction.quantity:
+                # Изменилась только цена покупки
+                if lot:
+                    lot.price = transaction.price
+                return True
+            # Количество покупки, из которой ещё ничего не продано: продажи её не касались
+            if lot and transaction.quantity > 0 and abs(lot.remaining - old['quantity']) <= self.EPSILON:
+                lot.price = transaction.price
+                lot.quantity = transaction.quantity
+                lot.remaining = transaction.quantity
+                return True
+            return False
+
+        self._run(transaction.user_id, new_ticker, incremental)
+
+    def on_transaction_deleted(self, old: dict):
+        """Обновить лоты после удаления транзакции (old — snapshot до удаления)"""
+        def incremental():
+            if old['operation_type'] != TransactionType.BUY:
+                return False
+            lot = self._lots_query(old['user_id'], old['ticker']).filter(
+                OpenLot.transaction_id == old['id']
+            ).first()
+            if lot and abs(lot.remaining - old['quantity']) <= self.EPSILON:
+                db_session.delete(lot)
+                return True
+            return False
+
+        self._run(old['user_id'], old['ticker'], incremental)
+
+    def delete_user_lots(self, user_id: int):
+        """Удалить все лоты пользователя (hard-reset); без commit"""
+        db_session.query(OpenLot).filter(OpenLot.user_id == user_id).delete(synchronize_session=False)
+
+    # --- Чтение ---
+
+    def get_positions(self, user_id: Optional[int], tickers: Optional[Iterable[str]] = None,
+                      session=None) -> Dict[str, dict]:
+        """
+        Открытые позиции по лотам одним запросом
+
+        Returns:
+            {'SBER': {'quantity': 10.0, 'cost': 2500.0, 'lots': 2}}
+            cost — сумма price * remaining (цены покупок как ввёл пользователь)
+        """
+        query = (session or db_session).query(
+            OpenLot.ticker,
+            func.sum(OpenLot.remaining),
+            func.sum(OpenLot.price * OpenLot.remaining),
+            func.count(OpenLot.id)
+        ).filter(OpenLot.user_id == user_id)
+        if tickers is not None:
+            query = query.filter(OpenLot.ticker.in_([self._ticker(t) for t in tickers]))
+        return {
+            ticker: {'quantity': quantity or 0.0, 'cost': cost or 0.0, 'lots': lots_count}
+            for ticker, quantity, cost, lots_count in query.group_by(OpenLot.ticker).all()
+        }
@@ -0,0 +1,98 @@
+"""
+Отложенная запись рыночных данных позиций портфеля (write-behind)
+
+get_portfolio получает с MOEX свежие цены, размер лота и параметры облигаций
+и раньше сохранял их отдельным commit на каждую позицию. Теперь обновления
+складываются в очередь, а фоновый поток записывает их одной транзакцией.
+Повторные обновления одной позиции (в том числе из разных запросов)
+объединяются: в БД попадают только последние значения.
+"""
+import threading
+import time
+from typing import Dict
+from sqlalchemy.orm import sessionmaker
+from models.database import engine
+from models.portfolio import Portfolio
+
+
+class MarketDataWriter:
+    """
+    Очередь обновлений рыночных полей Portfolio (current_price, lotsize, bond_* ...)
+
+    Пишутся только переданные поля через UPDATE по id, поэтому
+    одновременное редактирование позиции пользователем не затирается.
+    """
+
+    FLUSH_DELAY = 1.0  # Секунд ожидания перед записью — за это время копятся обновления других запросов
+
+    def __init__(self):
+        self._pending: Dict[int, dict] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopped = False
+        self._session_factory = sessionmaker(bind=engine)
+
+    def enqueue(self, updates: Dict[int, dict]):
+        """
+        Поставить обновления в очередь
+
+        Args:
+            updates: {portfolio_id: {'current_price': ..., 'lotsize': ...}}
+        """
+        if not updates:
+            return
+        with self._lock:
+            for portfolio_id, fields in updates.items():
+                if fields:
+                    self._pending.setdefault(portfolio_id, {}).update(fields)
+            # Поток запускаем лениво: при preload_app в gunicorn потоки мастер-процесса
+            # не переживают fork, а первый enqueue происходит уже в воркере
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='market-data-writer', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            if self._stopped:
+                break
+            # Даём накопиться обновлениям параллельных запросов
+            time.sleep(self.FLUSH_DELAY)
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Записать накопленные обновления одной транзакцией
+
+        Returns:
+            Количество обновлённых позиций
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        session = self._session_factory()
+        try:
+            for portfolio_id, fields in pending.items():
+                session.query(Portfolio).filter(Portfolio.id == portfolio_id).update(
+                    fields, synchronize_session=False
+                )
+            session.commit()
+            return len(pending)
+        except Exception as e:
+            session.rollback()
+            # Рыночные данные обновятся при следующем запросе к MOEX — повторно не пишем
+            print(f"[MarketDataWriter] Ошибка записи обновлений ({len(pending)} позиций): {e}")
+            return 0
+        finally:
+            session.close()
+
+    def shutdown(self):
+        """Записать остаток очереди и остановить поток"""
+        self._stopped = True
+        self._wakeup.set()
+        self.flush()
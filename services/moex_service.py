@@ -819,6 +819,98 @@ class MOEXService:
         """Текущее значение IMOEX2 (расширенная сессия)."""
         return self._get_index_current('IMOEX2')
 
+    def get_trading_calendar(self, date_from: str, date_to: str) -> Dict[str, bool]:
+        """
+        Получить календарь торговых дней фондового рынка за период.
+
+        Использует endpoint: /iss/rms/engines/stock/objects/settlementscalendar
+        date_from, date_to: строки формата 'YYYY-MM-DD'
+
+        Returns:
+            Словарь { 'YYYY-MM-DD': True/False (торговый день или нет) }
+            или пустой словарь, если календарь получить не удалось.
+            Дни периода, которых нет в словаре, торговыми не являются.
+        """
+        url = f"{self.BASE_URL}/rms/engines/stock/objects/settlementscalendar.json"
+        data = self._make_request(url, {'iss.meta': 'off', 'from': date_from, 'till': date_to})
+        if not data or not isinstance(data, dict):
+            return {}
+
+        block = data.get('settlementscalendar')
+        if not isinstance(block, dict):
+            return {}
+        cols = [str(c).lower() for c in block.get('columns', [])]
+        if 'tradedate' not in cols:
+            return {}
+        date_idx = cols.index('tradedate')
+        # stock_workday: 1 — торговый день фондового рынка, 0 — нет
+        flag_idx = cols.index('stock_workday') if 'stock_workday' in cols else None
+
+        result: Dict[str, bool] = {}
+        for row in block.get('data', []) or []:
+            try:
+                day = str(row[date_idx])[:10]
+            except (TypeError, IndexError):
+                continue
+            if not day:
+                continue
+            if flag_idx is None:
+                # Без stock_workday в блоке перечислены только торговые дни
+                result[day] = True
+            else:
+                try:
+                    result[day] = bool(int(row[flag_idx]))
+                except (TypeError, ValueError, IndexError):
+                    continue
+        return result
+
+    def get_splits(self, page_limit: int = 100) -> List[Dict]:
+        """
+        Получить сплиты и консолидации акций фондового рынка (все бумаги сразу).
+
+        Использует endpoint: /iss/statistics/engines/stock/splits
+        (постранично через start, пока ISS отдаёт строки)
+
+        Returns:
+            Список {'ticker': str, 'date': 'YYYY-MM-DD', 'before': float, 'after': float}:
+            before бумаг до события превращаются в after бумаг после него.
+            Пустой список, если данные получить не удалось.
+        """
+        url = f"{self.BASE_URL}/statistics/engines/stock/splits.json"
+        results = []
+        seen = set()
+        start = 0
+        for _ in range(page_limit):
+            data = self._make_request(url, {'iss.meta': 'off', 'start': start})
+            block = data.get('splits') if isinstance(data, dict) else None
+            if not isinstance(block, dict):
+                break
+            cols = [str(c).lower() for c in block.get('columns', [])]
+            rows = block.get('data', []) or []
+            if not rows or not {'tradedate', 'secid', 'before', 'after'}.issubset(cols):
+                break
+            idx = {name: cols.index(name) for name in ('tradedate', 'secid', 'before', 'after')}
+            known = len(results)
+            for row in rows:
+                try:
+                    item = {
+                        'ticker': str(row[idx['secid']]).strip().upper(),
+                        'date': str(row[idx['tradedate']])[:10],
+                        'before': float(row[idx['before']]),
+                        'after': float(row[idx['after']]),
+                    }
+                except (TypeError, ValueError, IndexError):
+                    continue
+                key = (item['ticker'], item['date'])
+                if item['ticker'] and item['before'] > 0 and item['after'] > 0 and key not in seen:
+                    seen.add(key)
+                    results.append(item)
+            if len(results) == known:
+                # Страница без новых строк — ISS не поддержал start или данные кончились
+                break
+            start += len(rows)
+        return results
+
     def get_imoex_history(self, date_from: str, date_to: str) -> list:
         """
         Получить историю значений индекса IMOEX за период.
@@ -0,0 +1,36 @@
+"""
+Кэш сериализованных ответов /api/portfolio (и других ответов, зависящих от версии портфеля)
+"""
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+
+class PortfolioResponseCache:
+    """
+    LRU-кэш готовых JSON-ответов портфеля в памяти процесса
+
+    Ключ включает версию портфеля пользователя (users.portfolio_version),
+    поэтому после любого изменения данных старые записи просто перестают
+    запрашиваться и со временем вытесняются.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[str, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Tuple[str, bytes]]:
+        """(etag, тело ответа) или None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Hashable, etag: str, body: bytes):
+        with self._lock:
+            self._entries[key] = (etag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,187 @@
+"""
+История позиций пользователя: количество каждого тикера на любую дату
+
+Раньше стоимость портфеля в прошлом считалась по сегодняшним количествам,
+поэтому точки до покупок и продаж были неверными. Теперь по транзакциям
+ведутся точки изменения (дата, тикер, количество на конец дня) в таблице
+position_changes; для расчёта они загружаются в отсортированные массивы,
+и количество на дату — один bisect по датам тикера.
+"""
+from bisect import bisect_right
+from datetime import date, datetime, time
+from typing import Dict, Iterable, List, Optional, Tuple
+from models.database import db_session
+from models.position_change import PositionChange
+from models.transaction import Transaction, TransactionType
+
+
+class PositionTimeline:
+    """
+    Точки изменения позиций одного пользователя
+
+    dates[тикер] — дни с транзакциями по возрастанию,
+    quantities[тикер][i] — количество на конец дня dates[тикер][i].
+    """
+
+    def __init__(self, rows: Iterable[Tuple[str, date, float]] = ()):
+        """
+        Args:
+            rows: (тикер, дата, количество), упорядоченные по тикеру и дате
+        """
+        self.dates: Dict[str, List[date]] = {}
+        self.quantities: Dict[str, List[float]] = {}
+        for ticker, change_date, quantity in rows:
+            ticker = (ticker or '').upper()
+            self.dates.setdefault(ticker, []).append(change_date)
+            self.quantities.setdefault(ticker, []).append(quantity)
+
+    @property
+    def tickers(self) -> List[str]:
+        return list(self.dates)
+
+    def quantity_on(self, ticker: str, day: date) -> float:
+        """Количество на конец дня day (0 до первой транзакции)"""
+        ticker = (ticker or '').upper()
+        dates = self.dates.get(ticker)
+        if not dates:
+            return 0.0
+        i = bisect_right(dates, day)
+        return self.quantities[ticker][i - 1] if i else 0.0
+
+    def latest(self, ticker: str) -> float:
+        """Количество после последней транзакции"""
+        quantities = self.quantities.get((ticker or '').upper())
+        return quantities[-1] if quantities else 0.0
+
+    def holdings_on(self, day: date, current: Dict[str, float]) -> Dict[str, float]:
+        """
+        Количества всех тикеров на конец дня day
+
+        Опорная точка — текущие количества портфеля (current, тикеры в верхнем
+        регистре): из них вычитается изменение по транзакциям после day. Так
+        позиции, введённые без транзакций, остаются как есть, а последняя точка
+        совпадает с портфелем. Тикеры, проданные целиком, входят с current = 0.
+        """
+        holdings = {}
+        for ticker in set(current) | set(self.dates):
+            quantity = current.get(ticker, 0.0)
+            if ticker in self.dates:
+                quantity -= self.latest(ticker) - self.quantity_on(ticker, day)
+            holdings[ticker] = quantity if quantity > 0 else 0.0
+        return holdings
+
+
+class PositionTimelineLedger:
+    """
+    Поддерживает таблицу position_changes в соответствии с транзакциями
+
+    Правила количества те же, что у LotLedger: покупка прибавляет,
+    продажа вычитает, но не ниже нуля. Изменение транзакции с датой D
+    пересчитывает точки тикера только начиная с дня D.
+    """
+
+    @staticmethod
+    def _ticker(ticker: str) -> str:
+        return (ticker or '').upper()
+
+    @staticmethod
+    def _day(value) -> date:
+        return value.date() if isinstance(value, datetime) else value
+
+    def rebuild(self, user_id: Optional[int], ticker: str, since=None, commit: bool = True) -> float:
+        """
+        Пересчитать точки тикера, начиная с дня since (None — с первой транзакции)
+
+        Returns:
+            Количество после последней транзакции
+        """
+        ticker = self._ticker(ticker)
+        since = self._day(since) if since is not None else None
+        # Сессия без autoflush: несохранённые изменения транзакций должны попасть в выборку
+        db_session.flush()
+        changes = db_session.query(PositionChange).filter(
+            PositionChange.user_id == user_id, PositionChange.ticker == ticker
+        )
+        quantity = 0.0
+        transactions = db_session.query(
+            Transaction.date, Transaction.operation_type, Transaction.quantity
+        ).filter(Transaction.user_id == user_id, Transaction.ticker == ticker)
+        if since is not None:
+            previous = changes.filter(PositionChange.change_date < since).order_by(
+                PositionChange.change_date.desc()
+            ).first()
+            quantity = previous.quantity if previous else 0.0
+            changes = changes.filter(PositionChange.change_date >= since)
+            transactions = transactions.filter(Transaction.date >= datetime.combine(since, time.min))
+        changes.delete(synchronize_session=False)
+
+        points: Dict[date, float] = {}
+        for tx_date, operation_type, tx_quantity in transactions.order_by(
+            Transaction.date.asc(), Transaction.id.asc()
+        ):
+            if operation_type == TransactionType.BUY:
+                quantity += tx_quantity
+            else:
+                quantity = max(quantity - tx_quantity, 0.0)
+            points[tx_date.date()] = quantity
+        if points:
+            db_session.execute(PositionChange.__table__.insert(), [
+                {'user_id': user_id, 'ticker': ticker, 'change_date': day, 'quantity': q}
+                for day, q in points.items()
+            ])
+        if commit:
+            db_session.commit()
+        return quantity
+
+    def on_transaction_changed(self, user_id: Optional[int], *changes: Tuple[str, datetime],
+                               commit: bool = True):
+        """
+        Пересчитать точки после добавления, изменения или удаления транзакций
+
+        Args:
+            changes: (тикер, дата) затронутых транзакций — для изменённой
+                     передаются старые и новые значения
+        """
+        since_by_ticker: Dict[str, date] = {}
+        for ticker, tx_date in changes:
+            ticker = self._ticker(ticker)
+            day = self._day(tx_date)
+            if ticker not in since_by_ticker or day < since_by_ticker[ticker]:
+                since_by_ticker[ticker] = day
+        for ticker, since in since_by_ticker.items():
+            self.rebuild(user_id, ticker, since=since, commit=False)
+        if commit:
+            db_session.commit()
+
+    def rebuild_all(self, user_id: Optional[int] = None) -> int:
+        """
+        Пересчитать точки по всем тикерам (всех пользователей или одного)
+
+        Returns:
+            Количество пересчитанных тикеров
+        """
+        query = db_session.query(Transaction.user_id, Transaction.ticker).distinct()
+        if user_id is not None:
+            query = query.filter(Transaction.user_id == user_id)
+        pairs = query.all()
+        for pair_user_id, ticker in pairs:
+            self.rebuild(pair_user_id, ticker, commit=False)
+        db_session.commit()
+        return len(pairs)
+
+    def delete_user_changes(self, user_id: Optional[int], commit: bool = False):
+        """Удалить точки пользователя (при удалении всех его транзакций)"""
+        db_session.query(PositionChange).filter(PositionChange.user_id == user_id).delete(
+            synchronize_session=False
+        )
+        if commit:
+            db_session.commit()
+
+    def load(self, user_id: Optional[int], session=None) -> PositionTimeline:
+        """История позиций пользователя для расчётов (один запрос по индексу)"""
+        rows = (session or db_session).query(
+            PositionChange.ticker, PositionChange.change_date, PositionChange.quantity
+        ).filter(PositionChange.user_id == user_id).order_by(
+            PositionChange.ticker.asc(), PositionChange.change_date.asc()
+        ).all()
+        return PositionTimeline(rows)
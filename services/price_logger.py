@@ -2,12 +2,15 @@
 Сервис для логирования цен акций
 """
 from datetime import datetime
+from sqlalchemy import func
 from models.database import db_session
 from models.portfolio import Portfolio
 from models.price_history import PriceHistory
 from services.moex_service import MOEXService
 import pytz
+import random
 import threading
+import time
 
 
 class PriceLogger:
@@ -16,27 +19,41 @@ class PriceLogger:
     
     Сохраняет текущие цены всех акций из портфеля в БД
     """
+
+    # Повторы для тикеров, по которым MOEX не вернул цену, в рамках одного запуска
+    RETRY_MAX_ATTEMPTS = 3      # Сколько раз переспрашиваем тикер
+    RETRY_BASE_DELAY = 2.0      # Базовая задержка перед повтором, сек (удваивается с каждой попыткой)
+    RETRY_MAX_DELAY = 30.0      # Потолок задержки, сек
+    RETRY_TIME_BUDGET = 120.0   # Общий бюджет времени на повторы за запуск, сек
     
-    def __init__(self, moex_service: MOEXService):
+    def __init__(self, moex_service: MOEXService, split_adjusted_prices=None):
         self.moex_service = moex_service
+        # SplitAdjustedPrices: множители сплитов для новых записей истории (необязательно)
+        self.split_adjusted_prices = split_adjusted_prices
         self.moscow_tz = pytz.timezone('Europe/Moscow')
         self._logging_lock = threading.Lock()  # Защита от одновременного выполнения
     
-    def log_all_prices(self, force=False):
+    def log_all_prices(self, force=False, progress=None):
         """
         Логирование цен для всех уникальных тикеров в портфеле
         
         Вызывается ежедневно в 00:00 МСК планировщиком или периодически каждые 3 часа
-        Защищено от дублирования: проверяет, были ли уже залогированы цены сегодня
+        Защищено от дублирования: проверяет, были ли уже залогированы цены сегодня.
+        Тикеры, по которым MOEX не ответил, переспрашиваются в рамках запуска
+        (до RETRY_MAX_ATTEMPTS раз, не дольше RETRY_TIME_BUDGET секунд)
         
         Args:
             force: Если True, логирует цены даже если запись за сегодня уже есть
+            progress: Необязательный callback progress(fraction, message) для фоновых задач
+
+        Returns:
+            Словарь с итогами запуска или None, если логирование уже выполняется
         """
         # Защита от одновременного выполнения
         if not self._logging_lock.acquire(blocking=False):
             moscow_time = datetime.now(self.moscow_tz)
             print(f"[{moscow_time}] Логирование уже выполняется, пропускаем дубликат")
-            return
+            return None
         
         try:
             moscow_time = datetime.now(self.moscow_tz)
@@ -44,22 +61,12 @@ class PriceLogger:
             print(f"[{moscow_time}] Принудительное логирование: {force}")
             from datetime import date, timedelta
             
-            # Получаем все уникальные тикеры из портфеля
-            portfolio_items = db_session.query(Portfolio).all()
+            # Получаем все уникальные тикеры из портфеля (один лёгкий запрос по колонкам)
+            unique_tickers = self.get_tracked_instruments()
             
-            if not portfolio_items:
+            if not unique_tickers:
                 print(f"[{datetime.now(self.moscow_tz)}] Портфель пуст, нечего логировать")
-                return
-            
-            # Собираем уникальные тикеры с типами инструментов
-            unique_tickers = {}
-            for item in portfolio_items:
-                if item.ticker not in unique_tickers:
-                    instrument_type = item.instrument_type.name if hasattr(item, 'instrument_type') and item.instrument_type else 'STOCK'
-                    unique_tickers[item.ticker] = {
-                        'company_name': item.company_name,
-                        'instrument_type': instrument_type
-                    }
+                return {'total': 0, 'logged': 0, 'skipped': 0, 'failed': []}
             
             # Проверяем, были ли уже залогированы цены сегодня.
             # Используем начало текущего дня по московскому времени
@@ -67,142 +74,95 @@ class PriceLogger:
             today_start = now_moscow.replace(hour=0, minute=0, second=0, microsecond=0)
             today_end = today_start + timedelta(days=1)
 
-            # Проверяем наличие записей за сегодня для всех тикеров
-            existing_logs_today = db_session.query(PriceHistory).filter(
-                PriceHistory.logged_at >= today_start,
-                PriceHistory.logged_at < today_end
-            ).all()
-
             # Создаем множество тикеров, для которых уже есть записи сегодня
-            tickers_logged_today = {log.ticker for log in existing_logs_today}
+            tickers_logged_today = self._get_tickers_logged_between(today_start, today_end)
 
             # Если для всех тикеров уже есть записи сегодня и не принудительное логирование, пропускаем
             if not force and tickers_logged_today.issuperset(unique_tickers.keys()):
                 print(f"[{datetime.now(self.moscow_tz)}] Цены уже залогированы сегодня для всех тикеров. Пропускаем дублирование.")
-                return
+                return {'total': len(unique_tickers), 'logged': 0, 'skipped': len(unique_tickers), 'failed': []}
             
             logged_count = 0
             skipped_count = 0
             # Одна общая метка времени для всех записей текущего запуска
             log_time = datetime.now(self.moscow_tz)
 
+            # В автоматическом режиме (force=False) пропускаем тикеры,
+            # для которых уже есть запись сегодня — чтобы не перезаписывать историю.
+            # В ручном режиме (force=True) наоборот хотим уметь обновлять сегодняшнюю цену.
+            queue = []
+            for ticker, ticker_info in unique_tickers.items():
+                if not force and ticker in tickers_logged_today:
+                    skipped_count += 1
+                    print(f"[{datetime.now(self.moscow_tz)}] Пропуск {ticker}: цена уже залогирована сегодня")
+                    continue
+                queue.append((ticker, ticker_info))
+
             # Готовим bulk-запросы к MOEX только для облигаций.
             # Для акций/ETF не используем bulk: поштучный get_current_price даёт единую логику
             # (shares вместо indices для валютных ETF вроде CNYM) и для планировщика, и для ручного запуска.
             if not force:
-                bond_tickers = [t for t, info in unique_tickers.items() if info['instrument_type'] == 'BOND']
+                bond_tickers = [t for t, info in queue if info['instrument_type'] == 'BOND']
                 bulk_prices_bond = self.moex_service.get_bulk_prices(bond_tickers, 'BOND') if bond_tickers else {}
-                bulk_prices_stock = {}  # акции/ETF — всегда через get_current_price
             else:
-                bulk_prices_stock = {}
                 bulk_prices_bond = {}
-            
-            # Логируем цену для каждого уникального тикера
-            for ticker, ticker_info in unique_tickers.items():
-                try:
-                    # В автоматическом режиме (force=False) пропускаем тикеры,
-                    # для которых уже есть запись сегодня — чтобы не перезаписывать историю.
-                    # В ручном режиме (force=True) наоборот хотим уметь обновлять сегодняшнюю цену.
-                    if not force and ticker in tickers_logged_today:
-                        skipped_count += 1
-                        print(f"[{datetime.now(self.moscow_tz)}] Пропуск {ticker}: цена уже залогирована сегодня")
-                        continue
 
-                    company_name = ticker_info['company_name']
-                    instrument_type = ticker_info['instrument_type']
-                    
-                    # Сначала пробуем взять цену из bulk-результатов для STOCK/BOND
-                    quote_data = None
-                    used_instrument_type = instrument_type
-                    ticker_upper = ticker.upper()
-                    bulk_price = None
-                    if instrument_type == 'STOCK':
-                        bulk_price = bulk_prices_stock.get(ticker_upper)
-                    elif instrument_type == 'BOND':
-                        bulk_price = bulk_prices_bond.get(ticker_upper)
-
-                    if bulk_price is not None:
-                        quote_data = {'price': bulk_price, 'volume': 0}
-                    else:
-                        # Если в bulk-ответе данных нет (или инструмент не STOCK/BOND),
-                        # используем существующую поштучную логику с fallback по типам.
-                        types_to_try = [instrument_type]
-                        if instrument_type == 'STOCK':
-                            types_to_try.append('BOND')
-                        elif instrument_type == 'BOND':
-                            types_to_try.append('STOCK')
-                        
-                        for itype in types_to_try:
-                            quote_data = self.moex_service.get_current_price(ticker, itype)
-                            if quote_data:
-                                used_instrument_type = itype
-                                break
-                    
-                    if not quote_data:
-                        print(f"[{datetime.now(self.moscow_tz)}] Не удалось получить данные для {ticker} (пробовали типы: {types_to_try})")
-                        continue
-                    
-                    current_price = quote_data.get('price', 0)
-                    
-                    # Получаем последнюю запись из истории для расчета изменения
-                    # Исключаем записи за сегодня, чтобы брать предыдущий день
-                    last_history_entry = db_session.query(PriceHistory).filter(
-                        PriceHistory.ticker == ticker,
-                        PriceHistory.logged_at < today_start
-                    ).order_by(PriceHistory.logged_at.desc()).first()
-                    
-                    if last_history_entry and current_price > 0:
-                        # Рассчитываем изменение относительно предыдущей записи
-                        last_logged_price = last_history_entry.price
-                        price_change = current_price - last_logged_price
-                        price_change_percent = (price_change / last_logged_price * 100) if last_logged_price > 0 else 0
-                    else:
-                        # Если это первая запись, изменение = 0
-                        price_change = 0
-                        price_change_percent = 0
-                    
-                    # Ищем запись за сегодняшний день: хотим хранить одну запись в день (последнюю)
-                    existing_today = db_session.query(PriceHistory).filter(
-                        PriceHistory.ticker == ticker,
-                        PriceHistory.logged_at >= today_start,
-                        PriceHistory.logged_at < today_end
-                    ).order_by(PriceHistory.logged_at.desc()).first()
-
-                    from models.portfolio import InstrumentType
-                    instrument_type_enum = InstrumentType[used_instrument_type] if used_instrument_type in ['STOCK', 'BOND'] else InstrumentType.STOCK
-                    if existing_today:
-                        # Обновляем существующую дневную запись (в истории остаётся только последняя цена за день)
-                        existing_today.company_name = company_name
-                        existing_today.price = current_price
-                        existing_today.change = round(price_change, 2)
-                        existing_today.change_percent = round(price_change_percent, 2)
-                        existing_today.volume = quote_data.get('volume', 0)
-                        existing_today.instrument_type = instrument_type_enum
-                        existing_today.logged_at = log_time
-                        logged_count += 1
-                        print(f"[{log_time}] Обновлена дневная запись для {ticker}: {current_price} ₽ (изменение: {price_change:+.2f} ₽, {price_change_percent:+.2f}%)")
-                    else:
-                        # Создаем новую запись в истории
-                        price_log = PriceHistory(
-                            ticker=ticker,
-                            company_name=company_name,
-                            price=current_price,
-                            change=round(price_change, 2),
-                            change_percent=round(price_change_percent, 2),
-                            volume=quote_data.get('volume', 0),
-                            instrument_type=instrument_type_enum,
-                            logged_at=log_time
+            # Тикеры, по которым MOEX не вернул цену, ставим обратно в очередь и
+            # переспрашиваем в рамках этого же запуска с нарастающей задержкой (с джиттером),
+            # пока не исчерпаны попытки или общий бюджет времени на повторы.
+            total_pending = len(queue)
+            attempt = 0
+            retry_deadline = time.monotonic() + self.RETRY_TIME_BUDGET
+            failed = []
+            while queue:
+                failed = []
+                for ticker, ticker_info in queue:
+                    try:
+                        # bulk-ответ используем только в первом проходе, повторы — поштучно
+                        quote_data, used_instrument_type, types_tried = self._fetch_quote(
+                            ticker,
+                            ticker_info['instrument_type'],
+                            bulk_prices_bond if attempt == 0 else {}
+                        )
+                        if not quote_data:
+                            print(f"[{datetime.now(self.moscow_tz)}] Не удалось получить данные для {ticker} (пробовали типы: {types_tried})")
+                            failed.append((ticker, ticker_info))
+                            continue
+
+                        self._store_price(
+                            ticker, ticker_info['company_name'], quote_data, used_instrument_type,
+                            today_start, today_end, log_time
                         )
-                        db_session.add(price_log)
                         logged_count += 1
-                        print(f"[{log_time}] Залогирована цена для {ticker}: {current_price} ₽ (изменение: {price_change:+.2f} ₽, {price_change_percent:+.2f}%)")
-                    
-                except Exception as e:
-                    print(f"[{log_time}] Ошибка логирования цены для {ticker}: {e}")
-                    continue
-            
-            # Сохраняем все изменения в БД
-            db_session.commit()
+                        if progress:
+                            progress(logged_count / total_pending, f'Залогирован {ticker}')
+                    except Exception as e:
+                        print(f"[{log_time}] Ошибка логирования цены для {ticker}: {e}")
+                        continue
+
+                # Сохраняем результат прохода сразу, чтобы не держать изменения на время паузы
+                db_session.commit()
+
+                attempt += 1
+                if not failed:
+                    break
+                if attempt > self.RETRY_MAX_ATTEMPTS:
+                    break
+                delay = self._retry_delay(attempt)
+                if time.monotonic() + delay > retry_deadline:
+                    print(f"[{datetime.now(self.moscow_tz)}] Бюджет времени на повторы исчерпан")
+                    break
+                if progress:
+                    progress(logged_count / total_pending, f'Повтор {attempt}: {len(failed)} тикеров')
+                print(f"[{datetime.now(self.moscow_tz)}] Повтор {attempt}/{self.RETRY_MAX_ATTEMPTS} через {delay:.1f} с для {len(failed)} тикеров: {', '.join(t for t, _ in failed)}")
+                time.sleep(delay)
+                queue = failed
+
+            if logged_count and self.split_adjusted_prices:
+                self.split_adjusted_prices.on_prices_written(today_start.date())
+
+            if failed:
+                print(f"[{datetime.now(self.moscow_tz)}] Не залогированы после повторов: {', '.join(t for t, _ in failed)} (будут дозаписаны следующим периодическим запуском)")
             
             moscow_time = datetime.now(self.moscow_tz)
             if skipped_count > 0:
@@ -210,6 +170,12 @@ class PriceLogger:
             else:
                 print(f"[{moscow_time}] Успешно залогировано цен: {logged_count}/{len(unique_tickers)}")
             print(f"[{moscow_time}] ===== ЛОГИРОВАНИЕ ЦЕН ЗАВЕРШЕНО =====")
+            return {
+                'total': len(unique_tickers),
+                'logged': logged_count,
+                'skipped': skipped_count,
+                'failed': [t for t, _ in failed]
+            }
             
         except Exception as e:
             moscow_time = datetime.now(self.moscow_tz)
@@ -217,10 +183,266 @@ class PriceLogger:
             import traceback
             traceback.print_exc()
             db_session.rollback()
+            return {'error': str(e)}
         finally:
             # Всегда освобождаем lock
             self._logging_lock.release()
     
+    def _retry_delay(self, attempt):
+        """Экспоненциальная задержка перед повтором с джиттером ±50%"""
+        delay = min(self.RETRY_MAX_DELAY, self.RETRY_BASE_DELAY * (2 ** (attempt - 1)))
+        return delay * random.uniform(0.5, 1.5)
+
+    def _fetch_quote(self, ticker, instrument_type, bulk_prices_bond):
+        """
+        Получить котировку тикера: сначала из bulk-ответа (только облигации),
+        затем поштучно с fallback по типам инструмента.
+
+        Returns:
+            (quote_data или None, использованный тип, список опробованных типов)
+        """
+        if instrument_type == 'BOND':
+            bulk_price = bulk_prices_bond.get(ticker.upper())
+            if bulk_price is not None:
+                return {'price': bulk_price, 'volume': 0}, instrument_type, [instrument_type]
+
+        types_to_try = [instrument_type]
+        if instrument_type == 'STOCK':
+            types_to_try.append('BOND')
+        elif instrument_type == 'BOND':
+            types_to_try.append('STOCK')
+
+        for itype in types_to_try:
+            quote_data = self.moex_service.get_current_price(ticker, itype)
+            if quote_data:
+                return quote_data, itype, types_to_try
+        return None, instrument_type, types_to_try
+
+    def _store_price(self, ticker, company_name, quote_data, used_instrument_type, today_start, today_end, log_time):
+        """
+        Записать цену тикера в историю (одна запись в день — последняя).
+        Изменение считается относительно последней записи до начала сегодняшнего дня.
+        """
+        from models.portfolio import InstrumentType
+
+        current_price = quote_data.get('price', 0)
+
+        # Получаем последнюю запись из истории для расчета изменения
+        # Исключаем записи за сегодня, чтобы брать предыдущий день
+        last_history_entry = db_session.query(PriceHistory).filter(
+            PriceHistory.ticker == ticker,
+            PriceHistory.logged_at < today_start
+        ).order_by(PriceHistory.logged_at.desc()).first()
+
+        if last_history_entry and current_price > 0:
+            # Рассчитываем изменение относительно предыдущей записи
+            last_logged_price = last_history_entry.price
+            price_change = current_price - last_logged_price
+            price_change_percent = (price_change / last_logged_price * 100) if last_logged_price > 0 else 0
+        else:
+            # Если это первая запись, изменение = 0
+            price_change = 0
+            price_change_percent = 0
+
+        # Ищем запись за сегодняшний день: хотим хранить одну запись в день (последнюю)
+        existing_today = db_session.query(PriceHistory).filter(
+            PriceHistory.ticker == ticker,
+            PriceHistory.logged_at >= today_start,
+            PriceHistory.logged_at < today_end
+        ).order_by(PriceHistory.logged_at.desc()).first()
+
+        instrument_type_enum = InstrumentType[used_instrument_type] if used_instrument_type in ['STOCK', 'BOND'] else InstrumentType.STOCK
+        if existing_today:
+            # Обновляем существующую дневную запись (в истории остаётся только последняя цена за день)
+            existing_today.company_name = company_name
+            existing_today.price = current_price
+            existing_today.change = round(price_change, 2)
+            existing_today.change_percent = round(price_change_percent, 2)
+            existing_today.volume = quote_data.get('volume', 0)
+            existing_today.instrument_type = instrument_type_enum
+            existing_today.logged_at = log_time
+            print(f"[{log_time}] Обновлена дневная запись для {ticker}: {current_price} ₽ (изменение: {price_change:+.2f} ₽, {price_change_percent:+.2f}%)")
+        else:
+            # Создаем новую запись в истории
+            price_log = PriceHistory(
+                ticker=ticker,
+                company_name=company_name,
+                price=current_price,
+                change=round(price_change, 2),
+                change_percent=round(price_change_percent, 2),
+                volume=quote_data.get('volume', 0),
+                instrument_type=instrument_type_enum,
+                logged_at=log_time
+            )
+            db_session.add(price_log)
+            print(f"[{log_time}] Залогирована цена для {ticker}: {current_price} ₽ (изменение: {price_change:+.2f} ₽, {price_change_percent:+.2f}%)")
+
+    def get_tracked_instruments(self):
+        """
+        Уникальные инструменты из портфелей всех пользователей
+
+        Выбираются только нужные колонки с группировкой по (тикер, тип инструмента),
+        без загрузки ORM-объектов Portfolio. Если пользователи указали для тикера
+        разные типы, берётся тип большинства позиций, при равенстве — тип самой
+        ранней позиции (как при прежнем проходе по портфелям).
+
+        Returns:
+            Словарь { 'SBER': {'company_name': str, 'instrument_type': 'STOCK'|'BOND'}, ... }
+        """
+        rows = db_session.query(
+            Portfolio.ticker,
+            Portfolio.instrument_type,
+            func.count(Portfolio.id).label('positions'),
+            func.min(Portfolio.id).label('first_id'),
+            func.min(Portfolio.company_name).label('company_name'),
+        ).group_by(Portfolio.ticker, Portfolio.instrument_type).all()
+
+        chosen = {}
+        for row in rows:
+            best = chosen.get(row.ticker)
+            if best is None or (row.positions, -row.first_id) > (best.positions, -best.first_id):
+                chosen[row.ticker] = row
+
+        return {
+            ticker: {
+                'company_name': row.company_name,
+                'instrument_type': row.instrument_type.name if row.instrument_type else 'STOCK'
+            }
+            for ticker, row in chosen.items()
+        }
+
+    def _get_tickers_logged_between(self, start, end):
+        """Множество тикеров, по которым есть записи в истории в интервале [start, end)"""
+        rows = db_session.query(PriceHistory.ticker).filter(
+            PriceHistory.logged_at >= start,
+            PriceHistory.logged_at < end
+        ).distinct().all()
+        return {row.ticker for row in rows}
+
+    def get_missing_tickers_today(self):
+        """
+        Тикеры из портфеля, для которых ещё нет записи в истории за сегодня (МСК).
+        Используется периодической проверкой, чтобы дозаписывать только пропуски.
+        """
+        from datetime import timedelta
+
+        tracked = {row.ticker for row in db_session.query(Portfolio.ticker).distinct()}
+        if not tracked:
+            return []
+
+        now_moscow = datetime.now(self.moscow_tz)
+        today_start = now_moscow.replace(hour=0, minute=0, second=0, microsecond=0)
+        today_end = today_start + timedelta(days=1)
+        return sorted(tracked - self._get_tickers_logged_between(today_start, today_end))
+    
+    def carry_forward_last_prices(self):
+        """
+        Перенести последние известные цены на сегодня без запросов к MOEX.
+
+        Используется в неторговые дни: для тикеров без записи за сегодня
+        создаётся запись с ценой последней записи из истории и нулевым изменением,
+        чтобы дневные графики оставались непрерывными.
+
+        Returns:
+            Количество созданных записей
+        """
+        from datetime import timedelta
+        from sqlalchemy import and_
+
+        missing = self.get_missing_tickers_today()
+        if not missing:
+            return 0
+
+        now_moscow = datetime.now(self.moscow_tz)
+        today_start = now_moscow.replace(hour=0, minute=0, second=0, microsecond=0)
+
+        # Последняя запись до сегодняшнего дня по каждому тикеру — одним запросом
+        subq = db_session.query(
+            PriceHistory.ticker,
+            func.max(PriceHistory.logged_at).label('max_logged_at')
+        ).filter(
+            PriceHistory.ticker.in_(missing),
+            PriceHistory.logged_at < today_start
+        ).group_by(PriceHistory.ticker).subquery()
+        last_entries = db_session.query(PriceHistory).join(
+            subq,
+            and_(PriceHistory.ticker == subq.c.ticker, PriceHistory.logged_at == subq.c.max_logged_at)
+        ).all()
+
+        created = 0
+        seen = set()
+        for entry in last_entries:
+            if entry.ticker in seen:
+                continue
+            seen.add(entry.ticker)
+            db_session.add(PriceHistory(
+                ticker=entry.ticker,
+                company_name=entry.company_name,
+                price=entry.price,
+                change=0.0,
+                change_percent=0.0,
+                volume=0,
+                instrument_type=entry.instrument_type,
+                logged_at=now_moscow
+            ))
+            created += 1
+        db_session.commit()
+        if created and self.split_adjusted_prices:
+            self.split_adjusted_prices.on_prices_written(today_start.date())
+        print(f"[{now_moscow}] Неторговый день: перенесено последних цен без запросов к MOEX: {created}")
+        return created
+
+    def cleanup_duplicate_history(self, progress=None, batch_size=1000):
+        """
+        Очистка истории: оставить по одной (последней) записи на день для каждого тикера.
+        Та же логика, что в scripts/cleanup_price_history_daily.py, но с удалением
+        батчами и отчётом о прогрессе — для запуска фоновой задачей.
+
+        Returns:
+            Словарь {'total': всего записей, 'deleted': удалено}
+        """
+        from sqlalchemy import and_
+
+        total_rows = db_session.query(func.count(PriceHistory.id)).scalar() or 0
+
+        # Для каждой пары (ticker, date) находим максимальный logged_at
+        subq = db_session.query(
+            PriceHistory.ticker.label('ticker'),
+            func.date(PriceHistory.logged_at).label('d'),
+            func.max(PriceHistory.logged_at).label('max_ts'),
+        ).group_by(PriceHistory.ticker, func.date(PriceHistory.logged_at)).subquery()
+
+        keep_ids = {
+            row.id for row in db_session.query(PriceHistory.id).join(
+                subq,
+                and_(
+                    PriceHistory.ticker == subq.c.ticker,
+                    func.date(PriceHistory.logged_at) == subq.c.d,
+                    PriceHistory.logged_at == subq.c.max_ts,
+                )
+            )
+        }
+        delete_ids = [
+            row.id for row in db_session.query(PriceHistory.id).all()
+            if row.id not in keep_ids
+        ]
+
+        deleted = 0
+        for i in range(0, len(delete_ids), batch_size):
+            batch = delete_ids[i:i + batch_size]
+            db_session.query(PriceHistory).filter(
+                PriceHistory.id.in_(batch)
+            ).delete(synchronize_session=False)
+            db_session.commit()
+            deleted += len(batch)
+            if progress:
+                progress(deleted / len(delete_ids), f'Удалено {deleted} из {len(delete_ids)}')
+        if deleted and self.split_adjusted_prices:
+            self.split_adjusted_prices.prune()
+
+        print(f"[{datetime.now(self.moscow_tz)}] Очистка истории: удалено {deleted} из {total_rows} записей")
+        return {'total': total_rows, 'deleted': deleted}
+
     def get_price_history(self, ticker=None, days=None, date_from=None, date_to=None, limit=None):
         """
         Получить историю цен
@@ -0,0 +1,160 @@
+"""
+Отчёт о реализованной прибыли/убытке по продажам (налоговые лоты, FIFO)
+
+Все транзакции пользователя проходятся один раз в порядке дат: по каждому
+тикеру держится очередь открытых покупок, каждая продажа закрывает самые
+старые из них. Для продажи получаем закрытые лоты со сроком владения,
+себестоимость и результат, а попутно — итоги по тикерам и по годам.
+"""
+from collections import deque
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from models.transaction import TransactionType
+
+
+class RealizedPnLReport:
+    """
+    Однопроходный расчёт реализованного результата
+
+    Правила FIFO те же, что у LotLedger: продажа закрывает самые старые
+    покупки, покупка после полной продажи начинает позицию заново.
+    Цены и количества берутся как в транзакциях (сплиты не применяются —
+    так же, как при учёте открытых лотов).
+
+    Продажа сверх купленного не получает себестоимости: её количество
+    возвращается в unmatched_quantity и в результат не входит.
+    """
+
+    EPSILON = 1e-9
+    # Льгота долгосрочного владения (ЛДВ): бумаги в собственности больше трёх лет
+    LONG_TERM_DAYS = 3 * 365
+
+    def __init__(self):
+        self._lots: Dict[str, deque] = {}        # тикер -> deque([id, дата, цена, остаток])
+        self._quantity: Dict[str, float] = {}    # тикер -> текущее количество
+        self.sales: List[dict] = []
+        self._by_ticker: Dict[str, dict] = {}
+        self._by_year: Dict[int, dict] = {}
+
+    @staticmethod
+    def _empty_totals() -> dict:
+        return {'proceeds': 0.0, 'cost': 0.0, 'realized_pnl': 0.0, 'long_term_pnl': 0.0, 'sales': 0}
+
+    def add(self, transaction_id: int, ticker: str, tx_date: datetime,
+            operation_type: TransactionType, price: float, quantity: float):
+        """Учесть очередную транзакцию (транзакции должны идти по возрастанию даты и id)"""
+        ticker = (ticker or '').upper()
+        lots = self._lots.setdefault(ticker, deque())
+        current = self._quantity.get(ticker, 0.0)
+
+        if operation_type == TransactionType.BUY:
+            if current <= 0:
+                # Позиция была полностью продана — начинаем заново
+                lots.clear()
+            lots.append([transaction_id, tx_date, price, quantity])
+            self._quantity[ticker] = current + quantity
+            return
+
+        self._quantity[ticker] = max(current - quantity, 0.0)
+        remaining = quantity
+        closed = []
+        while remaining > self.EPSILON and lots:
+            lot = lots[0]
+            matched = min(lot[3], remaining)
+            holding_days = (tx_date.date() - lot[1].date()).days
+            closed.append({
+                'buy_transaction_id': lot[0],
+                'buy_date': lot[1].strftime('%Y-%m-%d %H:%M:%S'),
+                'buy_price': lot[2],
+                'quantity': matched,
+                'cost': lot[2] * matched,
+                'holding_days': holding_days,
+                'long_term': holding_days > self.LONG_TERM_DAYS,
+            })
+            remaining -= matched
+            if lot[3] - matched <= self.EPSILON:
+                lots.popleft()
+            else:
+                lot[3] -= matched
+
+        matched_quantity = quantity - max(remaining, 0.0)
+        proceeds = price * matched_quantity
+        cost = sum(lot['cost'] for lot in closed)
+        realized = proceeds - cost
+        long_term = sum(price * lot['quantity'] - lot['cost'] for lot in closed if lot['long_term'])
+        holding_days = (
+            sum(lot['holding_days'] * lot['quantity'] for lot in closed) / matched_quantity
+            if matched_quantity > 0 else 0
+        )
+        self.sales.append({
+            'transaction_id': transaction_id,
+            'ticker': ticker,
+            'date': tx_date.strftime('%Y-%m-%d %H:%M:%S'),
+            'year': tx_date.year,
+            'quantity': quantity,
+            'sell_price': price,
+            'proceeds': proceeds,
+            'cost': cost,
+            'realized_pnl': realized,
+            'long_term_pnl': long_term,
+            'holding_days': holding_days,
+            'unmatched_quantity': quantity - matched_quantity,
+            'lots': closed,
+        })
+        for totals in (self._by_ticker.setdefault(ticker, self._empty_totals()),
+                       self._by_year.setdefault(tx_date.year, self._empty_totals())):
+            totals['proceeds'] += proceeds
+            totals['cost'] += cost
+            totals['realized_pnl'] += realized
+            totals['long_term_pnl'] += long_term
+            totals['sales'] += 1
+
+    def build(self, rows: Iterable) -> dict:
+        """
+        Проиграть транзакции и вернуть отчёт
+
+        Args:
+            rows: строки с полями id, ticker, date, operation_type, price, quantity,
+                  упорядоченные по (date, id)
+
+        Returns:
+            {'sales': [...], 'by_ticker': [...], 'by_year': [...], 'total': {...}}
+        """
+        for row in rows:
+            self.add(row.id, row.ticker, row.date, row.operation_type, row.price, row.quantity)
+        return self.result()
+
+    def result(self, include_sales: bool = True) -> dict:
+        total = self._empty_totals()
+        for totals in self._by_year.values():
+            for key in total:
+                total[key] += totals[key]
+        report = {
+            'by_ticker': [dict(ticker=t, **v) for t, v in sorted(self._by_ticker.items())],
+            'by_year': [dict(year=y, **v) for y, v in sorted(self._by_year.items())],
+            'total': total,
+        }
+        if include_sales:
+            report['sales'] = self.sales
+        return report
+
+    @staticmethod
+    def filter_year(report: dict, year: Optional[int]) -> dict:
+        """Отчёт, ограниченный одним годом продаж (итоги по тикерам пересчитываются)"""
+        if year is None:
+            return report
+        sales = [s for s in report.get('sales', []) if s['year'] == year]
+        by_ticker: Dict[str, dict] = {}
+        for sale in sales:
+            totals = by_ticker.setdefault(sale['ticker'], RealizedPnLReport._empty_totals())
+            for key in ('proceeds', 'cost', 'realized_pnl', 'long_term_pnl'):
+                totals[key] += sale[key]
+            totals['sales'] += 1
+        year_totals = next((y for y in report['by_year'] if y['year'] == year), None)
+        return {
+            'sales': sales,
+            'by_ticker': [dict(ticker=t, **v) for t, v in sorted(by_ticker.items())],
+            'by_year': [year_totals] if year_totals else [],
+            'total': {k: v for k, v in year_totals.items() if k != 'year'} if year_totals
+            else RealizedPnLReport._empty_totals(),
+        }
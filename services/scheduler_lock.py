@@ -0,0 +1,99 @@
+"""
+Файловая блокировка «лидера» планировщика
+
+Несколько воркеров gunicorn (и/или отдельный процесс scheduler_worker.py)
+импортируют один и тот же app.py, и в каждом создаётся APScheduler.
+Запускать его должен только один процесс — тот, кто удерживает
+эксклюзивную блокировку файла. Блокировку держит ОС: если процесс-лидер
+упал или был перезапущен, она освобождается автоматически, и другой
+процесс подхватывает роль лидера при следующей попытке.
+"""
+import os
+from datetime import datetime
+from typing import Optional
+from sqlalchemy.engine import make_url
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки нет, процесс всегда считается лидером
+    fcntl = None
+
+
+def default_lock_path(db_url: str) -> str:
+    """
+    Путь к файлу блокировки по умолчанию.
+
+    Для SQLite — рядом с файлом БД: все процессы приложения видят один и тот же
+    файл (в отличие от /tmp, который systemd может изолировать через PrivateTmp).
+    """
+    env_path = os.environ.get('SCHEDULER_LOCK_FILE')
+    if env_path:
+        return env_path
+    try:
+        url = make_url(db_url)
+        if url.get_backend_name() == 'sqlite' and url.database and url.database != ':memory:':
+            return os.path.join(os.path.dirname(os.path.abspath(url.database)), 'scheduler.lock')
+    except Exception:
+        pass
+    return os.path.abspath('scheduler.lock')
+
+
+class SchedulerLock:
+    """
+    Неблокирующая эксклюзивная блокировка файла (flock)
+
+    acquire() не ждёт: либо сразу становимся лидером, либо возвращаем False.
+    В файл пишется PID лидера, чтобы его было видно в /api/scheduler/status.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+        self.acquired_at: Optional[datetime] = None
+
+    @property
+    def is_held(self) -> bool:
+        return self._fd is not None or (fcntl is None and self.acquired_at is not None)
+
+    def acquire(self) -> bool:
+        """Попытаться стать лидером. Returns: True, если блокировка у нас"""
+        if self.is_held:
+            return True
+        if fcntl is None:
+            self.acquired_at = datetime.now()
+            return True
+
+        fd = None
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            if fd is not None:
+                os.close(fd)
+            return False
+
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        os.fsync(fd)
+        self._fd = fd
+        self.acquired_at = datetime.now()
+        return True
+
+    def release(self):
+        """Отпустить блокировку (при остановке процесса)"""
+        if self._fd is not None:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            finally:
+                os.close(self._fd)
+                self._fd = None
+        self.acquired_at = None
+
+    def holder_pid(self) -> Optional[int]:
+        """PID текущего лидера, записанный в файл блокировки"""
+        try:
+            with open(self.path) as f:
+                content = f.read().strip()
+            return int(content) if content else None
+        except (OSError, ValueError):
+            return None
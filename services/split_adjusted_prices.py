@@ -0,0 +1,141 @@
+"""
+История цен в текущей шкале с учётом сплитов пользователя
+
+Раньше каждая запись истории приводилась к текущей шкале в Python при каждом
+чтении (график, история цен, выгрузки). Теперь множитель сплитов для записи
+хранится в split_price_factors и пересчитывается только при изменениях:
+сплиты тикера — одним INSERT ... SELECT по истории этого тикера, новые цены —
+только для тикеров, у которых есть сплит не раньше даты цены. Чтение —
+LEFT JOIN и price * coalesce(factor, 1) в том же запросе.
+"""
+from datetime import date
+from typing import Dict, Optional
+from sqlalchemy import select, insert, and_, case, func, literal
+from models.database import db_session
+from models.price_history import PriceHistory
+from models.split_coefficient import SplitCoefficient
+from models.split_price_factor import SplitPriceFactor
+from services.split_index import SplitFactorIndex, TickerSplits
+
+
+class SplitAdjustedPrices:
+    """
+    Множитель записи — произведение коэффициентов сплитов с датой не раньше
+    даты цены (те же правила, что у SplitFactorIndex.price_factor). Между
+    соседними датами сплитов множитель постоянен, поэтому пересчёт тикера —
+    один CASE по дате цены, без чтения истории в Python.
+    """
+
+    @staticmethod
+    def _factor_case(splits: TickerSplits):
+        """Множитель по дате цены: i-й сплит и все более поздние действуют на цены до его даты включительно"""
+        price_date = func.date(PriceHistory.logged_at)
+        return case(
+            *[
+                (price_date <= eff_date.isoformat(), literal(factor if factor > 0 else 1.0))
+                for eff_date, factor in zip(splits.dates, splits.suffix)
+            ],
+            else_=literal(1.0),
+        )
+
+    def rebuild(self, user_id: int, ticker: str, commit: bool = True) -> int:
+        """
+        Пересчитать множители истории одного тикера пользователя
+        (после добавления или удаления коэффициента сплита)
+
+        Returns:
+            Количество записей истории, на которые действуют сплиты
+        """
+        ticker = (ticker or '').strip().upper()
+        # Сессия без autoflush: только что добавленный коэффициент должен попасть в выборку
+        db_session.flush()
+        db_session.query(SplitPriceFactor).filter(
+            SplitPriceFactor.user_id == user_id, SplitPriceFactor.ticker == ticker
+        ).delete(synchronize_session=False)
+
+        splits = SplitFactorIndex(
+            db_session.query(
+                SplitCoefficient.ticker, SplitCoefficient.effective_date, SplitCoefficient.coefficient
+            ).filter(SplitCoefficient.user_id == user_id, SplitCoefficient.ticker == ticker).all()
+        ).get(ticker)
+
+        count = 0
+        if splits:
+            source = select(
+                literal(user_id), PriceHistory.id, PriceHistory.ticker, self._factor_case(splits)
+            ).where(
+                PriceHistory.ticker == ticker,
+                func.date(PriceHistory.logged_at) <= splits.dates[-1].isoformat(),
+            )
+            result = db_session.execute(insert(SplitPriceFactor).from_select(
+                ['user_id', 'price_history_id', 'ticker', 'factor'], source
+            ))
+            count = max(result.rowcount or 0, 0)
+        if commit:
+            db_session.commit()
+        return count
+
+    def rebuild_all(self, commit: bool = True) -> int:
+        """Пересчитать множители всех пользователей и тикеров со сплитами"""
+        db_session.flush()
+        db_session.query(SplitPriceFactor).delete(synchronize_session=False)
+        pairs = db_session.query(SplitCoefficient.user_id, SplitCoefficient.ticker).distinct().all()
+        count = sum(self.rebuild(user_id, ticker, commit=False) for user_id, ticker in pairs)
+        if commit:
+            db_session.commit()
+        return count
+
+    def on_prices_written(self, since: date, commit: bool = True) -> int:
+        """
+        Учесть новые или перезаписанные цены с датой >= since
+
+        На такие цены действуют только сплиты с датой не раньше since, поэтому
+        пересчитываются лишь пары (пользователь, тикер) с такими сплитами —
+        обычно ни одной.
+        """
+        pairs = db_session.query(SplitCoefficient.user_id, SplitCoefficient.ticker).group_by(
+            SplitCoefficient.user_id, SplitCoefficient.ticker
+        ).having(func.max(SplitCoefficient.effective_date) >= since).all()
+        count = sum(self.rebuild(user_id, ticker, commit=False) for user_id, ticker in pairs)
+        if commit:
+            db_session.commit()
+        return count
+
+    def prune(self, commit: bool = True) -> int:
+        """Удалить множители записей истории, которых больше нет (после удаления истории цен)"""
+        deleted = db_session.query(SplitPriceFactor).filter(
+            ~SplitPriceFactor.price_history_id.in_(select(PriceHistory.id))
+        ).delete(synchronize_session=False)
+        if commit:
+            db_session.commit()
+        return deleted
+
+    # --- Чтение ---
+
+    @staticmethod
+    def select_prices(user_id: Optional[int], *columns):
+        """
+        select(колонки..., price, price_original) по истории цен
+
+        price — цена в текущей шкале пользователя, price_original — как записана.
+        Фильтры и сортировку по колонкам PriceHistory добавляет вызывающий код.
+        """
+        return select(
+            *columns,
+            (PriceHistory.price * func.coalesce(SplitPriceFactor.factor, 1.0)).label('price'),
+            PriceHistory.price.label('price_original'),
+        ).select_from(PriceHistory).outerjoin(SplitPriceFactor, and_(
+            SplitPriceFactor.price_history_id == PriceHistory.id,
+            SplitPriceFactor.user_id == user_id,
+            SplitPriceFactor.ticker == PriceHistory.ticker,
+        ))
+
+    @staticmethod
+    def factors(user_id: Optional[int], session=None, ticker: Optional[str] = None) -> Dict[int, float]:
+        """Множители пользователя {id записи истории: множитель} (записи без сплитов не входят)"""
+        query = (session or db_session).query(
+            SplitPriceFactor.price_history_id, SplitPriceFactor.factor
+        ).filter(SplitPriceFactor.user_id == user_id)
+        if ticker:
+            query = query.filter(SplitPriceFactor.ticker == ticker.strip().upper())
+        return dict(query.all())
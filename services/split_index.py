@@ -0,0 +1,155 @@
+"""
+Индекс коэффициентов сплитов: отсортированные даты и накопленные произведения
+
+Приведение цены к текущей шкале и накопленный коэффициент на дату считаются
+одним bisect по датам тикера (O(log k)) вместо прохода по всем коэффициентам
+с разбором дат на каждую строку истории. Индекс пользователя кэшируется
+в памяти процесса и пересобирается, когда меняются его коэффициенты.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import func
+from models.split_coefficient import SplitCoefficient
+
+
+class TickerSplits:
+    """
+    Сплиты одного тикера
+
+    dates  — даты вступления в силу по возрастанию
+    prefix — prefix[i]: произведение коэффициентов dates[0..i-1]
+    suffix — suffix[i]: произведение коэффициентов dates[i..]
+    prefix перемножается в порядке возрастания дат — так же, как прежний линейный
+    проход, поэтому factor_until совпадает с ним до последнего бита. suffix
+    накапливается одним проходом от последнего сплита к первому
+    (coeffs[i] * suffix[i + 1]): от перебора по возрастанию он может отличаться
+    на единицу последнего разряда.
+    """
+
+    __slots__ = ('dates', 'prefix', 'suffix')
+
+    def __init__(self, items: List[Tuple[date, float]]):
+        items = sorted(items, key=lambda item: item[0])
+        self.dates = [d for d, _ in items]
+        coeffs = [c for _, c in items]
+        self.prefix = [1.0]
+        for coeff in coeffs:
+            self.prefix.append(self.prefix[-1] * coeff)
+        self.suffix = [1.0] * (len(coeffs) + 1)
+        acc = 1.0
+        for i in range(len(coeffs) - 1, -1, -1):
+            acc *= coeffs[i]
+            self.suffix[i] = acc
+
+    def factor_until(self, target: date) -> float:
+        """Произведение коэффициентов с датой <= target"""
+        return self.prefix[bisect_right(self.dates, target)]
+
+    def factor_from(self, target: date) -> float:
+        """Произведение коэффициентов с датой >= target"""
+        return self.suffix[bisect_left(self.dates, target)]
+
+
+class SplitFactorIndex:
+    """Сплиты пользователя по тикерам (тикеры в верхнем регистре)"""
+
+    def __init__(self, rows: Iterable[Tuple[str, object, float]] = ()):
+        """
+        Args:
+            rows: (тикер, дата вступления в силу, коэффициент); дата может быть строкой YYYY-MM-DD.
+                  Коэффициенты <= 0 и строки без даты пропускаются.
+        """
+        grouped: Dict[str, List[Tuple[date, float]]] = {}
+        for ticker, eff_date, coeff in rows:
+            if isinstance(eff_date, str):
+                try:
+                    eff_date = datetime.strptime(eff_date, '%Y-%m-%d').date()
+                except Exception:
+                    eff_date = None
+            elif isinstance(eff_date, datetime):
+                eff_date = eff_date.date()
+            coeff = float(coeff or 1.0)
+            if eff_date and coeff > 0:
+                grouped.setdefault((ticker or '').strip().upper(), []).append((eff_date, coeff))
+        self._tickers = {ticker: TickerSplits(items) for ticker, items in grouped.items()}
+
+    def get(self, ticker: str) -> Optional[TickerSplits]:
+        return self._tickers.get((ticker or '').strip().upper())
+
+    def __contains__(self, ticker: str) -> bool:
+        return self.get(ticker) is not None
+
+    def __bool__(self) -> bool:
+        return bool(self._tickers)
+
+    @staticmethod
+    def _as_date(value) -> Optional[date]:
+        return value.date() if isinstance(value, datetime) else value
+
+    def factor_until(self, ticker: str, target) -> float:
+        """Накопленный коэффициент сплитов на дату (включительно); 1.0 без сплитов"""
+        splits = self.get(ticker)
+        target = self._as_date(target)
+        if not splits or not target:
+            return 1.0
+        factor = splits.factor_until(target)
+        return factor if factor > 0 else 1.0
+
+    def price_factor(self, ticker: str, price_dt) -> float:
+        """Множитель приведения цены на дату к текущей шкале (сплиты в дату цены и позже)"""
+        splits = self.get(ticker)
+        price_date = self._as_date(price_dt)
+        if not splits or not price_date:
+            return 1.0
+        factor = splits.factor_from(price_date)
+        return factor if factor > 0 else 1.0
+
+
+class SplitIndexCache:
+    """
+    SplitFactorIndex по пользователям в памяти процесса
+
+    Перед выдачей индекса сверяется отпечаток коэффициентов пользователя
+    (количество, максимальные id и created_at) — один агрегатный запрос.
+    Так изменения, сделанные другим воркером или фоновой задачей, видны
+    без межпроцессных уведомлений; invalidate() сбрасывает индекс сразу.
+    """
+
+    def __init__(self):
+        self._entries: Dict[int, Tuple[tuple, SplitFactorIndex]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stamp(user_id: int, session) -> tuple:
+        row = session.query(
+            func.count(SplitCoefficient.id), func.max(SplitCoefficient.id), func.max(SplitCoefficient.created_at)
+        ).filter(SplitCoefficient.user_id == user_id).one()
+        return tuple(str(v) for v in row)
+
+    def get(self, user_id: Optional[int], session) -> SplitFactorIndex:
+        if not user_id:
+            return SplitFactorIndex()
+        stamp = self._stamp(user_id, session)
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+
+        rows = session.query(
+            SplitCoefficient.ticker, SplitCoefficient.effective_date, SplitCoefficient.coefficient
+        ).filter(SplitCoefficient.user_id == user_id).order_by(
+            SplitCoefficient.effective_date.asc(), SplitCoefficient.id.asc()
+        ).all()
+        index = SplitFactorIndex(rows)
+        with self._lock:
+            self._entries[user_id] = (stamp, index)
+        return index
+
+    def invalidate(self, user_id: Optional[int] = None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
@@ -0,0 +1,178 @@
+"""
+Сплиты и консолидации из MOEX ISS → коэффициенты сплитов пользователей
+
+Раньше коэффициенты вводились только вручную, и пропущенный сплит молча
+ломал графики и количества. Теперь события по всем бумагам загружаются одним
+постраничным запросом к ISS в таблицу corporate_actions, а по ней каждому
+пользователю предлагаются (или сразу добавляются) недостающие SplitCoefficient.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import func
+from models.database import db_session
+from models.corporate_action import CorporateAction
+from models.portfolio import Portfolio
+from models.split_coefficient import SplitCoefficient
+from models.transaction import Transaction
+from services.moex_service import MOEXService
+
+
+class SplitSync:
+    """
+    Событие предлагается пользователю, если тикер есть в его портфеле,
+    коэффициента на эту дату ещё нет и событие случилось после начала владения
+    (первой транзакции по тикеру, а без транзакций — добавления в портфель):
+    сплит до покупки на количество не влияет, а коэффициент пересчитал бы его.
+    """
+
+    def __init__(self, moex_service: MOEXService, split_adjusted_prices=None, split_index_cache=None):
+        self.moex_service = moex_service
+        self.split_adjusted_prices = split_adjusted_prices
+        self.split_index_cache = split_index_cache
+
+    def refresh(self) -> List[CorporateAction]:
+        """
+        Загрузить события из ISS и сохранить новые (по тикерам из портфелей пользователей)
+
+        Returns:
+            Впервые сохранённые события
+        """
+        tracked = {row.ticker.upper() for row in db_session.query(Portfolio.ticker).distinct() if row.ticker}
+        if not tracked:
+            return []
+        fetched = self.moex_service.get_splits()
+        if not fetched:
+            return []
+
+        known = {
+            (row.ticker, row.trade_date)
+            for row in db_session.query(CorporateAction.ticker, CorporateAction.trade_date)
+        }
+        created = []
+        now = datetime.now()
+        for item in fetched:
+            if item['ticker'] not in tracked:
+                continue
+            try:
+                trade_date = datetime.strptime(item['date'], '%Y-%m-%d').date()
+            except ValueError:
+                continue
+            if (item['ticker'], trade_date) in known:
+                continue
+            known.add((item['ticker'], trade_date))
+            action = CorporateAction(
+                ticker=item['ticker'], trade_date=trade_date,
+                before=item['before'], after=item['after'], fetched_at=now,
+            )
+            db_session.add(action)
+            created.append(action)
+        db_session.commit()
+        return created
+
+    def _holding_starts(self, user_id: int) -> Dict[str, datetime]:
+        """Начало владения по тикерам портфеля пользователя"""
+        starts = {
+            (row.ticker or '').upper(): row.date_added
+            for row in db_session.query(Portfolio.ticker, Portfolio.date_added).filter(Portfolio.user_id == user_id)
+        }
+        first_transactions = db_session.query(
+            Transaction.ticker, func.min(Transaction.date)
+        ).filter(Transaction.user_id == user_id).group_by(Transaction.ticker)
+        for ticker, first_date in first_transactions:
+            ticker = (ticker or '').upper()
+            if ticker in starts and first_date:
+                starts[ticker] = first_date
+        return starts
+
+    def proposals(self, user_id: int, actions: Optional[Iterable[CorporateAction]] = None) -> List[CorporateAction]:
+        """
+        События, которые стоит добавить пользователю как коэффициенты сплитов
+
+        Args:
+            actions: рассматриваемые события (по умолчанию — все сохранённые)
+        """
+        starts = self._holding_starts(user_id)
+        if not starts:
+            return []
+        if actions is None:
+            actions = db_session.query(CorporateAction).filter(
+                CorporateAction.ticker.in_(list(starts))
+            ).order_by(CorporateAction.trade_date.asc(), CorporateAction.id.asc()).all()
+        existing = {
+            (row.ticker.upper(), row.effective_date)
+            for row in db_session.query(SplitCoefficient.ticker, SplitCoefficient.effective_date)
+            .filter(SplitCoefficient.user_id == user_id)
+        }
+        result = []
+        for action in actions:
+            start = starts.get(action.ticker)
+            if start is None or (action.ticker, action.trade_date) in existing:
+                continue
+            if start.date() >= action.trade_date:
+                continue
+            result.append(action)
+        return result
+
+    def apply(self, user_id: int, action_ids: Optional[Iterable[int]] = None) -> List[SplitCoefficient]:
+        """
+        Добавить пользователю коэффициенты по предложенным событиям
+
+        Args:
+            action_ids: id событий из proposals (None — все предложенные)
+
+        Returns:
+            Добавленные коэффициенты
+        """
+        actions = self.proposals(user_id)
+        if action_ids is not None:
+            wanted = set(action_ids)
+            actions = [a for a in actions if a.id in wanted]
+        rows = self._add_coefficients(user_id, actions)
+        db_session.commit()
+        if rows and self.split_index_cache:
+            self.split_index_cache.invalidate(user_id)
+        return rows
+
+    def _add_coefficients(self, user_id: int, actions: List[CorporateAction]) -> List[SplitCoefficient]:
+        rows = [
+            SplitCoefficient(
+                user_id=user_id, ticker=action.ticker,
+                effective_date=action.trade_date, coefficient=action.coefficient,
+            )
+            for action in actions
+        ]
+        db_session.add_all(rows)
+        if self.split_adjusted_prices:
+            for ticker in {row.ticker for row in rows}:
+                self.split_adjusted_prices.rebuild(user_id, ticker, commit=False)
+        return rows
+
+    def sync(self, auto_apply: bool = False) -> Tuple[int, Dict[int, List[SplitCoefficient]]]:
+        """
+        Плановая синхронизация: загрузить события и (если auto_apply) добавить
+        пользователям коэффициенты по событиям, загруженным впервые. Уже
+        известные события повторно не применяются — удалённый пользователем
+        коэффициент не вернётся при следующем запуске.
+
+        Returns:
+            (сколько событий загружено впервые, {user_id: добавленные коэффициенты})
+        """
+        created = self.refresh()
+        applied: Dict[int, List[SplitCoefficient]] = {}
+        if not created or not auto_apply:
+            return len(created), applied
+
+        user_ids = [
+            row.user_id for row in db_session.query(Portfolio.user_id).filter(
+                Portfolio.ticker.in_({a.ticker for a in created})
+            ).distinct() if row.user_id is not None
+        ]
+        for user_id in user_ids:
+            rows = self._add_coefficients(user_id, self.proposals(user_id, created))
+            if rows:
+                applied[user_id] = rows
+        db_session.commit()
+        if self.split_index_cache:
+            for user_id in applied:
+                self.split_index_cache.invalidate(user_id)
+        return len(created), applied
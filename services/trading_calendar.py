@@ -0,0 +1,214 @@
+"""
+Календарь торговых дней MOEX, сохранённый в БД
+"""
+import threading
+from datetime import datetime, date, timedelta
+from typing import Optional, Dict
+import pytz
+from sqlalchemy import select, func
+from sqlalchemy.exc import SQLAlchemyError
+from models.database import engine, read_engine
+from models.trading_day import TradingDay
+from services.moex_service import MOEXService
+
+
+class TradingCalendar:
+    """
+    Календарь торговых дней фондового рынка MOEX
+
+    - тянет календарь из ISS на период от прошлой недели до конца следующего месяца
+      и сохраняет его в таблицу trading_days; загружают его только задачи
+      планировщика (refresh / refresh_if_stale), чтение из веб-запросов в ISS не ходит
+    - любой процесс читает календарь из таблицы лениво: копия в памяти
+      перечитывается, когда меняется отпечаток таблицы (количество строк и время
+      загрузки), поэтому воркеры без планировщика видят календарь лидера,
+      а после перезапуска свежий календарь не запрашивается заново
+    - день внутри загруженного периода, которого нет в календаре, неторговый
+    - если календаря нет или день вне периода, день считается торговым,
+      чтобы задачи логирования работали как раньше
+    """
+
+    REFRESH_INTERVAL = timedelta(days=30)
+    RETRY_INTERVAL = timedelta(hours=1)  # Повтор загрузки после неудачи
+
+    def __init__(self, moex_service: MOEXService):
+        self.moex_service = moex_service
+        self.moscow_tz = pytz.timezone('Europe/Moscow')
+        self._days: Dict[date, bool] = {}
+        self._range_from: Optional[date] = None
+        self._range_to: Optional[date] = None
+        self._last_update: Optional[datetime] = None
+        self._last_attempt: Optional[datetime] = None
+        self._stamp: Optional[tuple] = None  # Отпечаток таблицы, из которой прочитана копия
+        self._lock = threading.Lock()
+
+    def _today(self) -> date:
+        return datetime.now(self.moscow_tz).date()
+
+    def _load(self):
+        """Перечитать календарь из trading_days, если таблица изменилась с прошлого чтения"""
+        try:
+            with read_engine.connect() as conn:
+                stamp = tuple(conn.execute(
+                    select(func.count(), func.max(TradingDay.fetched_at)).select_from(TradingDay)
+                ).one())
+                with self._lock:
+                    if stamp == self._stamp:
+                        return
+                rows = conn.execute(select(TradingDay.day, TradingDay.is_trading)).all()
+        except SQLAlchemyError as e:
+            print(f"[TradingCalendar] Не удалось прочитать календарь торгов из БД: {e}")
+            return
+
+        days = {row.day: bool(row.is_trading) for row in rows}
+        with self._lock:
+            self._days = days
+            self._range_from = min(days) if days else None
+            self._range_to = max(days) if days else None
+            self._last_update = stamp[1]
+            self._stamp = stamp
+
+    def refresh(self) -> bool:
+        """
+        Загрузить календарь из ISS и сохранить в trading_days
+
+        Returns:
+            True, если календарь получен и сохранён
+        """
+        today = self._today()
+        range_from = today - timedelta(days=7)
+        # Конец следующего месяца
+        next_month = (today.replace(day=1) + timedelta(days=32)).replace(day=1)
+        range_to = (next_month + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+        with self._lock:
+            self._last_attempt = datetime.now()
+        raw = self.moex_service.get_trading_calendar(range_from.isoformat(), range_to.isoformat())
+        if not raw:
+            print("[TradingCalendar] Не удалось получить календарь торгов из ISS")
+            return False
+
+        days = {}
+        for day_str, is_trading in raw.items():
+            try:
+                days[datetime.strptime(day_str, '%Y-%m-%d').date()] = is_trading
+            except ValueError:
+                continue
+        if not days:
+            print("[TradingCalendar] Календарь торгов из ISS не содержит дат")
+            return False
+        # Период, который календарь действительно покрывает: за его краями дни неизвестны
+        range_from = max(range_from, min(days))
+        range_to = min(range_to, max(days))
+        days = {day: is_trading for day, is_trading in days.items() if range_from <= day <= range_to}
+
+        fetched_at = datetime.now()
+        try:
+            # Календарь заменяется целиком: период таблицы — период последней загрузки
+            with engine.begin() as conn:
+                conn.execute(TradingDay.__table__.delete())
+                conn.execute(TradingDay.__table__.insert(), [
+                    {'day': day, 'is_trading': is_trading, 'fetched_at': fetched_at}
+                    for day, is_trading in days.items()
+                ])
+        except SQLAlchemyError as e:
+            # Повтор — как после неудачной загрузки, не раньше RETRY_INTERVAL
+            print(f"[TradingCalendar] Не удалось сохранить календарь торгов в БД: {e}")
+            return False
+
+        with self._lock:
+            self._days = days
+            self._range_from = range_from
+            self._range_to = range_to
+            self._last_update = fetched_at
+            self._stamp = None  # Следующее чтение сверится с таблицей
+        print(f"[TradingCalendar] Календарь торгов обновлён: {range_from} — {range_to}, "
+              f"неторговых дней: {len(self._closed_days())}")
+        return True
+
+    def refresh_if_stale(self) -> bool:
+        """
+        Загрузить календарь, если он устарел или не покрывает сегодня
+        (для задач планировщика; после неудачи повтор не чаще RETRY_INTERVAL)
+
+        Returns:
+            True, если календарь актуален
+        """
+        today = self._today()
+        self._load()
+        with self._lock:
+            in_range = self._range_from is not None and self._range_from <= today <= self._range_to
+            fresh = self._last_update is not None and datetime.now() - self._last_update < self.REFRESH_INTERVAL
+            recently_tried = (
+                self._last_attempt is not None and datetime.now() - self._last_attempt < self.RETRY_INTERVAL
+            )
+        if in_range and fresh:
+            return True
+        if recently_tried:
+            return False
+        return self.refresh()
+
+    def _known(self, day: date) -> bool:
+        return self._range_from is not None and self._range_from <= day <= self._range_to
+
+    def is_trading_day(self, day: date) -> bool:
+        """Торговый ли день. Неизвестный день (нет календаря или вне периода) считается торговым."""
+        self._load()
+        with self._lock:
+            if not self._known(day):
+                return True
+            return self._days.get(day, False)
+
+    def _closed_days(self) -> list:
+        """Неторговые дни загруженного периода (в том числе отсутствующие в календаре)"""
+        with self._lock:
+            if self._range_from is None:
+                return []
+            day, closed = self._range_from, []
+            while day <= self._range_to:
+                if not self._days.get(day, False):
+                    closed.append(day)
+                day += timedelta(days=1)
+            return closed
+
+    def has_session_for(self, day: date) -> bool:
+        """
+        Нужно ли в этот день запрашивать цены с биржи.
+
+        Запись за день делается в 00:00 и досписывается в течение дня, то есть
+        отражает закрытие предыдущей сессии и торги текущего дня. Поэтому цены
+        могли измениться, если торговым был сам день или предыдущий.
+        """
+        return self.is_trading_day(day) or self.is_trading_day(day - timedelta(days=1))
+
+    def next_trading_day(self, day: date) -> Optional[date]:
+        """Ближайший торговый день после day в пределах загруженного календаря"""
+        self._load()
+        with self._lock:
+            candidates = sorted(
+                d for d, is_trading in self._days.items() if is_trading and d > day and self._known(d)
+            )
+        return candidates[0] if candidates else None
+
+    def get_status(self) -> Dict:
+        """Состояние календаря для /api/scheduler/status (из БД, без запросов к ISS)"""
+        today = self._today()
+        self._load()
+        closed_days = [d.isoformat() for d in self._closed_days()]
+        with self._lock:
+            loaded = bool(self._days)
+            range_from = self._range_from.isoformat() if self._range_from else None
+            range_to = self._range_to.isoformat() if self._range_to else None
+            last_update = self._last_update.strftime('%Y-%m-%d %H:%M:%S') if self._last_update else None
+        next_day = self.next_trading_day(today)
+        return {
+            'loaded': loaded,
+            'range_from': range_from,
+            'range_to': range_to,
+            'last_update': last_update,
+            'today': today.isoformat(),
+            'today_is_trading': self.is_trading_day(today),
+            'fetch_prices_today': self.has_session_for(today),
+            'next_trading_day': next_day.isoformat() if next_day else None,
+            'closed_days': closed_days,
+        }
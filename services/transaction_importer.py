@@ -0,0 +1,256 @@
+"""
+Массовый импорт транзакций из выгрузок брокера (CSV / JSON)
+
+CSV (файлом или в теле запроса) читается и проверяется построчно — файл целиком
+в память не попадает. JSON разбирается целиком (json.load), поэтому большие
+выгрузки лучше загружать в CSV. Корректные строки вставляются пакетами
+по BATCH_SIZE строк (executemany) в одной транзакции вместе с пересчётом баланса
+(журналом движения денег — с даты самой ранней импортированной сделки)
+и открытых лотов — по одному разу на каждый затронутый тикер.
+Ошибочные строки не прерывают импорт и возвращаются в отчёте с номером строки;
+испорченный CSV (незакрытые кавычки, NUL-байты) отменяет импорт целиком.
+"""
+import csv
+import io
+import itertools
+import json
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from models.database import db_session
+from models.portfolio import InstrumentType
+from models.transaction import Transaction, TransactionType
+from services.lot_ledger import LotLedger
+from services.cash_ledger import CashLedger
+from services.position_timeline import PositionTimelineLedger
+
+
+class TransactionImporter:
+    """
+    Разбор, проверка и вставка транзакций пакетом
+
+    Поддерживаемые колонки (регистр не важен, есть русские варианты из выгрузок):
+    date, ticker, operation_type, price, quantity, company_name, instrument_type, notes.
+    """
+
+    COLUMN_ALIASES = {
+        'date': 'date', 'дата': 'date', 'datetime': 'date', 'дата сделки': 'date', 'trade_date': 'date',
+        'ticker': 'ticker', 'тикер': 'ticker', 'secid': 'ticker', 'код': 'ticker', 'symbol': 'ticker',
+        'operation_type': 'operation_type', 'operation': 'operation_type', 'type': 'operation_type',
+        'side': 'operation_type', 'операция': 'operation_type', 'тип операции': 'operation_type',
+        'вид сделки': 'operation_type', 'направление': 'operation_type',
+        'price': 'price', 'цена': 'price',
+        'quantity': 'quantity', 'qty': 'quantity', 'количество': 'quantity', 'кол-во': 'quantity',
+        'company_name': 'company_name', 'name': 'company_name', 'название': 'company_name',
+        'наименование': 'company_name', 'эмитент': 'company_name',
+        'instrument_type': 'instrument_type', 'тип инструмента': 'instrument_type',
+        'notes': 'notes', 'comment': 'notes', 'комментарий': 'notes', 'примечание': 'notes',
+    }
+    OPERATION_ALIASES = {
+        'покупка': TransactionType.BUY, 'buy': TransactionType.BUY, 'b': TransactionType.BUY,
+        'купля': TransactionType.BUY, 'к': TransactionType.BUY,
+        'продажа': TransactionType.SELL, 'sell': TransactionType.SELL, 's': TransactionType.SELL,
+        'п': TransactionType.SELL,
+    }
+    INSTRUMENT_ALIASES = {
+        'stock': InstrumentType.STOCK, 'акция': InstrumentType.STOCK,
+        'bond': InstrumentType.BOND, 'облигация': InstrumentType.BOND,
+    }
+    DATE_FORMATS = (
+        '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d',
+        '%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%d.%m.%Y',
+    )
+    # Без даты строку не угадать: дата сделки задаёт порядок лотов и баланса
+    REQUIRED_FIELDS = ('date', 'ticker', 'operation_type', 'price', 'quantity')
+    BATCH_SIZE = 1000  # Строк в одном executemany
+
+    def __init__(self, lot_ledger: Optional[LotLedger] = None, cash_ledger: Optional[CashLedger] = None,
+                 position_timeline: Optional[PositionTimelineLedger] = None):
+        self.lot_ledger = lot_ledger or LotLedger()
+        self.cash_ledger = cash_ledger or CashLedger()
+        self.position_timeline = position_timeline or PositionTimelineLedger()
+
+    # --- Разбор входных форматов ---
+
+    @staticmethod
+    def _detect_delimiter(header: str) -> str:
+        counts = {d: header.count(d) for d in (';', ',', '\t')}
+        return max(counts, key=counts.get) if any(counts.values()) else ','
+
+    def iter_csv(self, stream: Iterable[str]) -> Iterator[Tuple[int, dict]]:
+        """(номер строки файла, словарь колонок) — построчно, без чтения файла целиком"""
+        lines = iter(stream)
+        header = next(lines, None)
+        if header is None:
+            return
+        reader = csv.DictReader(itertools.chain([header], lines), delimiter=self._detect_delimiter(header))
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                # Дальше файл не разобрать: ошибка формата, а не одной строки
+                raise ValueError(f'строка {reader.reader.line_num}: {e}')
+            # Номер строки файла с учётом заголовка (для отчёта об ошибках)
+            yield reader.line_num, row
+
+    @staticmethod
+    def iter_json(data) -> Iterator[Tuple[int, dict]]:
+        """JSON-массив транзакций или объект {"transactions": [...]}"""
+        if isinstance(data, dict):
+            data = data.get('transactions', [])
+        if not isinstance(data, list):
+            raise ValueError('Ожидается массив транзакций')
+        for index, row in enumerate(data, start=1):
+            yield index, row if isinstance(row, dict) else {}
+
+    def iter_file(self, stream, filename: str = '') -> Iterator[Tuple[int, dict]]:
+        """
+        Разобрать бинарный поток файла (CSV или JSON — по расширению или содержимому)
+
+        CSV отдаётся построчно по мере чтения потока, JSON читается целиком.
+        """
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        if filename.lower().endswith('.json'):
+            return self.iter_json(json.load(text))
+        first_line = text.readline()
+        if first_line.lstrip().startswith(('[', '{')):
+            return self.iter_json(json.loads(first_line + text.read()))
+        return self.iter_csv(itertools.chain([first_line], text))
+
+    # --- Проверка ---
+
+    @staticmethod
+    def _parse_number(value) -> float:
+        if isinstance(value, (int, float)):
+            return float(value)
+        text = str(value or '').strip().replace('\xa0', '').replace(' ', '').replace(',', '.')
+        if not text:
+            raise ValueError('пустое значение')
+        return float(text)
+
+    def _parse_date(self, value) -> datetime:
+        text = str(value or '').strip()
+        if not text:
+            raise ValueError('нет даты')
+        for fmt in self.DATE_FORMATS:
+            try:
+                return datetime.strptime(text, fmt)
+            except ValueError:
+                continue
+        raise ValueError(f'неизвестный формат даты "{text}"')
+
+    def _normalize_keys(self, row: dict) -> dict:
+        normalized = {}
+        for key, value in row.items():
+            field = self.COLUMN_ALIASES.get(str(key or '').strip().lower())
+            if field and field not in normalized:
+                normalized[field] = value.strip() if isinstance(value, str) else value
+        return normalized
+
+    def validate_row(self, row: dict) -> dict:
+        """
+        Проверить строку и вернуть значения для вставки
+
+        Raises:
+            ValueError: описание ошибки для отчёта
+        """
+        data = self._normalize_keys(row)
+        missing = [f for f in self.REQUIRED_FIELDS if data.get(f) in (None, '')]
+        if missing:
+            raise ValueError(f'нет обязательных полей: {", ".join(missing)}')
+
+        operation_type = self.OPERATION_ALIASES.get(str(data['operation_type']).strip().lower())
+        if operation_type is None:
+            raise ValueError(f'неверный тип операции "{data["operation_type"]}" (ожидается "Покупка" или "Продажа")')
+
+        try:
+            price = self._parse_number(data['price'])
+            quantity = self._parse_number(data['quantity'])
+        except ValueError:
+            raise ValueError('цена и количество должны быть числами')
+        if price <= 0 or quantity <= 0:
+            raise ValueError('цена и количество должны быть положительными')
+
+        instrument_type = InstrumentType.STOCK
+        if data.get('instrument_type'):
+            instrument_type = (
+                self.INSTRUMENT_ALIASES.get(str(data['instrument_type']).strip().lower())
+                or InstrumentType.STOCK
+            )
+
+        return {
+            'date': self._parse_date(data.get('date')),
+            'ticker': str(data['ticker']).strip().upper(),
+            'company_name': data.get('company_name') or '',
+            'operation_type': operation_type,
+            'price': price,
+            'quantity': quantity,
+            'total': price * quantity,
+            'instrument_type': instrument_type,
+            'notes': (data.get('notes') or '')[:500],
+        }
+
+    # --- Импорт ---
+
+    def import_rows(self, user_id: int, rows: Iterable[Tuple[int, dict]], dry_run: bool = False) -> dict:
+        """
+        Проверить и вставить транзакции пользователя одной транзакцией БД
+
+        Баланс свободных денег пересчитывается журналом по тем же правилам, что и при
+        добавлении транзакции вручную; лоты каждого затронутого тикера
+        пересчитываются один раз. Позиции портфеля (Portfolio) пересчитывает вызывающий код.
+
+        Returns:
+            {'imported': int, 'valid': int, 'errors': [{'row': 3, 'error': '...'}],
+             'tickers': [...], 'cash_balance': float | None}
+        """
+        errors: List[Dict] = []
+        batch: List[dict] = []
+        valid = 0
+        # Для пересчётов достаточно самой ранней даты по каждому тикеру
+        earliest_by_ticker: Dict[str, datetime] = {}
+
+        try:
+            for row_number, row in rows:
+                try:
+                    item = self.validate_row(row)
+                except ValueError as e:
+                    errors.append({'row': row_number, 'error': str(e)})
+                    continue
+                valid += 1
+                ticker, tx_date = item['ticker'], item['date']
+                if ticker not in earliest_by_ticker or tx_date < earliest_by_ticker[ticker]:
+                    earliest_by_ticker[ticker] = tx_date
+                if dry_run:
+                    continue
+                item['user_id'] = user_id
+                batch.append(item)
+                if len(batch) >= self.BATCH_SIZE:
+                    db_session.execute(Transaction.__table__.insert(), batch)
+                    batch = []
+
+            tickers = sorted(earliest_by_ticker)
+            report = {'imported': 0, 'valid': valid, 'errors': errors, 'tickers': tickers, 'cash_balance': None}
+            if dry_run or not valid:
+                return report
+
+            if batch:
+                db_session.execute(Transaction.__table__.insert(), batch)
+
+            # id новых строк неизвестны: пересчёт с начала самой ранней даты импорта
+            earliest = min(earliest_by_ticker.values())
+            cash_balance = self.cash_ledger.rebuild(user_id, since=(earliest, 0), commit=False)
+
+            for ticker in tickers:
+                self.lot_ledger.rebuild(user_id, ticker, commit=False)
+            self.position_timeline.on_transaction_changed(user_id, *earliest_by_ticker.items(), commit=False)
+            db_session.commit()
+        except Exception:
+            # В том числе ошибка разбора файла после уже вставленных пакетов
+            db_session.rollback()
+            raise
+
+        report['imported'] = valid
+        report['cash_balance'] = cash_balance
+        return report
@@ -0,0 +1,231 @@
+"""
+Пакетная оценка позиций портфеля за один проход (без обращений к БД и MOEX)
+
+Вся арифметика оценки, которая раньше была вперемешку с запросами внутри
+get_portfolio: перевод цены облигаций из процентов номинала в валюту и рубли,
+коэффициенты сплитов, средняя цена и стоимость покупки по открытым лотам,
+прибыль/убыток, изменение цены за период и итоги портфеля.
+
+Входные данные — колонки одинаковой длины (по одному значению на позицию),
+каждая выходная колонка считается одним проходом по входным. Это обычные
+списки и циклы Python, а не векторизация: numpy в зависимостях нет, и при
+десятках позиций выигрыш даёт сам единый проход без запросов внутри, а не SIMD.
+Подготовка колонок (цены, курсы, коэффициенты) — забота вызывающего кода;
+курсы и коэффициенты сплитов на время одного запроса держит ValuationContext.
+"""
+from datetime import date
+from typing import Callable, Dict, List, Optional
+from services.split_index import SplitFactorIndex
+
+# Валюты номинала, которые не требуют пересчёта (SUR — код рубля на MOEX)
+RUB_CURRENCIES = ('SUR', 'RUB')
+
+
+class ValuationContext:
+    """
+    Курсы валют и коэффициенты сплитов на время одного расчёта портфеля
+
+    Курс каждой валюты запрашивается у fx_resolver один раз. Коэффициенты
+    сплитов берутся из SplitFactorIndex (даты разобраны и перемножены заранее,
+    поиск — bisect), накопленный коэффициент на сегодня запоминается по тикеру.
+    """
+
+    def __init__(self, split_index: Optional[SplitFactorIndex], today: date,
+                 fx_resolver: Callable[[str], float]):
+        self.today = today
+        self._fx_resolver = fx_resolver
+        self._fx_rates: Dict[str, float] = {}
+        self._split_factors: Dict[str, float] = {}
+        self._split_index = split_index or SplitFactorIndex()
+
+    def fx_rate(self, currency: Optional[str]) -> float:
+        """Курс валюты номинала к рублю (1.0 для рубля и при ошибке получения курса)"""
+        if not currency or currency in RUB_CURRENCIES:
+            return 1.0
+        rate = self._fx_rates.get(currency)
+        if rate is None:
+            try:
+                rate = self._fx_resolver(currency)
+            except Exception:
+                rate = 1.0
+            self._fx_rates[currency] = rate
+        return rate
+
+    def split_factor(self, ticker: str) -> float:
+        """Накопленный коэффициент сплитов на сегодня (включительно)"""
+        key = (ticker or '').upper()
+        factor = self._split_factors.get(key)
+        if factor is None:
+            factor = self._split_index.factor_until(key, self.today)
+            self._split_factors[key] = factor
+        return factor
+
+    def price_adjust(self, ticker: str, price_dt) -> float:
+        """Множитель приведения цены на дату к текущей шкале (сплиты в дату цены и позже)"""
+        return self._split_index.price_factor(ticker, price_dt)
+
+
+class PortfolioValuationEngine:
+    """
+    Пакетная оценка позиций: все позиции запроса — одним проходом по колонкам
+
+    Входные колонки (value):
+        is_bond            — облигация: цены в процентах от номинала
+        quantity           — количество в портфеле (до учёта сплитов)
+        average_buy_price  — средняя цена из портфеля (если открытых лотов нет)
+        lots_quantity      — остаток открытых лотов (None — лотов нет)
+        lots_cost          — стоимость покупки открытых лотов (None — лотов нет)
+        current_price      — текущая цена (для облигаций — % номинала)
+        has_quote          — цена получена (MOEX или кэш); без неё изменение цены = 0
+        facevalue          — номинал облигации (None — 1000)
+        fx_rate            — курс валюты номинала к рублю (1.0 для рублёвых и акций)
+        split_factor       — накопленный коэффициент сплитов на сегодня
+        latest_adjust      — множитель приведения текущей цены к текущей шкале
+        baseline_price     — цена начала периода из истории (None — нет записей)
+        baseline_adjust    — множитель приведения цены начала периода
+        lotsize            — размер лота
+    """
+
+    DEFAULT_FACEVALUE = 1000.0
+
+    INPUT_COLUMNS = (
+        'is_bond', 'quantity', 'average_buy_price', 'lots_quantity', 'lots_cost',
+        'current_price', 'has_quote', 'facevalue', 'fx_rate', 'split_factor',
+        'latest_adjust', 'baseline_price', 'baseline_adjust', 'lotsize',
+    )
+
+    @classmethod
+    def empty_columns(cls) -> Dict[str, list]:
+        return {name: [] for name in cls.INPUT_COLUMNS}
+
+    @classmethod
+    def value(cls, columns: Dict[str, list]) -> Dict[str, List[float]]:
+        """
+        Оценить позиции
+
+        Returns:
+            Колонки quantity, lots, average_buy_price, current_price, price_change,
+            price_change_percent, total_cost, total_buy_cost, profit_loss,
+            profit_loss_percent (суммы — в рублях, quantity — после сплитов)
+        """
+        is_bond = columns['is_bond']
+        split = columns['split_factor']
+        fx = columns['fx_rate']
+        nominal = [f if f else cls.DEFAULT_FACEVALUE for f in columns['facevalue']]
+
+        # Цены в текущей шкале (с учётом сплитов по дате цены)
+        latest = [
+            price * adjust if has_quote else None
+            for price, adjust, has_quote in zip(columns['current_price'], columns['latest_adjust'], columns['has_quote'])
+        ]
+        previous = [
+            base * adjust if base is not None else last
+            for base, adjust, last in zip(columns['baseline_price'], columns['baseline_adjust'], latest)
+        ]
+
+        # Изменение цены: для облигаций процент считается прямо из процентов,
+        # а изменение в деньгах — через номинал (в валюте номинала)
+        price_change = []
+        price_change_percent = []
+        for last, prev, bond, nom in zip(latest, previous, is_bond, nominal):
+            if last is None or prev is None:
+                price_change.append(0)
+                price_change_percent.append(0)
+            elif bond:
+                price_change.append(last * nom / 100 - prev * nom / 100)
+                price_change_percent.append(last - prev)
+            else:
+                change = last - prev
+                price_change.append(change)
+                price_change_percent.append((change / prev * 100) if prev > 0 else 0)
+
+        # Текущая цена в рублях: облигации — проценты * номинал / 100 * курс
+        current_rub = [
+            (price * nom / 100) * rate if bond else price
+            for price, nom, rate, bond in zip(columns['current_price'], nominal, fx, is_bond)
+        ]
+        price_change_rub = [
+            change * rate if bond else change
+            for change, rate, bond in zip(price_change, fx, is_bond)
+        ]
+
+        # Средняя цена покупки — по открытым лотам, иначе из портфеля (цены уже в рублях)
+        avg_raw = [
+            cost / lots_qty if cost is not None and lots_qty and lots_qty > 0 else avg
+            for cost, lots_qty, avg in zip(columns['lots_cost'], columns['lots_quantity'], columns['average_buy_price'])
+        ]
+
+        # Сплиты: количество делим на коэффициент, среднюю цену умножаем;
+        # текущая цена остаётся «как с биржи»
+        quantity = [q / s if s > 0 else q for q, s in zip(columns['quantity'], split)]
+        avg_rub = [(avg or 0) * s for avg, s in zip(avg_raw, split)]
+        total_value = [q * price for q, price in zip(quantity, current_rub)]
+
+        # Стоимость покупки — сумма открытых лотов; если количество в портфеле
+        # расходится с лотами (были продажи) — пропорционально текущему количеству
+        total_buy_cost = []
+        for q, avg, cost, lots_qty, s in zip(quantity, avg_rub, columns['lots_cost'], columns['lots_quantity'], split):
+            if cost is not None and lots_qty and lots_qty > 0:
+                effective_lots_qty = lots_qty / s if s > 0 else lots_qty
+                if abs(q - effective_lots_qty) < 0.01:
+                    total_buy_cost.append(cost)
+                else:
+                    total_buy_cost.append((cost / effective_lots_qty) * q)
+            else:
+                total_buy_cost.append(q * avg)
+
+        profit_loss = [value - cost for value, cost in zip(total_value, total_buy_cost)]
+        profit_loss_percent = [
+            ((price - avg) / avg * 100) if avg > 0 else 0
+            for price, avg in zip(current_rub, avg_rub)
+        ]
+        lots = [q / size if size > 0 else q for q, size in zip(quantity, columns['lotsize'])]
+
+        return {
+            'quantity': quantity,
+            'lots': lots,
+            'average_buy_price': avg_rub,
+            'current_price': current_rub,
+            'price_change': price_change_rub,
+            'price_change_percent': price_change_percent,
+            'total_cost': total_value,
+            'total_buy_cost': total_buy_cost,
+            'profit_loss': profit_loss,
+            'profit_loss_percent': profit_loss_percent,
+        }
+
+    @staticmethod
+    def summarize(values: Dict[str, List[float]], cash_balance: Optional[float] = None) -> dict:
+        """
+        Итоги портфеля по результату value() (или по колонкам, собранным из позиций)
+
+        Изменение цены портфеля — сумма изменений стоимости позиций, процент —
+        средневзвешенный по стоимости позиций, у которых цена изменилась.
+        """
+        total_value = sum(values['total_cost'])
+        total_cost = sum(values['total_buy_cost'])
+        total_pnl = total_value - total_cost
+        total_pnl_percent = (total_pnl / total_cost * 100) if total_cost > 0 else 0
+
+        total_price_change = sum(
+            change * q for change, q in zip(values['price_change'], values['quantity'])
+        )
+        changed_value = 0
+        weighted_percent = 0
+        for change, percent, value in zip(values['price_change'], values['price_change_percent'], values['total_cost']):
+            if change != 0:
+                changed_value += value
+                weighted_percent += percent * value
+        total_price_change_percent = weighted_percent / changed_value if changed_value > 0 else 0
+
+        summary = {
+            'total_value': total_value,
+            'total_cost': total_cost,
+            'total_pnl': total_pnl,
+            'total_pnl_percent': total_pnl_percent,
+            'total_price_change': total_price_change,
+            'total_price_change_percent': total_price_change_percent,
+        }
+        if cash_balance is not None:
+            summary['cash_balance'] = cash_balance
+        return summary
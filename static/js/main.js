@@ -67,6 +67,7 @@ function closeMainMenu() {
 let categoriesChanged = false; // Флаг изменения категорий
 let heightListenersAttached = false; // Флаг, чтобы не навешивать обработчики повторно
 let currentPortfolioData = null; // Текущие данные портфеля
+let portfolioVersion = null; // Версия портфеля на сервере, к которой относятся currentPortfolioData
 let currentChartType = localStorage.getItem('chartType') || 'pie'; // Текущий тип диаграммы (pie/bar)
 let currentAssetTypeChartType = localStorage.getItem('assetTypeChartType') || 'pie'; // Текущий тип диаграммы видов активов (pie/bar)
 // Режим сортировки для колонок "Прибыль" и "Изменение": 'rub' или 'pct'
@@ -74,6 +75,15 @@ let profitSortMode = localStorage.getItem('profitSortMode') || 'rub';
 let changeSortMode = localStorage.getItem('changeSortMode') || 'rub';
 let lastPriceLogCheck = null; // Последняя проверка записи цен
 let priceLogCheckInterval = null; // Интервал проверки новых записей цен
+let portfolioEventSource = null; // Подписка на поток событий /api/events (SSE)
+let priceLogReloadTimer = null; // Отложенная перезагрузка портфеля после записи цен
+let portfolioEventRetryTimer = null; // Повторное подключение к /api/events после отказа сервера
+const lastRawQuotes = new Map(); // Последняя котировка тикера из события quotes (как в БД, до пересчёта)
+let portfolioRefreshesInFlight = 0; // Точечные обновления строк после своих записей, ещё не завершённые
+let pendingStreamVersion = null; // Версия из события portfolio_version, ещё не сверенная с portfolioVersion
+let portfolioVersionTimer = null; // Отложенная сверка версии из потока
+const PORTFOLIO_VERSION_CHECK_DELAY_MS = 500;
+const PORTFOLIO_EVENTS_RETRY_MS = 60000; // Как Retry-After в ответе 503 (все слоты потоков событий заняты)
 
 // Режимы сортировки для колонок "Прибыль" и "Изменение"
 // profitSortMetric: 'rub' | 'percent'
@@ -314,7 +324,7 @@ document.addEventListener('DOMContentLoaded', async function() {
     // используя только сохранённые в БД данные (use_cached=1).
     loadPortfolio(false, true);
     setupEventListeners();
-    startPriceLogMonitoring(); // Запускаем мониторинг новых записей цен
+    startPortfolioEventStream(); // Подписываемся на события сервера (запись цен, изменения портфеля)
     loadCurrencyRates(); // Загружаем курсы валют для отображения
     setupStickyTableHeader(); // Настраиваем фиксацию шапки таблицы
     // На мобильных не ограничиваем высоту по viewport, даём странице скроллиться целиком
@@ -556,6 +566,7 @@ async function loadPortfolio(silent = false, useCachedPrices = false) {
                 portfolio: data.portfolio,
                 summary: data.summary
             };
+            portfolioVersion = data.version !== undefined ? data.version : null;
             
             // Отображаем данные
             displayPortfolio(currentPortfolioData.portfolio, currentPortfolioData.summary);
@@ -614,19 +625,23 @@ async function refreshSinglePortfolioPosition(ticker) {
     const errorMessage = document.getElementById('error-message');
     if (!tbody) return;
     
+    // Пока строка обновляется, событие portfolio_version о своей же записи не применяем
+    portfolioRefreshesInFlight++;
     try {
         if (errorMessage) {
             errorMessage.style.display = 'none';
         }
         
-        // Получаем актуальные данные портфеля с сервера
-        let url = '/api/portfolio';
-        const params = [];
-        if (currentChangeDays && currentChangeDays > 0) {
-            params.push(`change_days=${currentChangeDays}`);
+        // Если портфель ещё не загружен — обновлять точечно нечего
+        if (!currentPortfolioData) {
+            await loadPortfolio(true);
+            return;
         }
-        if (params.length > 0) {
-            url += `?${params.join('&')}`;
+        
+        // Получаем с сервера только эту позицию (остальные не пересчитываются)
+        let url = `/api/portfolio/${encodeURIComponent(ticker)}`;
+        if (currentChangeDays && currentChangeDays > 0) {
+            url += `?change_days=${currentChangeDays}`;
         }
         
         const response = await fetch(url);
@@ -636,67 +651,180 @@ async function refreshSinglePortfolioPosition(ticker) {
             return;
         }
         
-        // Обновляем глобальные данные портфеля
-        currentPortfolioData = {
-            portfolio: data.portfolio,
-            summary: data.summary
-        };
-        populateSplitTickerOptions();
-        
-        // Учитываем текущие фильтры по виду актива и категории
-        const { type: selectedType, category: selectedCategory } = getPortfolioFilters();
-        let filteredPortfolio = applyPortfolioFilters(currentPortfolioData.portfolio);
-        
-        // Если после операции портфель (с учётом фильтров) пуст — показываем сообщение как раньше
-        if (filteredPortfolio.length === 0) {
-            const hasType = !!selectedType;
-            const hasCategory = !!selectedCategory;
-            let message;
-            if (hasType && hasCategory) {
-                message = `Нет активов вида "${selectedType}" в категории "${selectedCategory}"`;
-            } else if (hasType) {
-                message = `Нет активов вида "${selectedType}"`;
-            } else if (hasCategory) {
-                message = `Нет активов категории "${selectedCategory}"`;
-            } else {
-                message = 'Портфель пуст. Добавьте первую позицию.';
-            }
-            tbody.innerHTML = `<tr><td colspan="9" style="text-align: center; padding: 40px; color: #7f8c8d;">${message}</td></tr>`;
-            previousPrices = {};
-            
-            const emptySummary = calculateSummaryFromPortfolio([]);
-            if (data.summary && data.summary.cash_balance !== undefined) {
-                emptySummary.cash_balance = data.summary.cash_balance;
-            }
-            updateSummary(emptySummary);
-            updateCategoryChart(currentPortfolioData.portfolio);
-            updatePortfolioSortIndicators();
+        mergePortfolioPositions(
+            data.position ? [data.position] : [],
+            data.position ? [] : [ticker],
+            data.summary
+        );
+        // Своя запись подняла версию портфеля на один шаг — принимаем её, чтобы событие
+        // portfolio_version из потока не применяло те же изменения второй раз. Если версия
+        // ушла дальше (писала и другая вкладка), оставляем прежнюю: дельта подтянет остальное.
+        if (portfolioVersion !== null && data.version === portfolioVersion + 1) {
+            portfolioVersion = data.version;
+        }
+        await renderPortfolioPositions([ticker]);
+    } catch (error) {
+        console.error('Ошибка точечного обновления позиции портфеля:', error);
+    } finally {
+        portfolioRefreshesInFlight--;
+        checkStreamedPortfolioVersion();
+    }
+}
+
+/**
+ * Сверить версию из события portfolio_version с версией вкладки и, если портфель
+ * менялся не только этой вкладкой, применить изменения. Пока идут точечные
+ * обновления строк после своих записей, сверка откладывается до их завершения.
+ */
+function checkStreamedPortfolioVersion() {
+    if (pendingStreamVersion === null || portfolioRefreshesInFlight > 0) return;
+    const version = pendingStreamVersion;
+    pendingStreamVersion = null;
+    // Свои изменения вкладка уже применила (версия совпадает)
+    if (portfolioVersion !== null && version !== portfolioVersion) {
+        applyPortfolioChanges();
+    }
+}
+
+/**
+ * Применить изменения портфеля после portfolioVersion (дельта с сервера).
+ * Пересчитываются только затронутые позиции; если сервер не может выдать
+ * дельту (full: true) — загружаем портфель целиком.
+ * @param {Array} extraTickers - Дополнительно пересчитать эти тикеры (свежие котировки)
+ */
+async function applyPortfolioChanges(extraTickers = []) {
+    try {
+        if (!currentPortfolioData || portfolioVersion === null) {
+            await loadPortfolio(true, true);
             return;
         }
         
-        // Пересчитываем сводку и обновляем верхнюю панель
-        const filteredSummary = calculateSummaryFromPortfolio(filteredPortfolio);
-        if (data.summary && data.summary.cash_balance !== undefined) {
-            filteredSummary.cash_balance = data.summary.cash_balance;
+        const params = [`since=${portfolioVersion}`, 'use_cached=1'];
+        if (currentChangeDays && currentChangeDays > 0) {
+            params.push(`change_days=${currentChangeDays}`);
+        }
+        if (extraTickers.length > 0) {
+            params.push(`tickers=${encodeURIComponent(extraTickers.join(','))}`);
+        }
+        const response = await fetch(`/api/portfolio/changes?${params.join('&')}`);
+        const data = await safeJsonResponse(response);
+        if (!data || !data.success || data.full) {
+            await loadPortfolio(true, true);
+            return;
         }
-        const totalPortfolioValue = filteredSummary.total_value || 0;
-        updateSummary(filteredSummary);
         
-        // Обновляем диаграмму категорий
-        updateCategoryChart(currentPortfolioData.portfolio);
+        mergePortfolioPositions(data.positions || [], data.removed || [], data.summary);
+        portfolioVersion = data.version;
+        const tickers = (data.positions || []).map(item => item.ticker).concat(data.removed || []);
+        if (tickers.length > 0) {
+            await renderPortfolioPositions(tickers);
+        }
+    } catch (error) {
+        console.error('Ошибка применения изменений портфеля:', error);
+        await loadPortfolio(true, true);
+    }
+}
+
+/**
+ * Подставить обновлённые позиции в currentPortfolioData (без перерисовки)
+ * @param {Array} positions - Пересчитанные позиции
+ * @param {Array} removedTickers - Тикеры позиций, которых больше нет в портфеле
+ * @param {Object} summary - Сводка с сервера: полная (/api/portfolio/changes) или только cash_balance
+ */
+function mergePortfolioPositions(positions, removedTickers, summary) {
+    const removed = new Set(removedTickers.map(t => String(t).toUpperCase()));
+    const updated = new Map(positions.map(item => [(item.ticker || '').toUpperCase(), item]));
+    
+    const merged = [];
+    currentPortfolioData.portfolio.forEach(item => {
+        const key = (item.ticker || '').toUpperCase();
+        if (removed.has(key)) return;
+        if (updated.has(key)) {
+            merged.push(updated.get(key));
+            updated.delete(key);
+        } else {
+            merged.push(item);
+        }
+    });
+    // Новые позиции — в конец (сортировка таблицы применяется при отрисовке)
+    updated.forEach(item => merged.push(item));
+    
+    currentPortfolioData.portfolio = merged;
+    if (summary && summary.total_value !== undefined) {
+        // Итоги по всему портфелю — как после загрузки /api/portfolio целиком
+        currentPortfolioData.summary = summary;
+    } else if (summary && summary.cash_balance !== undefined) {
+        currentPortfolioData.summary = currentPortfolioData.summary || {};
+        currentPortfolioData.summary.cash_balance = summary.cash_balance;
+    }
+}
+
+/**
+ * Перерисовать строки указанных тикеров, сводку и диаграмму категорий
+ * по currentPortfolioData (без перерисовки всей таблицы)
+ * @param {Array} tickers
+ */
+async function renderPortfolioPositions(tickers) {
+    const tbody = document.getElementById('portfolio-tbody');
+    if (!tbody || !currentPortfolioData) return;
+    
+    populateSplitTickerOptions();
+    
+    // Учитываем текущие фильтры по виду актива и категории
+    const { type: selectedType, category: selectedCategory } = getPortfolioFilters();
+    let filteredPortfolio = applyPortfolioFilters(currentPortfolioData.portfolio);
+    
+    // Если после операции портфель (с учётом фильтров) пуст — показываем сообщение как раньше
+    if (filteredPortfolio.length === 0) {
+        const hasType = !!selectedType;
+        const hasCategory = !!selectedCategory;
+        let message;
+        if (hasType && hasCategory) {
+            message = `Нет активов вида "${selectedType}" в категории "${selectedCategory}"`;
+        } else if (hasType) {
+            message = `Нет активов вида "${selectedType}"`;
+        } else if (hasCategory) {
+            message = `Нет активов категории "${selectedCategory}"`;
+        } else {
+            message = 'Портфель пуст. Добавьте первую позицию.';
+        }
+        tbody.innerHTML = `<tr><td colspan="9" style="text-align: center; padding: 40px; color: #7f8c8d;">${message}</td></tr>`;
+        previousPrices = {};
         
+        const emptySummary = calculateSummaryFromPortfolio([]);
+        if (currentPortfolioData.summary && currentPortfolioData.summary.cash_balance !== undefined) {
+            emptySummary.cash_balance = currentPortfolioData.summary.cash_balance;
+        }
+        updateSummary(emptySummary);
+        updateCategoryChart(currentPortfolioData.portfolio);
+        updatePortfolioSortIndicators();
+        return;
+    }
+    
+    // Пересчитываем сводку и обновляем верхнюю панель
+    const filteredSummary = calculateSummaryFromPortfolio(filteredPortfolio);
+    if (currentPortfolioData.summary && currentPortfolioData.summary.cash_balance !== undefined) {
+        filteredSummary.cash_balance = currentPortfolioData.summary.cash_balance;
+    }
+    const totalPortfolioValue = filteredSummary.total_value || 0;
+    updateSummary(filteredSummary);
+    
+    // Обновляем диаграмму категорий
+    updateCategoryChart(currentPortfolioData.portfolio);
+    
+    for (const ticker of tickers) {
         // Находим обновлённую позицию (с учётом фильтра) и соответствующую строку
-        const tickerUpper = ticker.toUpperCase();
+        const tickerUpper = String(ticker).toUpperCase();
         const updatedItem = filteredPortfolio.find(
             item => (item.ticker || '').toUpperCase() === tickerUpper
         );
         const existingRow = tbody.querySelector(`tr[data-ticker="${tickerUpper}"]`) ||
                             tbody.querySelector(`tr[data-ticker="${ticker}"]`);
-        
+    
         if (updatedItem) {
             // Создаём новую строку для позиции
             const newRow = createPortfolioRow(updatedItem, totalPortfolioValue);
-            
+        
             if (existingRow) {
                 tbody.replaceChild(newRow, existingRow);
             } else {
@@ -705,35 +833,126 @@ async function refreshSinglePortfolioPosition(ticker) {
                 if (emptyRow) emptyRow.remove();
                 tbody.appendChild(newRow);
             }
-            
+        
             // Обновляем спарклайн только для этого тикера
             const container = document.querySelector(`.sparkline-container[data-ticker="${updatedItem.ticker}"]`);
             if (container) {
                 await renderSparkline(container, updatedItem.ticker, updatedItem.instrument_type === 'Облигация');
             }
-            
+        
             // Перепривязываем обработчики кнопок продажи (для новой строки)
             attachSellButtonHandlers();
         } else if (existingRow) {
             // Позиция исчезла из портфеля (например, полностью продана) — удаляем строку
             existingRow.remove();
         }
+    }
 
-        // После точечного обновления строки повторно применяем скрытие/показ колонок.
-        // Иначе у только что созданной строки могут отображаться все ячейки по умолчанию.
-        applyColumnVisibility();
-        
-        // Обновляем индикаторы сортировки (колонка и направление не меняются)
-        updatePortfolioSortIndicators();
-        
-    } catch (error) {
-        console.error('Ошибка точечного обновления позиции портфеля:', error);
+    // После точечного обновления строки повторно применяем скрытие/показ колонок.
+    // Иначе у только что созданной строки могут отображаться все ячейки по умолчанию.
+    applyColumnVisibility();
+    
+    // Обновляем индикаторы сортировки (колонка и направление не меняются)
+    updatePortfolioSortIndicators();
+}
+
+/**
+ * Подписка на поток событий сервера (/api/events, Server-Sent Events).
+ * Сервер сам сообщает о записи цен, изменении портфеля (в том числе из другой
+ * вкладки) и свежих котировках — обновляются только затронутые строки.
+ * Если браузер не поддерживает EventSource или поток недоступен —
+ * возвращаемся к опросу раз в 60 секунд; после отказа сервера (503, когда
+ * заняты все слоты потоков событий) подключение повторяется через минуту.
+ */
+function startPortfolioEventStream() {
+    if (!window.EventSource) {
+        startPriceLogMonitoring();
+        return;
+    }
+    if (portfolioEventRetryTimer) {
+        clearTimeout(portfolioEventRetryTimer);
+        portfolioEventRetryTimer = null;
     }
+    if (portfolioEventSource) {
+        portfolioEventSource.close();
+    }
+    
+    portfolioEventSource = new EventSource('/api/events');
+    
+    portfolioEventSource.addEventListener('open', () => {
+        // Поток работает — периодический опрос не нужен
+        if (priceLogCheckInterval) {
+            clearInterval(priceLogCheckInterval);
+            priceLogCheckInterval = null;
+        }
+    });
+    
+    portfolioEventSource.addEventListener('error', () => {
+        // При обрыве EventSource переподключается сам; CLOSED — сервер отказал (например, сессия истекла)
+        if (portfolioEventSource.readyState === EventSource.CLOSED) {
+            console.warn('Поток событий недоступен, переходим на периодический опрос');
+            portfolioEventSource = null;
+            startPriceLogMonitoring();
+            if (!portfolioEventRetryTimer) {
+                portfolioEventRetryTimer = setTimeout(startPortfolioEventStream, PORTFOLIO_EVENTS_RETRY_MS);
+            }
+        }
+    });
+    
+    portfolioEventSource.addEventListener('price_log', () => {
+        console.log('Завершена запись цен, обновляем портфель');
+        updateLastUpdateTime();
+        // Цены уже в БД — перечитываем портфель без запросов к MOEX
+        if (priceLogReloadTimer) clearTimeout(priceLogReloadTimer);
+        priceLogReloadTimer = setTimeout(() => {
+            priceLogReloadTimer = null;
+            const tableView = document.getElementById('table-view');
+            if (tableView && tableView.style.display !== 'none') {
+                loadPortfolio(true, true);
+            }
+        }, 1000);
+    });
+    
+    portfolioEventSource.addEventListener('portfolio_version', (event) => {
+        const data = JSON.parse(event.data);
+        // Событие о своей записи приходит почти одновременно с ответом на неё — сверяем
+        // версию с небольшой задержкой, когда точечное обновление строки уже началось
+        pendingStreamVersion = data.version;
+        if (portfolioVersionTimer) clearTimeout(portfolioVersionTimer);
+        portfolioVersionTimer = setTimeout(() => {
+            portfolioVersionTimer = null;
+            checkStreamedPortfolioVersion();
+        }, PORTFOLIO_VERSION_CHECK_DELAY_MS);
+    });
+    
+    portfolioEventSource.addEventListener('quotes', (event) => {
+        if (!currentPortfolioData) return;
+        const data = JSON.parse(event.data);
+        const tickers = new Set(currentPortfolioData.portfolio.map(item => (item.ticker || '').toUpperCase()));
+        // Котировка приходит как записана в БД (в валюте бумаги, без учёта сплитов), а цена
+        // на экране уже пересчитана, поэтому сравниваем с прошлой котировкой тикера из потока.
+        // Первая котировка тикера — новая запись, позицию пересчитываем.
+        const changed = [];
+        for (const q of data.quotes || []) {
+            const ticker = (q.ticker || '').toUpperCase();
+            const previous = lastRawQuotes.get(ticker);
+            lastRawQuotes.set(ticker, q.current_price);
+            if (tickers.has(ticker) && previous !== q.current_price) {
+                changed.push(q.ticker);
+            }
+        }
+        if (changed.length > 0) {
+            applyPortfolioChanges(changed);
+        }
+    });
+    
+    console.log('Подписка на поток событий /api/events');
 }
 
 /**
  * Запуск мониторинга новых записей цен
- * Проверяет каждые 60 секунд, были ли записаны новые цены (например, в 0:00)
+ * Проверяет каждые 60 секунд, были ли записаны новые цены (например, в 0:00).
+ * Используется, только если поток событий /api/events недоступен.
  */
 function startPriceLogMonitoring() {
     // Останавливаем предыдущий интервал, если он есть
@@ -2155,7 +2374,7 @@ async function handleEditPosition(e) {
         
         if (data.success) {
             closeEditModal();
-            loadPortfolio(true, true);
+            applyPortfolioChanges();
             console.log('Позиция успешно обновлена');
         } else {
             console.error('Ошибка обновления позиции:', data.error);
@@ -2177,7 +2396,7 @@ async function deletePosition(id, ticker) {
         const data = await response.json();
         
         if (data.success) {
-            loadPortfolio(true, true);
+            applyPortfolioChanges();
             console.log(`Позиция ${ticker} успешно удалена`);
         } else {
             console.error('Ошибка удаления позиции:', data.error);
@@ -3768,6 +3987,28 @@ function updateHistoryTickerFilter() {
     tickerFilter.value = currentValue;
 }
 
+/**
+ * Ожидание завершения фоновой задачи (опрос /api/jobs/<id>)
+ * @param {string} jobId - id задачи
+ * @param {Function} onProgress - callback(job) на каждый опрос
+ * @returns {Promise<Object>} - итоговое состояние задачи
+ */
+async function waitForJob(jobId, onProgress = null, intervalMs = 1000) {
+    while (true) {
+        const response = await fetch(`/api/jobs/${jobId}`);
+        const data = await safeJsonResponse(response);
+        if (!data || !data.success) {
+            throw new Error((data && data.error) || 'Не удалось получить статус задачи');
+        }
+        const job = data.job;
+        if (onProgress) onProgress(job);
+        if (job.status === 'done' || job.status === 'failed') {
+            return job;
+        }
+        await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+}
+
 /**
  * Ручное логирование цен
  */
@@ -3785,7 +4026,16 @@ async function logPricesNow() {
         });
         const data = await response.json();
 
-        if (data.success) {
+        // Логирование выполняется фоновой задачей — ждём её завершения
+        const job = data.success
+            ? await waitForJob(data.job_id, (j) => {
+                if (j.status === 'running') {
+                    btn.innerHTML = `${SVG_PENCIL} Логирование... ${Math.round((j.progress || 0) * 100)}%`;
+                }
+            })
+            : null;
+
+        if (job && job.status === 'done') {
             btn.innerHTML = `${SVG_PENCIL} Готово!`;
             setTimeout(() => {
                 loadPriceHistory();
@@ -3795,7 +4045,7 @@ async function logPricesNow() {
             }, 1000);
         } else {
             btn.innerHTML = `${SVG_PENCIL} Ошибка`;
-            console.error('Ошибка логирования цен:', data.error);
+            console.error('Ошибка логирования цен:', job ? job.message : data.error);
             setTimeout(() => {
                 btn.innerHTML = originalHTML;
                 btn.disabled = false;
@@ -3968,8 +4218,31 @@ document.addEventListener('DOMContentLoaded', function() {
  * ==========================================
  */
 
+const TRANSACTIONS_PAGE_SIZE = 100; // Транзакций на одну страницу журнала
+let transactionsCursor = null; // Курсор следующей страницы (null — загружено всё)
+let transactionsQuery = ''; // Фильтры загруженного списка (query string без limit/cursor)
+let transactionsLoading = false; // Идёт загрузка страницы
+let transactionsRequestId = 0; // Номер запроса: ответы на устаревшие фильтры отбрасываются
+let loadedTransactions = new Map(); // Загруженные транзакции по id (для формы редактирования)
+
+/**
+ * Query string фильтров журнала транзакций
+ */
+function buildTransactionsQuery() {
+    const params = new URLSearchParams();
+    const ticker = document.getElementById('trans-ticker-filter')?.value || '';
+    const operationType = document.getElementById('trans-type-filter')?.value || '';
+    const dateFrom = document.getElementById('trans-date-from')?.value || '';
+    const dateTo = document.getElementById('trans-date-to')?.value || '';
+    if (ticker) params.set('ticker', ticker);
+    if (operationType) params.set('operation_type', operationType);
+    if (dateFrom) params.set('date_from', dateFrom);
+    if (dateTo) params.set('date_to', dateTo);
+    return params.toString();
+}
+
 /**
- * Загрузка транзакций с фильтрацией
+ * Загрузка транзакций с фильтрацией (первая страница и итоги)
  */
 async function loadTransactions() {
     const tbody = document.getElementById('transactions-tbody');
@@ -3978,22 +4251,17 @@ async function loadTransactions() {
     
     if (!tbody) return;
     
+    transactionsQuery = buildTransactionsQuery();
+    transactionsCursor = null;
+    loadedTransactions = new Map();
+    const requestId = ++transactionsRequestId;
+    transactionsLoading = true;
+    
     try {
-        // Получаем значения фильтров
-        const ticker = document.getElementById('trans-ticker-filter')?.value || '';
-        const operationType = document.getElementById('trans-type-filter')?.value || '';
-        const dateFrom = document.getElementById('trans-date-from')?.value || '';
-        const dateTo = document.getElementById('trans-date-to')?.value || '';
-        
-        // Формируем URL с параметрами
-        let url = '/api/transactions?';
-        if (ticker) url += `ticker=${ticker}&`;
-        if (operationType) url += `operation_type=${operationType}&`;
-        if (dateFrom) url += `date_from=${dateFrom}&`;
-        if (dateTo) url += `date_to=${dateTo}&`;
-        
+        const url = `/api/transactions?${transactionsQuery}&limit=${TRANSACTIONS_PAGE_SIZE}&totals=1`;
         const response = await fetch(url);
         const data = await response.json();
+        if (requestId !== transactionsRequestId) return;
         
         if (data.success) {
             if (data.transactions.length === 0) {
@@ -4002,8 +4270,10 @@ async function loadTransactions() {
             } else {
                 table.style.display = 'table';
                 noTransactionsMsg.style.display = 'none';
-                renderTransactions(data.transactions);
             }
+            renderTransactions(data.transactions);
+            renderTransactionsTotals(data.totals);
+            transactionsCursor = data.next_cursor;
             
             // Обновляем фильтр тикеров
             updateTransactionTickerFilter();
@@ -4012,19 +4282,111 @@ async function loadTransactions() {
         }
     } catch (error) {
         console.error('Ошибка загрузки транзакций:', error);
+    } finally {
+        if (requestId === transactionsRequestId) {
+            transactionsLoading = false;
+        }
+    }
+    attachTransactionsScroll();
+    loadMoreTransactionsIfNeeded();
+}
+
+/**
+ * Догрузка следующей страницы журнала (по курсору последней загруженной транзакции)
+ */
+async function loadMoreTransactions() {
+    if (transactionsLoading || !transactionsCursor) return;
+    const requestId = transactionsRequestId;
+    transactionsLoading = true;
+    
+    try {
+        const url = `/api/transactions?${transactionsQuery}&limit=${TRANSACTIONS_PAGE_SIZE}` +
+            `&cursor=${encodeURIComponent(transactionsCursor)}`;
+        const response = await fetch(url);
+        const data = await response.json();
+        if (requestId !== transactionsRequestId) return;
+        
+        if (data.success) {
+            renderTransactions(data.transactions, true);
+            transactionsCursor = data.next_cursor;
+        } else {
+            console.error('Ошибка загрузки транзакций:', data.error);
+            transactionsCursor = null;
+        }
+    } catch (error) {
+        console.error('Ошибка загрузки транзакций:', error);
+    } finally {
+        if (requestId === transactionsRequestId) {
+            transactionsLoading = false;
+        }
+    }
+    loadMoreTransactionsIfNeeded();
+}
+
+/**
+ * Догрузить страницу, если до конца таблицы осталось меньше экрана
+ * (при прокрутке и когда первая страница не заполняет окно)
+ */
+function loadMoreTransactionsIfNeeded() {
+    if (transactionsLoading || !transactionsCursor) return;
+    const view = document.getElementById('transactions-view');
+    const tbody = document.getElementById('transactions-tbody');
+    if (!view || !tbody || view.style.display === 'none') return;
+    
+    const container = document.getElementById('transactions-content');
+    const bottom = tbody.getBoundingClientRect().bottom;
+    const visibleBottom = Math.min(
+        window.innerHeight,
+        container ? container.getBoundingClientRect().bottom : window.innerHeight
+    );
+    if (bottom - visibleBottom < visibleBottom) {
+        loadMoreTransactions();
+    }
+}
+
+/**
+ * Обработчики прокрутки журнала (таблица прокручивается внутри .transactions-content,
+ * на узких экранах — вся страница)
+ */
+function attachTransactionsScroll() {
+    const container = document.getElementById('transactions-content');
+    if (!container || container.dataset.scrollAttached) return;
+    container.dataset.scrollAttached = '1';
+    container.addEventListener('scroll', loadMoreTransactionsIfNeeded, { passive: true });
+    window.addEventListener('scroll', loadMoreTransactionsIfNeeded, { passive: true });
+}
+
+/**
+ * Итоги по отфильтрованным транзакциям (считаются на сервере)
+ */
+function renderTransactionsTotals(totals) {
+    const el = document.getElementById('transactions-totals');
+    if (!el) return;
+    if (!totals || totals.count === 0) {
+        el.style.display = 'none';
+        return;
     }
+    el.style.display = 'block';
+    el.textContent = `Операций: ${formatNumber(totals.count)} · ` +
+        `куплено на ${formatCurrency(totals.bought)} · продано на ${formatCurrency(totals.sold)}`;
+    el.title = totals.by_ticker
+        .map(t => `${t.ticker}: ${t.count} опер., куплено ${formatCurrency(t.bought)}, продано ${formatCurrency(t.sold)}`)
+        .join('\n');
 }
 
 /**
- * Отрисовка транзакций в таблице
+ * Отрисовка транзакций в таблице (append — добавить страницу в конец)
  */
-function renderTransactions(transactions) {
+function renderTransactions(transactions, append = false) {
     const tbody = document.getElementById('transactions-tbody');
     if (!tbody) return;
     
-    tbody.innerHTML = '';
+    if (!append) {
+        tbody.innerHTML = '';
+    }
     
     transactions.forEach(transaction => {
+        loadedTransactions.set(transaction.id, transaction);
         const row = document.createElement('tr');
         
         // Форматируем дату (без времени)
@@ -4168,30 +4530,25 @@ async function handleAddTransaction(event) {
  */
 async function openEditTransactionModal(transactionId) {
     try {
-        const response = await fetch(`/api/transactions?`);
-        const data = await response.json();
-        
-        if (data.success) {
-            const transaction = data.transactions.find(t => t.id === transactionId);
+        // Строка редактируется из таблицы, значит транзакция уже загружена
+        const transaction = loadedTransactions.get(transactionId);
+        if (transaction) {
+            document.getElementById('trans-edit-id').value = transaction.id;
             
-            if (transaction) {
-                document.getElementById('trans-edit-id').value = transaction.id;
-                
-                // Конвертируем дату в формат datetime-local
-                const date = new Date(transaction.date);
-                date.setMinutes(date.getMinutes() - date.getTimezoneOffset());
-                document.getElementById('trans-edit-date').value = date.toISOString().slice(0, 16);
-                
-                document.getElementById('trans-edit-ticker').value = transaction.ticker;
-                document.getElementById('trans-edit-company').value = transaction.company_name || '';
-                document.getElementById('trans-edit-type').value = transaction.operation_type;
-                document.getElementById('trans-edit-price').value = transaction.price;
-                document.getElementById('trans-edit-quantity').value = transaction.quantity;
-                document.getElementById('trans-edit-total').value = transaction.total;
-                document.getElementById('trans-edit-notes').value = '';
-                
-                document.getElementById('edit-transaction-modal').style.display = 'flex';
-            }
+            // Конвертируем дату в формат datetime-local
+            const date = new Date(transaction.date);
+            date.setMinutes(date.getMinutes() - date.getTimezoneOffset());
+            document.getElementById('trans-edit-date').value = date.toISOString().slice(0, 16);
+            
+            document.getElementById('trans-edit-ticker').value = transaction.ticker;
+            document.getElementById('trans-edit-company').value = transaction.company_name || '';
+            document.getElementById('trans-edit-type').value = transaction.operation_type;
+            document.getElementById('trans-edit-price').value = transaction.price;
+            document.getElementById('trans-edit-quantity').value = transaction.quantity;
+            document.getElementById('trans-edit-total').value = transaction.total;
+            document.getElementById('trans-edit-notes').value = '';
+            
+            document.getElementById('edit-transaction-modal').style.display = 'flex';
         }
     } catch (error) {
         console.error('Ошибка открытия формы редактирования:', error);
@@ -5689,8 +6046,9 @@ async function loadLoggingSettings() {
         console.error('Ошибка загрузки настроек времени:', error);
     }
 
-    // Загружаем коэффициенты сплитов
+    // Загружаем коэффициенты сплитов и предложения по данным MOEX
     loadSplitCoefficients();
+    loadSplitProposals();
 }
 
 /**
@@ -5775,6 +6133,61 @@ async function loadSplitCoefficients() {
     }
 }
 
+async function loadSplitProposals() {
+    const container = document.getElementById('split-proposals');
+    const tbody = document.getElementById('split-proposals-tbody');
+    if (!container || !tbody) return;
+    try {
+        const response = await fetch('/api/split-coefficients/proposals');
+        const data = await response.json();
+        const items = data.success && Array.isArray(data.items) ? data.items : [];
+        // Блок показываем, только если MOEX сообщил о сплитах, которых нет в списке выше
+        container.style.display = items.length ? '' : 'none';
+        if (!items.length) return;
+
+        const note = document.getElementById('split-proposals-note');
+        if (note) {
+            note.textContent = 'Эти сплиты и консолидации случились, пока бумаги были в портфеле, но коэффициентов для них нет.' +
+                (data.synced_at ? ` Данные MOEX загружены ${data.synced_at}.` : '');
+        }
+        tbody.innerHTML = items.map(item => `
+            <tr>
+                <td>${item.effective_date || ''}</td>
+                <td>${item.ticker || ''}</td>
+                <td>${item.before} → ${item.after}</td>
+                <td>${item.coefficient}</td>
+                <td>
+                    <button class="btn btn-primary" type="button" onclick="applySplitProposals([${item.id}])">Добавить</button>
+                </td>
+            </tr>
+        `).join('');
+    } catch (error) {
+        console.error('Ошибка загрузки сплитов MOEX:', error);
+        container.style.display = 'none';
+    }
+}
+
+async function applySplitProposals(ids) {
+    try {
+        const response = await fetch('/api/split-coefficients/proposals/apply', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(ids ? { ids } : {})
+        });
+        const data = await response.json();
+        if (!data.success) {
+            alert(`Ошибка: ${data.error || 'не удалось добавить коэффициенты'}`);
+            return;
+        }
+        await loadSplitCoefficients();
+        await loadSplitProposals();
+        await loadPortfolio(true, true);
+    } catch (error) {
+        console.error('Ошибка добавления коэффициентов:', error);
+        alert('Ошибка соединения');
+    }
+}
+
 function populateSplitTickerOptions() {
     const select = document.getElementById('split-ticker-select');
     if (!select) return;
@@ -5833,6 +6246,7 @@ async function addSplitCoefficient() {
 
         coeffEl.value = '';
         await loadSplitCoefficients();
+        loadSplitProposals();
         // Перерисовываем портфель с новыми коэффициентами
         await loadPortfolio(true, true);
     } catch (error) {
@@ -5851,6 +6265,7 @@ async function deleteSplitCoefficient(id) {
             return;
         }
         await loadSplitCoefficients();
+        loadSplitProposals();
         await loadPortfolio(true, true);
     } catch (error) {
         console.error('Ошибка удаления коэффициента:', error);
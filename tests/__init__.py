@@ -0,0 +1,21 @@
+"""
+Тесты: python -m unittest discover -s tests -t .   (или pytest)
+
+Движок БД создаётся при первом импорте models.database по DATABASE_URL,
+поэтому временная база задаётся здесь — до импорта приложения тестами.
+Планировщик в тестах не запускается (SCHEDULER_MODE=external).
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+_TMP_DIR = tempfile.mkdtemp(prefix='portfolio-tests-')
+atexit.register(shutil.rmtree, _TMP_DIR, ignore_errors=True)
+
+os.environ['DATABASE_URL'] = f'sqlite:///{_TMP_DIR}/test.db'
+os.environ['SCHEDULER_MODE'] = 'external'
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
@@ -0,0 +1,86 @@
+"""
+Общие части тестов: клиент API под admin на временной базе и случайные транзакции
+"""
+import unittest
+from datetime import datetime, timedelta
+
+import app as portfolio_app
+from models.database import Base
+from models.portfolio import Portfolio
+from models.price_history import PriceHistory
+from models.transaction import Transaction
+from models.user import User
+
+db_session = portfolio_app.db_session
+TICKERS = ['SBER', 'GAZP', 'LKOH']
+
+
+class ApiTestCase(unittest.TestCase):
+    """Вход под admin; перед каждым тестом и после него данные пользователя очищаются"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = portfolio_app.app.test_client()
+        response = cls.client.post('/login', data={'username': 'admin', 'password': 'admin'})
+        assert response.status_code == 302, response.status_code
+        cls.user_id = db_session.query(User.id).filter_by(username='admin').scalar()
+
+    def setUp(self):
+        self.clear_user_data()
+
+    def tearDown(self):
+        db_session.rollback()
+        self.clear_user_data()
+
+    def clear_user_data(self):
+        # Все таблицы с user_id (в порядке, обратном зависимостям) и общая история цен
+        for table in reversed(Base.metadata.sorted_tables):
+            if 'user_id' in table.c:
+                db_session.execute(table.delete().where(table.c.user_id == self.user_id))
+        db_session.query(PriceHistory).delete(synchronize_session=False)
+        db_session.commit()
+        portfolio_app.split_index_cache.invalidate()
+
+    def api(self, method, url, **kwargs):
+        response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 300, (url, response.status_code, response.get_data(as_text=True)[:300]))
+        return response.get_json()
+
+    def transaction_ids(self):
+        return [row.id for row in db_session.query(Transaction.id).filter(Transaction.user_id == self.user_id)]
+
+    def portfolio_quantities(self):
+        db_session.expire_all()
+        return {p.ticker: p.quantity for p in db_session.query(Portfolio).filter(Portfolio.user_id == self.user_id)}
+
+    def random_step(self, rnd, actions=('add', 'add', 'add', 'update', 'delete')):
+        """Случайное изменение транзакций через API; возвращает название действия"""
+        ids = self.transaction_ids()
+        action = rnd.choice(actions) if ids else 'add'
+        if action == 'add':
+            self.api('post', '/api/transactions', json=random_transaction(rnd))
+        elif action == 'update':
+            changes = random_transaction(rnd)
+            fields = rnd.sample(sorted(changes), rnd.randrange(1, len(changes) + 1))
+            self.api('put', f'/api/transactions/{rnd.choice(ids)}', json={f: changes[f] for f in fields})
+        elif action == 'delete':
+            self.api('delete', f'/api/transactions/{rnd.choice(ids)}')
+        else:
+            rows = [random_transaction(rnd) for _ in range(rnd.randrange(1, 6))]
+            report = self.api('post', '/api/transactions/import', json={'transactions': rows})
+            self.assertEqual(report['imported'], len(rows))
+        return action
+
+
+def random_transaction(rnd):
+    day = datetime(2024, 1, 1) + timedelta(days=rnd.randrange(60))
+    # Часть операций в одну и ту же секунду: порядок внутри дня задаёт id
+    moment = day + timedelta(hours=rnd.choice([0, 0, 10, 15]))
+    return {
+        'ticker': rnd.choice(TICKERS),
+        'operation_type': rnd.choice(['Покупка', 'Покупка', 'Продажа']),
+        'price': rnd.choice([50, 100.5, 250, 1000]),
+        'quantity': rnd.randrange(1, 20),
+        'date': moment.strftime('%Y-%m-%d %H:%M:%S'),
+        'instrument_type': 'STOCK',
+    }
@@ -0,0 +1,59 @@
+"""
+Журнал денег (CashLedger) после изменений через API против полного пересчёта
+"""
+import random
+import unittest
+
+import app as portfolio_app
+from models.cash_balance import CashBalance
+from models.cash_snapshot import CashBalanceSnapshot
+from tests.support import ApiTestCase, db_session
+
+
+class CashLedgerTest(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Снимки почаще, чтобы пересчёт от ближайшего снимка тоже проверялся
+        self._snapshot_every = portfolio_app.cash_ledger.SNAPSHOT_EVERY
+        portfolio_app.cash_ledger.SNAPSHOT_EVERY = 3
+
+    def tearDown(self):
+        portfolio_app.cash_ledger.SNAPSHOT_EVERY = self._snapshot_every
+        super().tearDown()
+
+    def _state(self):
+        db_session.expire_all()
+        balance = db_session.query(CashBalance.balance).filter(CashBalance.user_id == self.user_id).scalar()
+        snapshots = sorted(
+            (s.transaction_date, s.transaction_id, round(s.balance, 6))
+            for s in db_session.query(CashBalanceSnapshot).filter(CashBalanceSnapshot.user_id == self.user_id)
+        )
+        return round(balance or 0.0, 6), snapshots
+
+    def test_random_changes_match_full_rebuild(self):
+        for seed in range(4):
+            rnd = random.Random(seed)
+            self.clear_user_data()
+            for step in range(40):
+                action = self.random_step(rnd, ('add', 'add', 'add', 'update', 'delete', 'import'))
+                label = f'seed {seed}, step {step} ({action})'
+                incremental = self._state()
+                portfolio_app.cash_ledger.rebuild(self.user_id)
+                self.assertEqual(incremental, self._state(), label)
+                self.assertEqual(portfolio_app.cash_ledger.verify(self.user_id), [], label)
+
+    def test_buy_above_balance_resets_it_to_zero(self):
+        for date, operation, price in (('2024-01-01', 'Продажа', 100), ('2024-01-02', 'Покупка', 30),
+                                       ('2024-01-03', 'Покупка', 500), ('2024-01-04', 'Продажа', 20)):
+            self.api('post', '/api/transactions', json={
+                'ticker': 'SBER', 'operation_type': operation, 'price': price, 'quantity': 1,
+                'date': date, 'instrument_type': 'STOCK',
+            })
+        balances = [m['balance'] for m in portfolio_app.cash_ledger.movements(self.user_id)]
+        self.assertEqual(balances, [100.0, 70.0, 0.0, 20.0])
+        self.assertEqual(self._state()[0], 20.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
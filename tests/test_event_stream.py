@@ -0,0 +1,37 @@
+"""
+Поток событий /api/events: лимит соединений на процесс
+"""
+import unittest
+
+import app as portfolio_app
+from tests.support import ApiTestCase
+
+
+class EventStreamLimitTest(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        publisher = portfolio_app.portfolio_events
+        self.addCleanup(setattr, publisher, 'MAX_SUBSCRIBERS', publisher.MAX_SUBSCRIBERS)
+        publisher.MAX_SUBSCRIBERS = 1
+
+    def test_busy_process_answers_503_with_retry(self):
+        publisher = portfolio_app.portfolio_events
+        first = self.client.get('/api/events', buffered=False)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(next(first.response), f'retry: {publisher.RETRY_MS}\n\n'.encode())
+
+        busy = self.client.get('/api/events')
+        self.assertEqual(busy.status_code, 503)
+        self.assertEqual(busy.headers['Retry-After'], str(publisher.BUSY_RETRY_MS // 1000))
+        self.assertEqual(busy.get_data(as_text=True), f'retry: {publisher.BUSY_RETRY_MS}\n\n')
+
+        # Закрытие соединения освобождает слот
+        first.close()
+        second = self.client.get('/api/events', buffered=False)
+        self.assertEqual(second.status_code, 200)
+        second.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
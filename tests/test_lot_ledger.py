@@ -0,0 +1,54 @@
+"""
+Открытые лоты (LotLedger) после изменений через API против полного пересчёта
+"""
+import random
+import unittest
+
+import app as portfolio_app
+from models.open_lot import OpenLot
+from tests.support import ApiTestCase, TICKERS, db_session
+
+
+class LotLedgerTest(ApiTestCase):
+
+    ACTIONS = ('add', 'add', 'add', 'update', 'delete', 'import')
+
+    def _lots(self):
+        db_session.expire_all()
+        return sorted(
+            (lot.ticker, lot.transaction_id, lot.buy_date, lot.price, lot.quantity, round(lot.remaining, 9))
+            for lot in db_session.query(OpenLot).filter(OpenLot.user_id == self.user_id)
+        )
+
+    def _assert_matches_full_rebuild(self, step):
+        incremental = self._lots()
+        portfolio_app.lot_ledger.rebuild_all(user_id=self.user_id)
+        self.assertEqual(incremental, self._lots(), step)
+
+        # Количество в портфеле — из тех же лотов
+        positions = portfolio_app.lot_ledger.get_positions(self.user_id)
+        portfolio = self.portfolio_quantities()
+        for ticker in TICKERS:
+            quantity = positions.get(ticker, {}).get('quantity', 0.0)
+            self.assertAlmostEqual(portfolio.get(ticker, 0.0), quantity, places=9, msg=f'{step}: {ticker}')
+
+    def test_random_changes_match_full_rebuild(self):
+        for seed in range(4):
+            rnd = random.Random(seed)
+            self.clear_user_data()
+            for step in range(40):
+                action = self.random_step(rnd, self.ACTIONS)
+                self._assert_matches_full_rebuild(f'seed {seed}, step {step} ({action})')
+
+    def test_fifo_sell_closes_oldest_lot(self):
+        for date, operation, quantity in (('2024-01-01', 'Покупка', 5), ('2024-01-02', 'Покупка', 5),
+                                          ('2024-01-03', 'Продажа', 7)):
+            self.api('post', '/api/transactions', json={
+                'ticker': 'SBER', 'operation_type': operation, 'price': 100, 'quantity': quantity,
+                'date': date, 'instrument_type': 'STOCK',
+            })
+        self.assertEqual([(lot[2].day, lot[5]) for lot in self._lots()], [(2, 3.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
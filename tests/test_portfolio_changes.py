@@ -0,0 +1,34 @@
+"""
+Дельта портфеля /api/portfolio/changes против полной загрузки /api/portfolio
+"""
+import unittest
+
+from tests.support import ApiTestCase
+
+
+class PortfolioChangesTest(ApiTestCase):
+
+    def _buy(self, ticker, quantity, price, date='2024-01-10'):
+        self.api('post', '/api/transactions', json={
+            'ticker': ticker, 'operation_type': 'Покупка', 'price': price, 'quantity': quantity,
+            'date': date, 'instrument_type': 'STOCK',
+        })
+
+    def test_summary_matches_full_portfolio(self):
+        self._buy('SBER', 10, 250)
+        self._buy('GAZP', 5, 160)
+        version = self.api('get', '/api/portfolio?use_cached=1')['version']
+
+        self._buy('SBER', 4, 300, date='2024-02-01')
+        changes = self.api('get', f'/api/portfolio/changes?since={version}&use_cached=1')
+        full = self.api('get', '/api/portfolio?use_cached=1')
+
+        self.assertFalse(changes['full'])
+        self.assertEqual(changes['version'], full['version'])
+        self.assertEqual([item['ticker'] for item in changes['positions']], ['SBER'])
+        self.assertEqual(changes['summary'], full['summary'])
+        self.assertAlmostEqual(changes['summary']['total_cost'], 10 * 250 + 5 * 160 + 4 * 300)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+История позиций (PositionTimelineLedger) после изменений через API против полного пересчёта
+"""
+import random
+import unittest
+from datetime import date, datetime
+
+import app as portfolio_app
+from models.portfolio import InstrumentType
+from models.price_history import PriceHistory
+from tests.support import ApiTestCase, TICKERS, db_session
+
+
+class PositionTimelineTest(ApiTestCase):
+
+    def _timeline(self):
+        timeline = portfolio_app.position_timeline.load(self.user_id)
+        return {t: list(zip(timeline.dates[t], [round(q, 9) for q in timeline.quantities[t]]))
+                for t in timeline.tickers}
+
+    def test_random_changes_match_full_rebuild(self):
+        for seed in range(4):
+            rnd = random.Random(seed)
+            self.clear_user_data()
+            for step in range(40):
+                action = self.random_step(rnd, ('add', 'add', 'add', 'update', 'delete', 'import'))
+                label = f'seed {seed}, step {step} ({action})'
+                incremental = self._timeline()
+                portfolio_app.position_timeline.rebuild_all(user_id=self.user_id)
+                self.assertEqual(incremental, self._timeline(), label)
+
+                # Последняя точка — текущее количество по лотам
+                positions = portfolio_app.lot_ledger.get_positions(self.user_id)
+                timeline = portfolio_app.position_timeline.load(self.user_id)
+                for ticker in TICKERS:
+                    self.assertAlmostEqual(timeline.latest(ticker), positions.get(ticker, {}).get('quantity', 0.0),
+                                           places=9, msg=f'{label}: {ticker}')
+
+    def test_holdings_on_past_day(self):
+        for day, operation, quantity in (('2024-01-10', 'Покупка', 10), ('2024-02-10', 'Продажа', 4),
+                                         ('2024-02-10', 'Покупка', 1)):
+            self.api('post', '/api/transactions', json={
+                'ticker': 'SBER', 'operation_type': operation, 'price': 100, 'quantity': quantity,
+                'date': day, 'instrument_type': 'STOCK',
+            })
+        timeline = portfolio_app.position_timeline.load(self.user_id)
+        current = {'SBER': 7.0}
+        self.assertEqual(timeline.holdings_on(date(2024, 1, 9), current), {'SBER': 0.0})
+        self.assertEqual(timeline.holdings_on(date(2024, 1, 10), current), {'SBER': 10.0})
+        self.assertEqual(timeline.holdings_on(date(2024, 2, 10), current), {'SBER': 7.0})
+
+    def test_day_without_price_uses_last_known_price(self):
+        for ticker, quantity in (('SBER', 10), ('GAZP', 5)):
+            self.api('post', '/api/transactions', json={
+                'ticker': ticker, 'operation_type': 'Покупка', 'price': 100, 'quantity': quantity,
+                'date': '2024-01-10', 'instrument_type': 'STOCK',
+            })
+        # По GAZP за 2024-03-02 записи нет
+        for ticker, day, price in (('SBER', 1, 250), ('GAZP', 1, 160), ('SBER', 2, 260)):
+            db_session.add(PriceHistory(
+                ticker=ticker, company_name=ticker, price=price, instrument_type=InstrumentType.STOCK,
+                logged_at=datetime(2024, 3, day, 19),
+            ))
+        db_session.commit()
+        expected = [('2024-03-01', 10 * 250 + 5 * 160), ('2024-03-02', 10 * 260 + 5 * 160)]
+
+        history = self.api('get', '/api/portfolio-value-history?date_from=2024-03-01&date_to=2024-03-02')
+        self.assertEqual([(p['date'], p['value']) for p in history['portfolio']], expected)
+
+        response = self.client.get('/api/export/portfolio-values?date_from=2024-03-01&date_to=2024-03-02')
+        self.assertEqual(response.status_code, 200)
+        rows = response.get_data(as_text=True).lstrip('\ufeff').split()[1:]
+        self.assertEqual([tuple(row.split(';')) for row in rows], [(d, f'{v:.1f}') for d, v in expected])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Планы запросов горячих путей на заполненной базе: без полного сканирования таблиц
+
+Те же запросы, что проверяет scripts/check_query_plans.py, — после миграций
+схемы (init_db, migrate_portfolio_columns) и на данных, где каждый путь
+действительно доходит до БД: транзакции, история цен, сплиты.
+"""
+import importlib.util
+import os
+import random
+import unittest
+from datetime import datetime, timedelta
+
+import app as portfolio_app
+from models.database import init_db
+from models.portfolio import InstrumentType, Portfolio
+from models.price_history import PriceHistory
+from tests import APP_DIR
+from tests.support import ApiTestCase, TICKERS, db_session
+
+
+def _load_checker():
+    path = os.path.join(APP_DIR, 'scripts', 'check_query_plans.py')
+    spec = importlib.util.spec_from_file_location('check_query_plans', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class QueryPlansTest(ApiTestCase):
+
+    def _populate(self):
+        rnd = random.Random(50)
+        for ticker in TICKERS:
+            self.api('post', '/api/transactions', json={
+                'ticker': ticker, 'operation_type': 'Покупка', 'price': 100, 'quantity': 1000,
+                'date': '2023-12-01', 'instrument_type': 'STOCK',
+            })
+        for _ in range(30):
+            self.random_step(rnd, ('add',))
+        start = datetime.now() - timedelta(days=400)
+        for ticker in TICKERS:
+            for day in range(0, 400, 5):
+                db_session.add(PriceHistory(
+                    ticker=ticker, company_name=ticker, price=rnd.uniform(10, 1000),
+                    instrument_type=InstrumentType.STOCK, logged_at=start + timedelta(days=day, hours=19),
+                ))
+        db_session.commit()
+        self.api('post', '/api/split-coefficients', json={
+            'ticker': 'SBER', 'effective_date': (start + timedelta(days=200)).strftime('%Y-%m-%d'),
+            'coefficient': 0.1,
+        })
+        portfolio_app.split_adjusted_prices.rebuild_all()
+
+    def test_hot_paths_use_indexes(self):
+        self._populate()
+        init_db()
+        portfolio_app.migrate_portfolio_columns()
+        checker = _load_checker()
+
+        tickers = [row.ticker for row in db_session.query(Portfolio.ticker).filter(Portfolio.user_id == self.user_id)]
+        self.assertTrue(tickers)
+        statements = checker.collect_statements(self.user_id, tickers)
+        self.assertGreater(len(statements), 10)
+
+        with portfolio_app.engine.connect() as conn:
+            tables_in_db = {row[0] for row in conn.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )}
+            for name, statement, parameters in statements:
+                plan = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+                self.assertEqual(checker.full_scans(plan, tables_in_db), [],
+                                 f'{name}: {" ".join(statement.split())}\n' + '\n'.join(row[-1] for row in plan))
+
+
+if __name__ == '__main__':
+    unittest.main()
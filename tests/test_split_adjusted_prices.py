@@ -0,0 +1,68 @@
+"""
+Множители сплитов истории цен (SplitAdjustedPrices) против индекса сплитов
+"""
+import random
+import unittest
+from datetime import datetime, timedelta
+
+import app as portfolio_app
+from models.portfolio import InstrumentType
+from models.price_history import PriceHistory
+from models.split_coefficient import SplitCoefficient
+from tests.support import ApiTestCase, TICKERS, db_session
+
+
+class SplitAdjustedPricesTest(ApiTestCase):
+
+    def _add_prices(self, rnd, ticker, days):
+        for day in days:
+            db_session.add(PriceHistory(
+                ticker=ticker, company_name=ticker, price=rnd.uniform(10, 1000),
+                instrument_type=InstrumentType.STOCK,
+                logged_at=day + timedelta(hours=rnd.choice([0, 12, 23])),
+            ))
+        db_session.commit()
+
+    def _assert_factors_match_index(self, step):
+        db_session.expire_all()
+        index = portfolio_app._get_split_index(self.user_id)
+        stored = portfolio_app.split_adjusted_prices.factors(self.user_id)
+        for row in db_session.query(PriceHistory):
+            expected = index.price_factor(row.ticker, row.logged_at)
+            self.assertEqual(stored.get(row.id, 1.0), expected, f'{step}: {row.ticker} {row.logged_at}')
+
+    def test_factors_follow_split_changes(self):
+        rnd = random.Random(7)
+        start = datetime(2024, 1, 1)
+        for ticker in TICKERS:
+            self.api('post', '/api/transactions', json={
+                'ticker': ticker, 'operation_type': 'Покупка', 'price': 100, 'quantity': 10,
+                'date': '2023-12-01', 'instrument_type': 'STOCK',
+            })
+            self._add_prices(rnd, ticker, [start + timedelta(days=d) for d in range(0, 120, 3)])
+
+        for step in range(25):
+            split_ids = [row.id for row in db_session.query(SplitCoefficient.id).filter(
+                SplitCoefficient.user_id == self.user_id)]
+            if split_ids and rnd.random() < 0.3:
+                self.api('delete', f'/api/split-coefficients/{rnd.choice(split_ids)}')
+            elif rnd.random() < 0.2:
+                # Новые цены после сплитов: пересчёт только затронутых тикеров
+                day = start + timedelta(days=rnd.randrange(120))
+                self._add_prices(rnd, rnd.choice(TICKERS), [day])
+                portfolio_app.split_adjusted_prices.on_prices_written(day.date())
+            else:
+                self.api('post', '/api/split-coefficients', json={
+                    'ticker': rnd.choice(TICKERS),
+                    'effective_date': (start + timedelta(days=rnd.randrange(120))).strftime('%Y-%m-%d'),
+                    'coefficient': rnd.choice([0.1, 0.5, 2, 10]),
+                })
+            self._assert_factors_match_index(f'step {step}')
+
+        incremental = portfolio_app.split_adjusted_prices.factors(self.user_id)
+        portfolio_app.split_adjusted_prices.rebuild_all()
+        self.assertEqual(incremental, portfolio_app.split_adjusted_prices.factors(self.user_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+"""
+SplitFactorIndex против прямого перебора коэффициентов (как считалось до индекса)
+и кэш индекса по пользователю
+"""
+import random
+import unittest
+from datetime import date, datetime, timedelta
+
+import app as portfolio_app
+from models.split_coefficient import SplitCoefficient
+from services.split_index import SplitFactorIndex
+from tests.support import ApiTestCase, db_session
+
+
+def _factor_until(rows, ticker, target):
+    """Произведение коэффициентов тикера с датой <= target (в порядке дат)"""
+    factor = 1.0
+    for row_ticker, eff_date, coeff in sorted(rows, key=lambda r: r[1]):
+        if row_ticker.upper() == ticker.upper() and coeff > 0 and eff_date <= target:
+            factor *= coeff
+    return factor if factor > 0 else 1.0
+
+
+def _price_factor(rows, ticker, price_date):
+    """Произведение коэффициентов тикера с датой >= даты цены (от последней даты к первой)"""
+    factor = 1.0
+    for row_ticker, eff_date, coeff in reversed(sorted(rows, key=lambda r: r[1])):
+        if row_ticker.upper() == ticker.upper() and coeff > 0 and eff_date >= price_date:
+            factor *= coeff
+    return factor if factor > 0 else 1.0
+
+
+class SplitFactorIndexTest(unittest.TestCase):
+
+    def test_matches_linear_scan(self):
+        for seed in range(20):
+            rnd = random.Random(seed)
+            start = date(2020, 1, 1)
+            rows = [
+                (rnd.choice(['SBER', 'gazp', 'VTBR']), start + timedelta(days=rnd.randrange(1500)),
+                 rnd.choice([0.1, 0.5, 2.0, 10.0, 1 / 3, 0.0, -1.0]))
+                for _ in range(rnd.randrange(0, 12))
+            ]
+            index = SplitFactorIndex(rows)
+            for _ in range(200):
+                ticker = rnd.choice(['SBER', 'GAZP', 'vtbr', 'LKOH'])
+                day = start + timedelta(days=rnd.randrange(-30, 1530))
+                # Точное равенство: индекс перемножает в том же порядке, что и перебор
+                # (factor_until — по возрастанию дат, price_factor — по убыванию)
+                self.assertEqual(index.factor_until(ticker, day), _factor_until(rows, ticker, day))
+                self.assertEqual(index.price_factor(ticker, day), _price_factor(rows, ticker, day))
+                self.assertEqual(
+                    index.price_factor(ticker, datetime.combine(day, datetime.min.time())),
+                    _price_factor(rows, ticker, day),
+                )
+
+    def test_split_day_boundaries(self):
+        index = SplitFactorIndex([('SBER', '2024-07-01', 0.1)])
+        # Цена в день сплита ещё в старой шкале, количество на этот день — уже в новой
+        self.assertEqual(index.price_factor('SBER', date(2024, 7, 1)), 0.1)
+        self.assertEqual(index.price_factor('SBER', date(2024, 7, 2)), 1.0)
+        self.assertEqual(index.factor_until('SBER', date(2024, 6, 30)), 1.0)
+        self.assertEqual(index.factor_until('SBER', date(2024, 7, 1)), 0.1)
+
+    def test_empty_and_invalid_rows(self):
+        index = SplitFactorIndex([('SBER', 'not a date', 10.0), ('SBER', None, 10.0), ('GAZP', '2024-01-01', -2.0)])
+        self.assertFalse(index)
+        self.assertNotIn('SBER', index)
+        self.assertEqual(index.factor_until('SBER', date(2030, 1, 1)), 1.0)
+        self.assertEqual(index.price_factor('GAZP', None), 1.0)
+        # Нулевой коэффициент считается единичным
+        self.assertEqual(SplitFactorIndex([('GAZP', '2024-01-01', 0)]).factor_until('GAZP', date(2025, 1, 1)), 1.0)
+
+
+class SplitIndexCacheTest(ApiTestCase):
+
+    def test_sees_changes_from_other_writers(self):
+        self.assertNotIn('SBER', portfolio_app._get_split_index(self.user_id))
+        # Запись в обход эндпоинтов (другой воркер): кэш замечает её по отпечатку
+        db_session.add(SplitCoefficient(
+            user_id=self.user_id, ticker='SBER', effective_date=date(2024, 7, 1), coefficient=0.1,
+        ))
+        db_session.commit()
+        self.assertEqual(portfolio_app._get_split_index(self.user_id).factor_until('SBER', date(2024, 8, 1)), 0.1)
+
+    def test_endpoint_changes_apply_immediately(self):
+        split = self.api('post', '/api/split-coefficients', json={
+            'ticker': 'SBER', 'effective_date': '2024-07-01', 'coefficient': 0.1,
+        })
+        self.assertEqual(portfolio_app._get_split_index(self.user_id).price_factor('SBER', date(2024, 6, 1)), 0.1)
+        self.api('delete', f"/api/split-coefficients/{split['item']['id']}")
+        self.assertNotIn('SBER', portfolio_app._get_split_index(self.user_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
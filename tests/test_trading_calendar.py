@@ -0,0 +1,66 @@
+"""
+Календарь торгов: загрузка из ISS сохраняется в БД и видна другим процессам
+"""
+import unittest
+from datetime import date, timedelta
+
+import app as portfolio_app  # noqa: F401  (создаёт схему временной базы)
+from models.trading_day import TradingDay
+from services.trading_calendar import TradingCalendar
+from tests.support import db_session
+
+
+class _FakeMOEX:
+    """Календарь ISS: выходные неторговые, calls — число запросов"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_trading_calendar(self, date_from, date_to):
+        self.calls += 1
+        day, end, days = date.fromisoformat(date_from), date.fromisoformat(date_to), {}
+        while day <= end:
+            days[day.isoformat()] = day.weekday() < 5
+            day += timedelta(days=1)
+        return days
+
+
+class TradingCalendarTest(unittest.TestCase):
+
+    def setUp(self):
+        db_session.query(TradingDay).delete()
+        db_session.commit()
+
+    def test_other_process_reads_saved_calendar(self):
+        leader_moex, worker_moex = _FakeMOEX(), _FakeMOEX()
+        leader, worker = TradingCalendar(leader_moex), TradingCalendar(worker_moex)
+        self.assertFalse(worker.get_status()['loaded'])
+
+        self.assertTrue(leader.refresh())
+        status = worker.get_status()
+        self.assertTrue(status['loaded'])
+        self.assertEqual(status['closed_days'], leader.get_status()['closed_days'])
+        saturday = date.fromisoformat(status['range_from'])
+        while saturday.weekday() != 5:
+            saturday += timedelta(days=1)
+        self.assertFalse(worker.is_trading_day(saturday))
+        self.assertTrue(worker.is_trading_day(saturday + timedelta(days=2)))
+        self.assertEqual(worker_moex.calls, 0)
+
+    def test_restart_does_not_refetch_fresh_calendar(self):
+        TradingCalendar(_FakeMOEX()).refresh()
+        restarted_moex = _FakeMOEX()
+        self.assertTrue(TradingCalendar(restarted_moex).refresh_if_stale())
+        self.assertEqual(restarted_moex.calls, 0)
+
+    def test_refresh_replaces_saved_calendar(self):
+        calendar = TradingCalendar(_FakeMOEX())
+        calendar.refresh()
+        calendar.refresh()
+        status = calendar.get_status()
+        days = (date.fromisoformat(status['range_to']) - date.fromisoformat(status['range_from'])).days + 1
+        self.assertEqual(db_session.query(TradingDay).count(), days)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+Массовый импорт транзакций (TransactionImporter и /api/transactions/import)
+"""
+import io
+import random
+import unittest
+
+import app as portfolio_app
+from models.transaction import Transaction, TransactionType
+from services.transaction_importer import TransactionImporter
+from tests.support import ApiTestCase, db_session, random_transaction
+
+BROKER_CSV = (
+    'Дата сделки;Тикер;Вид сделки;Цена;Кол-во;Комментарий\n'
+    '15.01.2024 10:30;sber;Купля;250,5;10;первая\n'
+    '16.01.2024;GAZP;Покупка;160;abc;\n'
+    '17.01.2024;SBER;П;260;4;\n'
+    '18.01.2024;;Покупка;100;1;\n'
+)
+
+
+class TransactionImporterTest(unittest.TestCase):
+
+    def test_broker_csv_with_russian_columns(self):
+        importer = TransactionImporter()
+        rows = list(importer.iter_file(io.BytesIO(('\ufeff' + BROKER_CSV).encode('utf-8')), 'report.csv'))
+        self.assertEqual([number for number, _ in rows], [2, 3, 4, 5])
+
+        item = importer.validate_row(rows[0][1])
+        self.assertEqual(item['ticker'], 'SBER')
+        self.assertEqual(item['operation_type'], TransactionType.BUY)
+        self.assertEqual((item['price'], item['quantity'], item['total']), (250.5, 10.0, 2505.0))
+        self.assertEqual(item['date'].strftime('%Y-%m-%d %H:%M'), '2024-01-15 10:30')
+        self.assertEqual(importer.validate_row(rows[2][1])['operation_type'], TransactionType.SELL)
+
+    def test_errors_are_reported_by_row_number(self):
+        report = TransactionImporter().import_rows(1, TransactionImporter().iter_csv(io.StringIO(BROKER_CSV)),
+                                                   dry_run=True)
+        self.assertEqual(report['valid'], 2)
+        self.assertEqual([error['row'] for error in report['errors']], [3, 5])
+        self.assertIn('числами', report['errors'][0]['error'])
+        self.assertIn('ticker', report['errors'][1]['error'])
+
+    def test_row_without_date_is_an_error(self):
+        rows = TransactionImporter.iter_json([
+            {'ticker': 'SBER', 'operation_type': 'buy', 'price': 100, 'quantity': 1},
+            {'ticker': 'SBER', 'operation_type': 'buy', 'price': 100, 'quantity': 1, 'date': ' '},
+        ])
+        report = TransactionImporter().import_rows(1, rows, dry_run=True)
+        self.assertEqual(report['valid'], 0)
+        self.assertEqual([error['error'] for error in report['errors']], ['нет обязательных полей: date'] * 2)
+
+    def test_json_array_and_object(self):
+        rows = [{'ticker': 'SBER'}, 'not a row']
+        self.assertEqual(list(TransactionImporter.iter_json(rows)), [(1, {'ticker': 'SBER'}), (2, {})])
+        self.assertEqual(list(TransactionImporter.iter_json({'transactions': rows[:1]})), [(1, {'ticker': 'SBER'})])
+        with self.assertRaises(ValueError):
+            list(TransactionImporter.iter_json('SBER'))
+
+
+class ImportEndpointTest(ApiTestCase):
+
+    def _transactions(self):
+        db_session.expire_all()
+        return db_session.query(Transaction).filter(Transaction.user_id == self.user_id).order_by(Transaction.date).all()
+
+    def test_file_upload_imports_valid_rows(self):
+        report = self.api('post', '/api/transactions/import', data={
+            'file': (io.BytesIO(BROKER_CSV.encode('utf-8')), 'report.csv'),
+        }, content_type='multipart/form-data')
+        self.assertEqual((report['imported'], len(report['errors'])), (2, 2))
+        self.assertEqual([(t.ticker, t.quantity) for t in self._transactions()], [('SBER', 10.0), ('SBER', 4.0)])
+        self.assertAlmostEqual(self.portfolio_quantities()['SBER'], 6.0)
+
+    def test_dry_run_writes_nothing(self):
+        report = self.api('post', '/api/transactions/import?dry_run=1', json={'transactions': [
+            {'ticker': 'SBER', 'operation_type': 'buy', 'price': 100, 'quantity': 1, 'date': '2024-01-01'},
+        ]})
+        self.assertEqual((report['valid'], report['imported']), (1, 0))
+        self.assertEqual(self._transactions(), [])
+
+    def test_csv_body(self):
+        body = 'ticker,operation_type,price,quantity,date\nLKOH,buy,7000,2,2024-02-01\n'
+        report = self.api('post', '/api/transactions/import', data=body, content_type='text/csv')
+        self.assertEqual(report['imported'], 1)
+        self.assertEqual(portfolio_app.lot_ledger.get_positions(self.user_id)['LKOH']['quantity'], 2.0)
+
+    def _with_batch_size(self, size):
+        importer = portfolio_app.transaction_importer
+        self.addCleanup(setattr, importer, 'BATCH_SIZE', importer.BATCH_SIZE)
+        importer.BATCH_SIZE = size
+
+    def test_import_in_batches(self):
+        self._with_batch_size(2)
+        rows = [random_transaction(random.Random(100)) for _ in range(7)]
+        report = self.api('post', '/api/transactions/import', json={'transactions': rows})
+        self.assertEqual(report['imported'], 7)
+        self.assertEqual(len(self._transactions()), 7)
+
+        lots = portfolio_app.lot_ledger.get_positions(self.user_id)
+        balance = portfolio_app.cash_ledger.verify(self.user_id)
+        portfolio_app.lot_ledger.rebuild_all(user_id=self.user_id)
+        self.assertEqual(lots, portfolio_app.lot_ledger.get_positions(self.user_id))
+        self.assertEqual(balance, [])
+
+    def test_malformed_csv_rolls_back_inserted_batches(self):
+        self._with_batch_size(2)
+        good = ''.join(f'SBER,buy,100,1,2024-01-0{day}\n' for day in range(1, 6))
+        body = 'ticker,operation_type,price,quantity,date\n' + good + 'SBER,buy,100,1,"' + 'x' * 200000 + '"\n'
+        response = self.client.post('/api/transactions/import', data=body, content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('строка 7', response.get_json()['error'])
+        self.assertEqual(self._transactions(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()